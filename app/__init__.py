@@ -20,6 +20,14 @@ def create_app():
         from app.models.models import User
         return User.query.get(int(user_id))
 
+    # Per-request query counts and N+1 warnings (QUERY_STATS_ENABLED or debug mode)
+    from app.services.query_stats import init_query_stats
+    init_query_stats(app)
+
+    # Reads in @read_replica views go to the replica; nothing after the view does
+    from app.services.read_replica import end_replica_reads
+    app.after_request(end_replica_reads)
+
     @app.before_request
     def require_login():
         public_routes = ['admin.login', 'static', 'public_bp.signup']
@@ -34,6 +42,7 @@ def create_app():
     from app.routes.routes import public_bp
     from app.routes.user_routes import user_bp
     from app.routes.research_routes import research_bp
+    from app.routes.search_routes import search_bp
 
     app.register_blueprint(chat_bp)
     app.register_blueprint(admin_blueprint, url_prefix='/admin')
@@ -42,6 +51,15 @@ def create_app():
     app.register_blueprint(public_bp)
     app.register_blueprint(user_bp)
     app.register_blueprint(research_bp)
+    app.register_blueprint(search_bp)
+
+    # Server-side session store (creates its table for the sqlalchemy backend)
+    from app.services.session_store import init_session_store
+    init_session_store(app)
+
+    # Register maintenance commands (flask <command>)
+    from app.cli import register_commands
+    register_commands(app)
 
     # Initialize database tables
     with app.app_context():
@@ -59,6 +77,14 @@ def create_app():
                 tables_created = True
             else:
                 print(f"Database already has {len(existing_tables)} tables, skipping creation")
+                # Tables added after the initial deploy still need creating
+                missing_tables = [
+                    table for name, table in db.metadata.tables.items()
+                    if name not in existing_tables
+                ]
+                if missing_tables:
+                    print(f"Creating {len(missing_tables)} missing tables...")
+                    db.metadata.create_all(bind=db.engine, tables=missing_tables)
                 tables_created = True
                 
         except Exception as e:
@@ -96,4 +122,20 @@ def create_app():
             if not tables_created:
                 raise Exception("Database initialization failed - tables not created")
 
+    # Schema changes to existing tables (indexes, columns)
+    if app.config.get('RUN_MIGRATIONS_ON_STARTUP', True):
+        from app.migrations import run_migrations
+        try:
+            with app.app_context():
+                run_migrations()
+        except Exception as e:
+            print(f"Schema migrations failed: {e}")
+
+    # Full-text search index (FTS5 on SQLite, tsvector on Postgres)
+    from app.services.search_service import init_search_index
+    try:
+        init_search_index(app)
+    except Exception as e:
+        print(f"Search index initialization failed: {e}")
+
     return app
\ No newline at end of file
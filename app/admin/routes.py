@@ -1,4 +1,4 @@
-from flask import render_template, redirect, url_for, flash, request
+from flask import render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_user, login_required, logout_user, current_user
 from . import admin
 from app.models.models import User, LoginRecord, Project, ChatSession, Document
@@ -9,6 +9,10 @@ from app import db  # Import db from app package instead of __init__
 from datetime import datetime, timedelta
 import pytz
 from sqlalchemy import func
+from app.services.read_replica import read_replica
+from app.services.activity_rollup_service import get_daily_activity, record_daily_activity
+from app.services.login_report_service import get_login_summaries
+from app.services.query_stats import query_report, reset_query_report
 
 # set local timezone  - eventually this could be from user table
 edt_tz = pytz.timezone('US/Eastern')
@@ -30,6 +34,7 @@ def login():
             # Record login
             login_record = LoginRecord(user_id=user.id, login_time=datetime.utcnow())
             db.session.add(login_record)
+            record_daily_activity(user.organization_id, logins=1)
             db.session.commit()
             next_page = request.args.get('next')
             return redirect(next_page or url_for('chat_bp.index_page'))
@@ -57,65 +62,34 @@ def logout():
 @admin.route('/dashboard')
 @login_required
 @admin_required
+@read_replica
 def dashboard():
-    total_users = User.query.count()
-    admin_users = User.query.filter_by(role='admin').count()
-    regular_users = User.query.filter_by(role='user').count()
-
-    # Chat sessions per day for last 14 days
-    today = datetime.utcnow().date()
-    start_date = today - timedelta(days=13)
-    chat_activity = (
-        db.session.query(
-            func.date(ChatSession.created_at).label('date'),
-            func.count(ChatSession.id).label('count')
-        )
-        .filter(ChatSession.created_at >= start_date)
-        .group_by(func.date(ChatSession.created_at))
-        .order_by(func.date(ChatSession.created_at))
-        .all()
-    )
-    # Fill in missing days with 0
-    activity_dict = {row.date: row.count for row in chat_activity}
-    chat_activity_list = []
-    for i in range(14):
-        day = start_date + timedelta(days=i)
-        chat_activity_list.append({
-            'date': day.strftime('%Y-%m-%d'),
-            'count': activity_dict.get(day, 0)
-        })
-
-    # Latest 10 user logins
-    latest_logins = (
-        db.session.query(LoginRecord, User)
+    users_by_role = dict(db.session.query(User.role, func.count(User.id)).group_by(User.role).all())
+    total_users = sum(users_by_role.values())
+    admin_users = users_by_role.get('admin', 0)
+    regular_users = users_by_role.get('user', 0)
+
+    # Daily totals for the last 14 days, read from the rollups (see `flask rollup-activity`)
+    chat_activity_list = [dict(day, count=day['sessions']) for day in get_daily_activity(14)]
+    activity_totals = {
+        name: sum(day[name] for day in chat_activity_list)
+        for name in ('sessions', 'messages', 'logins', 'uploads', 'tokens')
+    }
+
+    # Latest 10 user logins and uploads (newest ids first, so the primary keys serve both)
+    login_table = [
+        {'username': row.username, 'login_time': row.login_time}
+        for row in db.session.query(User.username, LoginRecord.login_time)
         .join(User, LoginRecord.user_id == User.id)
-        .order_by(LoginRecord.login_time.desc())
+        .order_by(LoginRecord.id.desc())
         .limit(10)
-        .all()
-    )
-    login_table = [
-        {
-            'username': user.username,
-            'login_time': login.login_time
-        }
-        for login, user in latest_logins
     ]
-
-    # Latest 10 file uploads
-    latest_uploads = (
-        db.session.query(Document, User)
+    upload_table = [
+        {'username': row.username, 'filename': row.filename, 'created_at': row.created_at}
+        for row in db.session.query(User.username, Document.filename, Document.created_at)
         .join(User, Document.user_id == User.id)
-        .order_by(Document.created_at.desc())
+        .order_by(Document.id.desc())
         .limit(10)
-        .all()
-    )
-    upload_table = [
-        {
-            'username': user.username,
-            'filename': doc.filename,
-            'created_at': doc.created_at
-        }
-        for doc, user in latest_uploads
     ]
 
     return render_template('admin/dashboard.html',
@@ -123,6 +97,7 @@ def dashboard():
                            admin_users=admin_users,
                            regular_users=regular_users,
                            chat_activity=chat_activity_list,
+                           activity_totals=activity_totals,
                            login_table=login_table,
                            upload_table=upload_table)
 
@@ -230,21 +205,28 @@ def delete_user(user_id):
 @admin.route('/logins')
 @login_required
 @admin_required
+@read_replica
 def login_records():
-    # Get all users and their login records
-    users = User.query.all()
-    user_logins = []
-    for user in users:
-        login_records = LoginRecord.query.filter_by(user_id=user.id).order_by(LoginRecord.login_time.desc()).all()
-        total_logins = len(login_records)
-        most_recent_login = login_records[0].login_time if login_records else None
-        user_logins.append({
-            'username': user.username,
-            'total_logins': total_logins,
-            'most_recent_login': most_recent_login
-        })
-
-    return render_template('admin/logins.html', user_logins=user_logins)
+    # One page of users; their counts and latest logins come from a single query
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config.get('LOGIN_RECORDS_PAGE_SIZE', 50)
+    user_logins, total_users = get_login_summaries(page, per_page, current_app.config.get('LOGIN_RECORDS_RECENT', 3))
+    pages = max((total_users + per_page - 1) // per_page, 1)
+
+    return render_template('admin/logins.html', user_logins=user_logins, page=page, pages=pages, total_users=total_users)
+
+@admin.route('/query-stats', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def query_stats():
+    # Per-endpoint SQL counts collected by app.services.query_stats (this worker only)
+    if request.method == 'POST':
+        reset_query_report()
+        flash('Query statistics cleared.', 'success')
+        return redirect(url_for('admin.query_stats'))
+    enabled = current_app.config.get('QUERY_STATS_ENABLED') or current_app.debug
+    return render_template('admin/query_stats.html', endpoints=query_report(), enabled=enabled,
+                           repeat_threshold=current_app.config.get('QUERY_STATS_REPEAT_THRESHOLD', 5))
 
 @admin.app_template_filter('utc_to_edt')
 def utc_to_edt(utc_dt):
@@ -0,0 +1,150 @@
+import click
+from sqlalchemy import func, or_, select
+from app.extensions import db
+
+
+def register_commands(app):
+    """Register maintenance commands with the Flask CLI"""
+
+    @app.cli.command('backfill-chat-messages')
+    @click.option('--batch-size', default=200, help='Chat sessions to process per commit')
+    def backfill_chat_messages(batch_size):
+        """Create ChatMessage rows for history stored before per-message rows existed"""
+        from app.models.models import ChatSession, ChatMessage
+
+        # Sessions with fewer rows than messages, including ones that got rows only for turns sent since
+        row_count = select(func.count(ChatMessage.id)).where(
+            ChatMessage.chat_session_id == ChatSession.id
+        ).correlate(ChatSession).scalar_subquery()
+        last_id = 0
+        total_messages = 0
+        while True:
+            sessions = ChatSession.query.filter(
+                ChatSession.id > last_id,
+                or_(ChatSession.message_count.is_(None), ChatSession.message_count > row_count)
+            ).order_by(ChatSession.id).limit(batch_size).all()
+            if not sessions:
+                break
+
+            for chat_session in sessions:
+                try:
+                    total_messages += chat_session.sync_messages()
+                except Exception as e:
+                    print(f"Skipping session {chat_session.id}: {e}")
+                    continue
+
+            last_id = sessions[-1].id
+            db.session.commit()
+            print(f"Backfilled sessions up to id {last_id} ({total_messages} messages)")
+
+        print(f"Done. {total_messages} messages created.")
+
+    @app.cli.command('rebuild-search-index')
+    @click.option('--batch-size', default=500, help='Rows to index per transaction')
+    def rebuild_search_index_command(batch_size):
+        """Re-index all chat messages and research sessions for full-text search"""
+        from app.services.search_service import rebuild_search_index
+
+        total = rebuild_search_index(batch_size=batch_size)
+        print(f"Done. {total} rows indexed.")
+
+    @app.cli.command('refresh-user-memories')
+    @click.option('--mode', type=click.Choice(['online', 'batch']), default='online',
+                  help='online: summarize now; batch: collect finished batches and submit a new one')
+    @click.option('--workers', type=int, default=None, help='Concurrent summarization calls (online mode)')
+    @click.option('--rpm', type=int, default=None, help='Requests per minute budget (online mode)')
+    @click.option('--limit', type=int, default=None, help='Maximum users to process this run')
+    def refresh_user_memories_command(mode, workers, rpm, limit):
+        """Refresh UserChatMemory for every user with new chat activity (run from cron)"""
+        from app.services.chat_memory_service import (
+            refresh_user_memories, submit_user_memory_batch, collect_user_memory_batches
+        )
+
+        if mode == 'online':
+            results = refresh_user_memories(max_workers=workers, requests_per_minute=rpm, limit=limit)
+            print(f"Done. {results}")
+        else:
+            applied = collect_user_memory_batches()
+            print(f"Applied {applied} user memories from finished batches")
+            batch = submit_user_memory_batch(limit=limit)
+            if batch:
+                print(f"Submitted batch {batch.batch_id} with {batch.request_count} requests")
+            else:
+                print("No users need a memory refresh")
+
+    @app.cli.command('fill-assistant-thread-pool')
+    def fill_assistant_thread_pool_command():
+        """Pre-create Assistants API threads so new chat sessions don't wait on one"""
+        from app.services.assistant_thread_service import fill_thread_pool
+
+        created = fill_thread_pool()
+        print(f"Done. Created {created} threads.")
+
+    @app.cli.command('db-migrate')
+    def db_migrate_command():
+        """Apply pending schema migrations (app/migrations)"""
+        from app.migrations import run_migrations
+
+        applied = run_migrations()
+        print(f"Done. Applied {len(applied)} migrations{': ' + ', '.join(map(str, applied)) if applied else ''}.")
+
+    @app.cli.command('db-migrations')
+    def db_migrations_command():
+        """List schema migrations and whether each is applied"""
+        from app.migrations import MIGRATIONS, pending_migrations
+
+        pending = {m.VERSION for m in pending_migrations()}
+        for migration in MIGRATIONS:
+            state = 'pending' if migration.VERSION in pending else 'applied'
+            print(f"{migration.VERSION:04d} {migration.NAME:<40} {state}")
+
+    @app.cli.command('check-query-plans')
+    @click.option('--verbose', is_flag=True, help='Print every plan, not just failing ones')
+    def check_query_plans_command(verbose):
+        """EXPLAIN the hot queries and fail if any of them is not served by an index"""
+        from app.migrations.query_plans import check_query_plans
+
+        failed = 0
+        for result in check_query_plans():
+            status = 'FAIL' if result['problems'] else 'ok'
+            note = '' if result['used_expected_index'] else f" (not using {result['expected_index']})"
+            print(f"[{status}] {result['name']}{note}")
+            for problem in result['problems']:
+                print(f"    {problem}")
+            if verbose or result['problems']:
+                for line in result['plan']:
+                    print(f"      | {line}")
+            failed += bool(result['problems'])
+        if failed:
+            raise SystemExit(f"{failed} hot queries are not served by an index")
+        print("All hot queries use an index.")
+
+    @app.cli.command('read-replica-status')
+    def read_replica_status_command():
+        """Compare row counts on the primary and the read replica (DATABASE_REPLICA_URL)"""
+        from sqlalchemy import func, select
+        from app.models.models import ChatSession, ChatMessage, Document, ResearchSession, LoginRecord
+        from app.services.read_replica import REPLICA_BIND
+
+        if REPLICA_BIND not in db.engines:
+            raise SystemExit("No read replica configured (set DATABASE_REPLICA_URL)")
+        print(f"Primary: {db.engine.url.render_as_string(hide_password=True)}")
+        print(f"Replica: {db.engines[REPLICA_BIND].url.render_as_string(hide_password=True)}")
+        behind = 0
+        for model in (ChatSession, ChatMessage, Document, ResearchSession, LoginRecord):
+            counts = []
+            for engine in (db.engine, db.engines[REPLICA_BIND]):
+                with engine.connect() as conn:
+                    counts.append(conn.execute(select(func.count()).select_from(model.__table__)).scalar())
+            behind += counts[0] != counts[1]
+            print(f"  {model.__tablename__}: primary {counts[0]}, replica {counts[1]}")
+        print("Replica is behind or diverged." if behind else "Replica matches the primary.")
+
+    @app.cli.command('rollup-activity')
+    @click.option('--days', default=2, help='Days to recompute, today included (use 14+ to backfill)')
+    def rollup_activity_command(days):
+        """Recompute the admin dashboard's daily activity rollups from the source tables"""
+        from app.services.activity_rollup_service import rollup_daily_activity
+
+        rows = rollup_daily_activity(days)
+        print(f"Rebuilt {rows} daily activity rows for the last {days} days")
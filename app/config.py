@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,6 +9,18 @@ class Config:
     SECRET_KEY = os.getenv('FLASK_SECRET_KEY', 'your_secret_key')
     WTF_CSRF_ENABLED = True
 
+    # Sessions are kept server-side; the cookie only holds a random session id
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlalchemy')  # sqlalchemy, filesystem, redis or cookie
+    SESSION_SQLALCHEMY_TABLE = 'nomadchat_sessions'
+    SESSION_FILE_DIR = os.getenv('SESSION_FILE_DIR')  # filesystem backend; defaults to the temp dir
+    SESSION_FILE_THRESHOLD = 10000  # filesystem backend: expired, then oldest, files are pruned beyond this
+    SESSION_REDIS_URL = os.getenv('SESSION_REDIS_URL')  # redis backend, e.g. redis://localhost:6379/0
+    SESSION_KEY_PREFIX = 'nomadchat:session:'
+    SESSION_SERIALIZATION_FORMAT = 'msgpack'
+    PERMANENT_SESSION_LIFETIME = timedelta(days=int(os.getenv('SESSION_LIFETIME_DAYS', 7)))  # Store TTL and cookie expiry
+    SESSION_REFRESH_EACH_REQUEST = False  # Write the store only when the session changes
+    SESSION_CLEANUP_N_REQUESTS = 1000  # sqlalchemy backend: purge expired rows about once per this many requests
+
     # Upload settings
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB limit
@@ -18,10 +31,37 @@ class Config:
     if SQLALCHEMY_DATABASE_URI.startswith("postgres://"):
         SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace("postgres://", "postgresql://", 1)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool per worker process. Chat and upload streams hand their connection back
+    # before calling the LLM, so the pool only has to cover queries, not open streams.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',  # Drop dead connections on checkout
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE_SECONDS', 1800)),  # Reconnect before server-side idle timeouts
+    }
+    if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        SQLALCHEMY_ENGINE_OPTIONS.update({
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT_SECONDS', 10)),  # Fail fast rather than queue for 30s
+        })
+    # Optional read replica for read-only views (@read_replica); writes always go to the primary.
+    # To try it locally point this at a second SQLite file (a copy of the primary) or a local Postgres replica.
+    DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+    if DATABASE_REPLICA_URL and DATABASE_REPLICA_URL.startswith("postgres://"):
+        DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace("postgres://", "postgresql://", 1)
+    SQLALCHEMY_BINDS = {'replica': DATABASE_REPLICA_URL} if DATABASE_REPLICA_URL else {}
+    READ_REPLICA_AFTER_WRITE_SECONDS = 10  # A user's reads stay on the primary this long after they write
+    RUN_MIGRATIONS_ON_STARTUP = os.getenv('RUN_MIGRATIONS_ON_STARTUP', 'true').lower() == 'true'  # Else run `flask db-migrate`
 
     # API keys
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     CLAUDE_API_KEY = os.environ.get('CLAUDE_API_KEY')
+    GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+
+    # Provider endpoints; unset means the public APIs. Point these at scripts/mock_llm_server.py
+    # for offline load tests.
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # e.g. http://127.0.0.1:8765/v1
+    ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL')  # e.g. http://127.0.0.1:8765
+    PERPLEXITY_BASE_URL = os.getenv('PERPLEXITY_BASE_URL')  # e.g. http://127.0.0.1:8765
     OPENAI_ASSISTANT_ID = os.getenv('OPENAI_ASSISTANT_ID')
     print("Loaded OPENAI_ASSISTANT_ID:", OPENAI_ASSISTANT_ID)
 
@@ -38,15 +78,102 @@ class Config:
     CLAUDE_MAX_TOKENS = 16384
     GEMINI_MODEL = "gemini-1"
     GEMINI_MAX_TOKENS = 2048
+    GEMINI_CHAT_MODEL = "gemini-1.5-pro"
 
     CLAUDE_CHAT_MODEL = "claude-3-7-sonnet-20250219"
     CLAUDE_CHAT_MAX_TOKENS = 16384
 
+    # Chat provider routing (providers without an API key are skipped)
+    CHAT_PROVIDERS = os.getenv('CHAT_PROVIDERS', 'openai,anthropic,gemini').split(',')  # Preference order
+    PROVIDER_HEDGING_ENABLED = os.getenv('PROVIDER_HEDGING_ENABLED', 'false').lower() == 'true'  # Opt-in: fire a backup request (billed too) when the first token is late
+    PROVIDER_HEDGE_PERCENTILE = 95  # "Late" means slower than this percentile of recent first-token times
+    PROVIDER_HEDGE_MIN_SECONDS = 2.0
+    PROVIDER_HEDGE_MAX_SECONDS = 10.0  # Also used until enough samples exist
+    PROVIDER_FIRST_TOKEN_TIMEOUT_SECONDS = 30  # Give up on a provider that hasn't started streaming
+    PROVIDER_STREAM_IDLE_TIMEOUT_SECONDS = 60  # Give up on a stream that stops mid-answer
+    PROVIDER_CIRCUIT_FAILURES = 3  # Consecutive failures before a provider is skipped
+    PROVIDER_CIRCUIT_OPEN_SECONDS = 30  # How long it is skipped before a trial request
+
+    # Stopping a streaming answer (POST /api/chat/<session>/stop); the stop may land on another worker
+    CHAT_STOP_DIR = os.getenv('CHAT_STOP_DIR')  # Stop markers shared by workers; defaults to the temp dir
+    CHAT_STOP_POLL_SECONDS = 0.5  # How often a stream checks for a stop from another worker
+
+    # Chat list (/api/chats) and transcript (/api/chats/<session_id>) pages
+    CHAT_LIST_PAGE_SIZE = 50
+    CHAT_LIST_MAX_PAGE_SIZE = 200
+    CHAT_LIST_SEARCH_MAX_MATCHES = 500  # ?q= on /api/chats: message hits taken from the search index
+    CHAT_TRANSCRIPT_PAGE_SIZE = 50  # Newest messages sent when a chat is opened; older ones load on demand
+    CHAT_TRANSCRIPT_MAX_PAGE_SIZE = 200
+
+    # Prewarming when a chat is opened (/api/new_chat, /api/chats/<id>), ahead of the first message
+    PREWARM_ENABLED = True
+    PREWARM_CONTEXT_TTL_SECONDS = 120  # How long cached memory/background/project context is reused
+    PREWARM_CONNECTION_INTERVAL_SECONDS = 60  # Min gap between keep-alive requests to a provider
+
+    # Outbound rate limits, shared by all workers on the host (requests and tokens per minute).
+    # "<provider>:*" covers models without their own entry; tpm None means requests only.
+    RATE_LIMITS = {
+        'openai:*': {'rpm': 500, 'tpm': 200000},
+        'openai:assistants': {'rpm': 200, 'tpm': 200000},
+        'anthropic:*': {'rpm': 50, 'tpm': 40000},
+        'gemini:*': {'rpm': 60, 'tpm': 120000},
+        'perplexity:*': {'rpm': 50, 'tpm': None},
+    }
+    RATE_LIMIT_STATE_FILE = os.getenv('RATE_LIMIT_STATE_FILE')  # Defaults to a file in the temp dir
+    RATE_LIMIT_INTERACTIVE_WAIT_SECONDS = 5  # Longest a user-facing call queues for capacity
+    RATE_LIMIT_BACKGROUND_WAIT_SECONDS = 120  # Longest a memory/summary job queues for capacity
+    RATE_LIMIT_OUTPUT_TOKENS_ESTIMATE = 1000  # Expected completion size counted against tpm
+    RATE_LIMIT_INTERACTIVE_RESERVE = 0.2  # Share of each bucket background calls may not use
+
+    # Outbound LLM scheduling per process (interactive chat ahead of background and bulk jobs)
+    LLM_CONCURRENCY = {'interactive': 32, 'background': 4, 'bulk': 2}  # Concurrent calls per class
+    LLM_INTERACTIVE_TTFT_TARGET_SECONDS = 3.0  # Background work waits while chat p90 TTFT is above this
+    LLM_LATENCY_WINDOW_SECONDS = 60  # How far back TTFT samples count
+    LLM_BACKGROUND_MAX_DEFER_SECONDS = 120  # After this a deferred background call runs anyway
+    LLM_BULK_MAX_DEFER_SECONDS = 600
+    LLM_BULK_MAX_INTERACTIVE = 4  # Bulk calls wait while more chat streams than this are running
+    LLM_BACKGROUND_WORKERS = 2  # Threads running background jobs such as project memory refresh
+
+    # Admin dashboard: daily activity comes from rollups (`flask rollup-activity` from cron corrects drift)
+    DASHBOARD_CACHE_TTL_SECONDS = 60  # How long a worker reuses the 14-day activity it last read
+    LOGIN_RECORDS_PAGE_SIZE = 50  # Users per page on /admin/logins
+    LOGIN_RECORDS_RECENT = 3  # Latest logins listed per user
+
+    # Per-request SQL instrumentation: X-DB-* headers in debug mode, report at /admin/query-stats
+    QUERY_STATS_ENABLED = os.getenv('QUERY_STATS_ENABLED', 'false').lower() == 'true'  # Always on in debug mode
+    QUERY_STATS_REPEAT_THRESHOLD = 5  # One statement run this many times in a request is reported as N+1
+
+    # APILog usage rows are queued and written in bulk by a background thread
+    API_LOG_BATCH_SIZE = 200  # Rows per insert; a full batch is written right away
+    API_LOG_FLUSH_SECONDS = 2.0  # Longest a queued row waits before being written
+    API_LOG_MAX_QUEUE = 10000  # Oldest rows are dropped beyond this (database down)
+
+    # Assistants API settings
+    ASSISTANT_STREAMING = True  # Stream run events; polling with backoff is the fallback
+    ASSISTANT_RUN_TIMEOUT_SECONDS = 120  # Runs still going after this are cancelled
+    ASSISTANT_THREAD_POOL_SIZE = 5  # Pre-created threads kept ready for new chat sessions
+    ASSISTANT_THREAD_POOL_MAX_AGE_HOURS = 24  # Pooled threads older than this are not handed out
+
+    # User memory batch settings (flask refresh-user-memories)
+    USER_MEMORY_MAX_TOKENS = 512  # Summary length per call
+    USER_MEMORY_CHUNK_CHARS = 24000  # Larger inputs are summarized in chunks, then merged
+    USER_MEMORY_BATCH_WORKERS = 4  # Concurrent summarization calls
+    USER_MEMORY_BATCH_RPM = 60  # Requests per minute allowed across those workers
+
     # Project memory settings
     PROJECT_MEMORY_UPDATE_HOURS = 24  # How often to update long-term memory
     PROJECT_MEMORY_UPDATE_SESSIONS = 3  # How many sessions before updating memory
+    PROJECT_MEMORY_UPDATE_MESSAGES = 20  # How many new messages (any session) before updating memory
+    PROJECT_MEMORY_UPDATE_TOKENS = 4000  # How much new content (estimated tokens) before updating memory
+    MEMORY_LOCK_TTL_SECONDS = 300  # Lock-table entries not renewed for this long are treated as abandoned
+    MEMORY_LOCK_WAIT_SECONDS = 60  # How long a waiting caller blocks on an in-flight rebuild
     RECENT_CONTEXT_HOURS = 24  # How far back to look for recent context
     RECENT_CONTEXT_MAX_MESSAGES = 50  # Max messages to include in recent context
+    RECENT_CONTEXT_MESSAGE_CHARS = 500  # Per-message truncation (applied in SQL)
+
+    # Full-text search recall settings
+    SEARCH_RECALL_ENABLED = True  # Add matching past excerpts to the chat system prompt
+    SEARCH_RECALL_MAX_EXCERPTS = 5  # Max excerpts included per chat turn
 
     PROMO_CODES = ["FoundationAIconf", "BuildGoodAI"]
 
@@ -2,9 +2,10 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_session import Session
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
+from app.services.read_replica import RoutingSession
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 csrf = CSRFProtect()
 login_manager = LoginManager()
 flask_session = Session()
\ No newline at end of file
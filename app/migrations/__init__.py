@@ -0,0 +1,72 @@
+"""
+Versioned schema migrations.
+
+db.create_all() only creates missing tables, so changes to existing tables (new indexes,
+columns) go here as numbered modules. Each module defines VERSION, NAME and upgrade(conn);
+applied versions are recorded in nomadchat_schema_migrations. Modules that set
+TRANSACTIONAL = False get an autocommit connection, so Postgres can build indexes
+CONCURRENTLY without locking writes. Migrations must be idempotent: a fresh database
+already has everything the models declare.
+"""
+from datetime import datetime
+from sqlalchemy import text
+from app.extensions import db
+from app.migrations import (
+    m0001_hot_query_indexes, m0002_chat_list_metadata, m0003_chat_transcript_index,
+    m0004_login_record_user_time_index, m0005_drop_chat_message_session_index,
+)
+
+MIGRATIONS = [
+    m0001_hot_query_indexes,
+    m0002_chat_list_metadata,
+    m0003_chat_transcript_index,
+    m0004_login_record_user_time_index,
+    m0005_drop_chat_message_session_index,
+]
+
+# Serializes runners across workers starting at the same time (Postgres only)
+ADVISORY_LOCK_ID = 73310041
+
+
+def applied_versions(conn):
+    from app.models.models import SchemaMigration
+    SchemaMigration.__table__.create(bind=conn, checkfirst=True)
+    return {row.version for row in conn.execute(text(f"SELECT version FROM {SchemaMigration.__tablename__}"))}
+
+
+def pending_migrations():
+    with db.engine.begin() as conn:
+        applied = applied_versions(conn)
+    return [m for m in MIGRATIONS if m.VERSION not in applied]
+
+
+def run_migrations():
+    """Apply pending migrations in version order; returns the versions applied"""
+    from app.models.models import SchemaMigration
+    engine = db.engine
+    applied_now = []
+    with engine.connect() as lock_conn:
+        if engine.dialect.name == 'postgresql':
+            lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {'id': ADVISORY_LOCK_ID})
+        try:
+            with engine.begin() as conn:
+                applied = applied_versions(conn)
+            for migration in sorted(MIGRATIONS, key=lambda m: m.VERSION):
+                if migration.VERSION in applied:
+                    continue
+                print(f"[Migrations] Applying {migration.VERSION:04d} {migration.NAME}")
+                if getattr(migration, 'TRANSACTIONAL', True):
+                    with engine.begin() as conn:
+                        migration.upgrade(conn)
+                else:
+                    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                        migration.upgrade(conn)
+                with engine.begin() as conn:
+                    conn.execute(SchemaMigration.__table__.insert().values(
+                        version=migration.VERSION, name=migration.NAME, applied_at=datetime.utcnow()
+                    ))
+                applied_now.append(migration.VERSION)
+        finally:
+            if engine.dialect.name == 'postgresql':
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': ADVISORY_LOCK_ID})
+    return applied_now
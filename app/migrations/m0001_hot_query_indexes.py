@@ -0,0 +1,19 @@
+"""Composite indexes for the chat, document, research and usage hot queries"""
+from app.migrations.ops import create_index
+
+VERSION = 1
+NAME = 'hot_query_indexes'
+TRANSACTIONAL = False
+
+INDEXES = [
+    ('ix_chatsession_user_session_project', 'nomadchat_chatsession', ['user_id', 'session_id', 'project_id']),
+    ('ix_chatsession_user_project_pinned_updated', 'nomadchat_chatsession', ['user_id', 'project_id', 'pinned', 'updated_at']),
+    ('ix_documents_user_project_created', 'nomadchat_documents', ['user_id', 'project_id', 'created_at']),
+    ('ix_research_session_user_project_created', 'nomadchat_research_session', ['user_id', 'project_id', 'created_at']),
+    ('ix_api_log_user_timestamp', 'nomadchat_api_log', ['user_id', 'timestamp']),
+]
+
+
+def upgrade(conn):
+    for name, table, columns in INDEXES:
+        create_index(conn, name, table, columns)
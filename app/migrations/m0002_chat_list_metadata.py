@@ -0,0 +1,58 @@
+"""Stored preview, message count and last message time for the chat list, plus its keyset index"""
+import json
+from sqlalchemy import text
+from app.migrations.ops import add_column, create_index, drop_index
+
+VERSION = 2
+NAME = 'chat_list_metadata'
+TRANSACTIONAL = False
+
+BATCH_SIZE = 500
+
+
+def _preview(content, length=100):
+    if not content:
+        return None
+    return content[:length] + '...' if len(content) > length else content
+
+
+def upgrade(conn):
+    add_column(conn, 'nomadchat_chatsession', 'preview', 'VARCHAR(120)')
+    add_column(conn, 'nomadchat_chatsession', 'message_count', 'INTEGER')
+    add_column(conn, 'nomadchat_chatsession', 'last_message_at', 'TIMESTAMP')
+
+    # Backfill from the history blobs once, in id order; rows written since have message_count set
+    update = text(
+        "UPDATE nomadchat_chatsession SET preview = :preview, message_count = :message_count, "
+        "last_message_at = :last_message_at, pinned = COALESCE(pinned, :not_pinned) WHERE id = :row_id"
+    )
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, chat_history, updated_at, created_at FROM nomadchat_chatsession "
+            "WHERE id > :last_id AND message_count IS NULL ORDER BY id LIMIT :limit"
+        ), {'last_id': last_id, 'limit': BATCH_SIZE}).all()
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            try:
+                history = json.loads(row.chat_history or '[]')
+            except ValueError:
+                history = []
+            params.append({
+                'row_id': row.id,
+                'preview': _preview(history[0].get('content')) if history else None,
+                'message_count': len(history),
+                'last_message_at': (row.updated_at or row.created_at) if history else None,
+                'not_pinned': False,
+            })
+        conn.execute(update, params)
+        conn.commit()
+        last_id = rows[-1].id
+        print(f"[Migrations] Chat list metadata backfilled up to id {last_id}")
+
+    # Keyset paging orders by (pinned, updated_at, id); the 0001 index lacked the id tiebreaker
+    create_index(conn, 'ix_chatsession_user_project_list', 'nomadchat_chatsession',
+                 ['user_id', 'project_id', 'pinned', 'updated_at', 'id'])
+    drop_index(conn, 'ix_chatsession_user_project_pinned_updated')
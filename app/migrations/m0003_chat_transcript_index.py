@@ -0,0 +1,10 @@
+"""Index for paging a chat's messages newest first"""
+from app.migrations.ops import create_index
+
+VERSION = 3
+NAME = 'chat_transcript_index'
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_chat_message_session_message', 'nomadchat_chat_message', ['chat_session_id', 'id'])
@@ -0,0 +1,10 @@
+"""Index for the admin login report: a user's logins newest first"""
+from app.migrations.ops import create_index
+
+VERSION = 4
+NAME = 'login_record_user_time_index'
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_login_record_user_login_time', 'nomadchat_login_record', ['user_id', 'login_time'])
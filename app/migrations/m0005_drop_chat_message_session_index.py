@@ -0,0 +1,10 @@
+"""Drop the single-column chat_session_id index; ix_chat_message_session_message leads with the same column"""
+from app.migrations.ops import drop_index
+
+VERSION = 5
+NAME = 'drop_chat_message_session_index'
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    drop_index(conn, 'ix_nomadchat_chat_message_chat_session_id')
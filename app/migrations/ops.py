@@ -0,0 +1,25 @@
+"""Helpers for migration modules"""
+from sqlalchemy import inspect, text
+
+
+def create_index(conn, name, table, columns):
+    """CREATE INDEX IF NOT EXISTS, concurrently on Postgres when the connection is autocommit"""
+    concurrently = ''
+    if conn.dialect.name == 'postgresql' and conn.get_execution_options().get('isolation_level') == 'AUTOCOMMIT':
+        concurrently = 'CONCURRENTLY '
+    conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+def drop_index(conn, name):
+    """DROP INDEX IF EXISTS, concurrently on Postgres when the connection is autocommit"""
+    concurrently = ''
+    if conn.dialect.name == 'postgresql' and conn.get_execution_options().get('isolation_level') == 'AUTOCOMMIT':
+        concurrently = 'CONCURRENTLY '
+    conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
+
+
+def add_column(conn, table, column, ddl_type):
+    """ALTER TABLE ADD COLUMN unless the column is already there (SQLite has no IF NOT EXISTS)"""
+    existing = {c['name'] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
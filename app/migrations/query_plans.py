@@ -0,0 +1,105 @@
+"""
+EXPLAIN checks for the hot queries, run by `flask check-query-plans` (SQLite and Postgres).
+
+Each query is compiled from the same ORM filters the routes use and must be answered
+through an index: no full-table scan, and on SQLite no temporary sort for the ORDER BY.
+Postgres is explained with enable_seqscan off, so small test tables still show whether
+an index *can* serve the query.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, text, tuple_
+from app.extensions import db
+
+# Queries whose only sort is over one bounded page of rows (after the index has done the work)
+BOUNDED_SORT_QUERIES = {'admin login report'}
+
+
+def hot_queries(user_id=1, project_id=1, session_id='00000000-0000-0000-0000-000000000000'):
+    """(name, expected index, select) for each hot query"""
+    from app.models.models import ChatSession, ChatMessage, Document, ResearchSession, APILog
+    from app.services.login_report_service import login_summary_statement, users_page
+
+    since = datetime.utcnow() - timedelta(days=30)
+    chat_list_columns = (ChatSession.id, ChatSession.session_id, ChatSession.preview, ChatSession.pinned,
+                         ChatSession.message_count, ChatSession.last_message_at,
+                         ChatSession.created_at, ChatSession.updated_at)
+    chat_list_order = (ChatSession.pinned.desc(), ChatSession.updated_at.desc(), ChatSession.id.desc())
+    return [
+        ('load chat', 'ix_chatsession_user_session_project',
+         select(ChatSession).filter_by(user_id=user_id, session_id=session_id, project_id=project_id)),
+        ('load chat (any project)', 'ix_chatsession_user_session_project',
+         select(ChatSession).filter_by(user_id=user_id, session_id=session_id)),
+        ('list chats', 'ix_chatsession_user_project_list',
+         select(*chat_list_columns).filter_by(user_id=user_id, project_id=project_id)
+         .order_by(*chat_list_order).limit(51)),
+        ('list chats (next page)', 'ix_chatsession_user_project_list',
+         select(*chat_list_columns).filter_by(user_id=user_id, project_id=project_id)
+         .where(tuple_(ChatSession.pinned, ChatSession.updated_at, ChatSession.id) < tuple_(False, since, 1000))
+         .order_by(*chat_list_order).limit(51)),
+        ('chat transcript page', 'ix_chat_message_session_message',
+         select(ChatMessage.id, ChatMessage.role, ChatMessage.content)
+         .where(ChatMessage.chat_session_id == 1, ChatMessage.id < 1000)
+         .order_by(ChatMessage.id.desc()).limit(51)),
+        ('list documents', 'ix_documents_user_project_created',
+         select(Document).filter_by(user_id=user_id, project_id=project_id).order_by(Document.created_at.desc())),
+        ('research history', 'ix_research_session_user_project_created',
+         select(ResearchSession).filter_by(user_id=user_id, project_id=project_id)
+         .order_by(ResearchSession.created_at.desc())),
+        ('admin login report', 'ix_login_record_user_login_time',
+         login_summary_statement(users_page(1, 50), 3)),
+        ('user api usage', 'ix_api_log_user_timestamp',
+         select(APILog).where(APILog.user_id == user_id, APILog.timestamp >= since)
+         .order_by(APILog.timestamp.desc())),
+    ]
+
+
+def explain(conn, statement):
+    """Plan lines for a statement on the connection's dialect"""
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    if conn.dialect.name == 'sqlite':
+        return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        return [row[0] for row in conn.execute(text(f"EXPLAIN {sql}"))]
+    raise ValueError(f"Query plan checks are not supported on {conn.dialect.name}")
+
+
+def plan_problems(dialect, plan, tables=None, allow_sort=False):
+    """
+    Reasons the plan does not use an index (empty when it does). On SQLite, scans of
+    subqueries are only flagged when `tables` (the real table names) is not given.
+    """
+    problems = []
+    if dialect == 'sqlite':
+        for line in plan:
+            scanned = line.split()[1] if line.startswith('SCAN ') else None
+            if scanned and ' USING ' not in line and (tables is None or scanned in tables):
+                problems.append(f"full scan: {line}")
+            if 'USE TEMP B-TREE' in line and not allow_sort:
+                problems.append(f"sort not served by an index: {line}")
+    else:
+        if not any('Index' in line for line in plan):
+            problems.append("no index scan in plan")
+        problems += [f"full scan: {line.strip()}" for line in plan if 'Seq Scan' in line]
+    return problems
+
+
+def check_query_plans():
+    """
+    EXPLAIN every hot query; returns one result dict per query with
+    name, expected_index, used_expected_index, plan and problems
+    """
+    results = []
+    tables = set(db.metadata.tables)
+    with db.engine.connect() as conn:
+        for name, expected_index, statement in hot_queries():
+            with conn.begin():
+                plan = explain(conn, statement)
+            results.append({
+                'name': name,
+                'expected_index': expected_index,
+                'used_expected_index': any(expected_index in line for line in plan),
+                'plan': plan,
+                'problems': plan_problems(conn.dialect.name, plan, tables, name in BOUNDED_SORT_QUERIES),
+            })
+    return results
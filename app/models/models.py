@@ -1,7 +1,7 @@
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from app.extensions import db
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 from flask_login import UserMixin
 from sqlalchemy import Index
@@ -81,6 +81,12 @@ class LoginRecord(db.Model):
     user = db.relationship('User', back_populates='login_records')
 
 
+def make_chat_preview(content, length=100):
+    """Chat list preview: the start of the chat's first message"""
+    if not content:
+        return None
+    return content[:length] + '...' if len(content) > length else content
+
 class ChatSession(db.Model):
     __tablename__ = 'nomadchat_chatsession'
     id = db.Column(db.Integer, primary_key=True)
@@ -92,6 +98,11 @@ class ChatSession(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     pinned = db.Column(db.Boolean, default=False)
+    # Chat list metadata, kept in step with chat_history by add_message so the sidebar
+    # never has to load or parse the history blob
+    preview = db.Column(db.String(120), nullable=True)
+    message_count = db.Column(db.Integer, default=0)
+    last_message_at = db.Column(db.DateTime, nullable=True)
 
     def set_chat_history(self, chat_history):
         self.chat_history = json.dumps(chat_history)
@@ -99,6 +110,108 @@ class ChatSession(db.Model):
     def get_chat_history(self):
         return json.loads(self.chat_history)
 
+    def sync_messages(self, chat_history=None):
+        """
+        Give every message in the stored history a ChatMessage row. Chats stored before
+        per-message rows existed have none, or only rows for the turns sent since; their rows
+        are rebuilt in history order so id order stays transcript order. Messages whose time
+        was never recorded get times spread between the chat's start and its first known
+        message. Returns the number of rows created; the caller commits.
+        """
+        if chat_history is None:
+            chat_history = self.get_chat_history()
+        if not chat_history or self.id is None:
+            return 0
+        if self.messages.count() >= len(chat_history):
+            return 0
+
+        # Existing rows mirror the newest messages; keep their times
+        existing = self.messages.order_by(ChatMessage.id).all()
+        missing = len(chat_history) - len(existing)
+        start = self.created_at or datetime.utcnow()
+        if existing:
+            end = existing[0].created_at or start
+            step = max(end - start, timedelta(0)) / (missing + 1)
+            times = [start + step * i for i in range(missing)]
+        else:
+            end = self.last_message_at or self.updated_at or start
+            step = max(end - start, timedelta(0)) / max(missing - 1, 1)
+            times = [start + step * i for i in range(missing)]
+        times += [message.created_at for message in existing]
+
+        for message in existing:
+            db.session.delete(message)
+        for msg, created_at in zip(chat_history, times):
+            content = msg.get('content') or ''
+            db.session.add(ChatMessage(
+                chat_session_id=self.id,
+                project_id=self.project_id,
+                user_id=self.user_id,
+                role=msg.get('role', 'user'),
+                content=content,
+                content_length=len(content),
+                created_at=created_at
+            ))
+        return missing
+
+    def add_message(self, role, content, chat_history=None):
+        """Append a message to the stored history and mirror it as a ChatMessage row"""
+        if chat_history is None:
+            chat_history = self.get_chat_history()
+        # Chats from before per-message rows: mirror the earlier messages first
+        self.sync_messages(chat_history)
+        chat_history.append({"role": role, "content": content})
+        self.set_chat_history(chat_history)
+        self.message_count = len(chat_history)
+        self.last_message_at = datetime.utcnow()
+        if not self.preview:
+            self.preview = make_chat_preview(chat_history[0].get('content'))
+
+        message = ChatMessage(
+            chat_session=self,
+            project_id=self.project_id,
+            user_id=self.user_id,
+            role=role,
+            content=content,
+            content_length=len(content)
+        )
+        db.session.add(message)
+        return message
+
+
+class ChatMessage(db.Model):
+    """One row per chat message, so recent context can be read without parsing whole histories"""
+    __tablename__ = 'nomadchat_chat_message'
+    id = db.Column(db.Integer, primary_key=True)
+    chat_session_id = db.Column(db.Integer, db.ForeignKey('nomadchat_chatsession.id', ondelete='CASCADE'), nullable=False)  # Indexed by ix_chat_message_session_message
+    project_id = db.Column(db.Integer, db.ForeignKey('nomadchat_project.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('nomadchat_users.id'), nullable=False)
+    role = db.Column(db.String(20), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    content_length = db.Column(db.Integer, nullable=False, default=0)  # Stored so callers can truncate without reading content
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    chat_session = db.relationship('ChatSession', backref=db.backref('messages', lazy='dynamic', cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<ChatMessage {self.chat_session_id}-{self.id}>'
+
+class AssistantThread(db.Model):
+    """Remote Assistants API thread; unassigned rows (chat_session_id NULL) form a pool of pre-created threads"""
+    __tablename__ = 'nomadchat_assistant_thread'
+    id = db.Column(db.Integer, primary_key=True)
+    thread_id = db.Column(db.String(100), nullable=False, unique=True)
+    chat_session_id = db.Column(db.Integer, db.ForeignKey('nomadchat_chatsession.id', ondelete='CASCADE'), nullable=True, unique=True)
+    synced_messages = db.Column(db.Integer, nullable=False, default=0)  # Transcript messages already on the thread
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=True)
+
+    chat_session = db.relationship('ChatSession', backref=db.backref('assistant_thread', uselist=False, cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<AssistantThread {self.thread_id}>'
+
+
 class Project(db.Model):
     __tablename__ = 'nomadchat_project'
     id = db.Column(db.Integer, primary_key=True)
@@ -193,6 +306,26 @@ class UserChatMemory(db.Model):
         return f'<UserChatMemory user_id={self.user_id}>'
 
 
+class MemoryBatch(db.Model):
+    """A user-memory summarization batch submitted to the provider's offline batch endpoint"""
+    __tablename__ = 'nomadchat_memory_batch'
+    PENDING_STATUSES = ('validating', 'in_progress', 'finalizing')
+
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(100), nullable=False, unique=True)
+    status = db.Column(db.String(30), nullable=False)
+    request_count = db.Column(db.Integer, default=0)
+    user_ids = db.Column(db.Text, nullable=False, default='[]')  # JSON list of users covered
+    submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    def get_user_ids(self):
+        return json.loads(self.user_ids or '[]')
+
+    def __repr__(self):
+        return f'<MemoryBatch {self.batch_id} {self.status}>'
+
+
 class ProjectMemory(db.Model):
     __tablename__ = 'nomadchat_project_memory'
     id = db.Column(db.Integer, primary_key=True)
@@ -210,6 +343,52 @@ class ProjectMemory(db.Model):
     def __repr__(self):
         return f'<ProjectMemory project_id={self.project_id}>'
 
+class ProjectActivity(db.Model):
+    """Counters of new project content since the last memory build, maintained on write"""
+    __tablename__ = 'nomadchat_project_activity'
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('nomadchat_project.id'), nullable=False, unique=True)
+    new_sessions = db.Column(db.Integer, nullable=False, default=0)
+    new_messages = db.Column(db.Integer, nullable=False, default=0)
+    new_documents = db.Column(db.Integer, nullable=False, default=0)
+    new_tokens = db.Column(db.Integer, nullable=False, default=0)
+    last_memory_build = db.Column(db.DateTime, nullable=True)  # None until memory is first built
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    project = db.relationship('Project', backref=db.backref('activity', uselist=False))
+
+    def __repr__(self):
+        return f'<ProjectActivity project_id={self.project_id}>'
+
+class DailyActivity(db.Model):
+    """Per-day, per-organization activity totals for the admin dashboard, maintained on write"""
+    __tablename__ = 'nomadchat_daily_activity'
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    organization_id = db.Column(db.Integer, nullable=False, default=0)  # 0 for users without an organization
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+    logins = db.Column(db.Integer, nullable=False, default=0)
+    uploads = db.Column(db.Integer, nullable=False, default=0)
+    tokens = db.Column(db.Integer, nullable=False, default=0)  # Provider prompt + completion tokens (APILog)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('day', 'organization_id', name='uq_daily_activity_day_org'),)
+
+    def __repr__(self):
+        return f'<DailyActivity {self.day} organization_id={self.organization_id}>'
+
+class MemoryLock(db.Model):
+    """Lock rows used for single-flight memory rebuilds on databases without advisory locks"""
+    __tablename__ = 'nomadchat_memory_lock'
+    lock_key = db.Column(db.String(100), primary_key=True)
+    owner = db.Column(db.String(64), nullable=False)
+    acquired_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<MemoryLock {self.lock_key}>'
+
 class UserAgreement(db.Model):
     __tablename__ = 'nomadchat_user_agreement'
     id = db.Column(db.Integer, primary_key=True)
@@ -257,6 +436,33 @@ class ResearchSession(db.Model):
     def __repr__(self):
         return f'<ResearchSession {self.topic}>'
 
+class SchemaMigration(db.Model):
+    """One row per applied migration in app/migrations"""
+    __tablename__ = 'nomadchat_schema_migrations'
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 # Add indexes for organization
 Index('ix_organization_name', Organization.name)
-Index('ix_organization_domain', Organization.domain)
\ No newline at end of file
+Index('ix_organization_domain', Organization.domain)
+
+# Recent project context reads the newest messages of a project
+Index('ix_chat_message_project_created', ChatMessage.project_id, ChatMessage.created_at)
+# User memory refresh reads a user's messages since the last summary
+Index('ix_chat_message_user_created', ChatMessage.user_id, ChatMessage.created_at)
+# Transcript pages: a chat's messages newest first, keyed by id
+Index('ix_chat_message_session_message', ChatMessage.chat_session_id, ChatMessage.id)
+# Admin login report: each user's logins newest first
+Index('ix_login_record_user_login_time', LoginRecord.user_id, LoginRecord.login_time)
+
+# Hot query filters (added to existing databases by app/migrations)
+# Loading one chat: user_id + session_id (+ project_id in /api/chat)
+Index('ix_chatsession_user_session_project', ChatSession.user_id, ChatSession.session_id, ChatSession.project_id)
+# Chat list: a user's chats in a project, pinned first, newest first (id breaks ties for keyset paging)
+Index('ix_chatsession_user_project_list', ChatSession.user_id, ChatSession.project_id, ChatSession.pinned, ChatSession.updated_at, ChatSession.id)
+# Document library and research history, newest first
+Index('ix_documents_user_project_created', Document.user_id, Document.project_id, Document.created_at)
+Index('ix_research_session_user_project_created', ResearchSession.user_id, ResearchSession.project_id, ResearchSession.created_at)
+# Per-user usage over a time range
+Index('ix_api_log_user_timestamp', APILog.user_id, APILog.timestamp)
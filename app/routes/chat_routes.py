@@ -2,28 +2,44 @@ from flask import Blueprint, render_template, request, Response, stream_with_con
 from flask_wtf.csrf import CSRFProtect
 from flask_login import current_user, login_required
 from app.services.auth_decorators import login_required, admin_required
+from app.services.read_replica import read_replica
+import base64
 import json
 import os
 import anthropic
 import traceback
 from datetime import datetime, timedelta
 from functools import wraps
+import time
 import uuid
+from contextlib import closing
 import tenacity
 from tenacity import retry, stop_after_attempt, wait_exponential
 from app.extensions import db
-from app.models.models import ChatSession, Project, Document, UserSurvey
+from app.models.models import ChatSession, ChatMessage, Project, Document, UserSurvey
 from typing import Generator, List, Optional
+from sqlalchemy import func, or_, tuple_
 import openai
 import requests
 from io import BytesIO
-from app.services.chat_memory_service import generate_user_memory, get_user_memory
-from app.services.project_memory_service import get_incremental_project_memory, get_project_memory, get_enhanced_project_context
+from app.services.activity_rollup_service import record_daily_activity
+from app.services.project_memory_service import get_incremental_project_memory, get_project_memory, invalidate_recent_project_context, record_project_activity, estimate_tokens
 import tempfile
 from tempfile import NamedTemporaryFile
 import pandas as pd
 import random
-from app.services.user_background_service import generate_user_background
+from app.services.search_service import KIND_CHAT, get_search_recall_context, search
+from app.services.provider_router import register_upstream, stream_with_failover
+from app.services.rate_limiter import acquire, report_rate_limited, retry_after_seconds, estimate_request_tokens
+from app.services.llm_scheduler import llm_slot, submit_background, INTERACTIVE
+from app.services.llm_clients import get_openai_client, get_anthropic_client
+from app.services.api_log_service import log_api_usage, openai_usage, gemini_usage, anthropic_stream_text
+from app.services.stream_control import register_stream, unregister_stream, stop_requested, request_stop
+from app.services.prewarm_service import schedule_prewarm, get_chat_context, invalidate_chat_context
+from app.services.assistant_thread_service import (
+    MAX_ADDITIONAL_MESSAGES, AssistantRunTimeout, get_session_thread, get_unsynced_messages, reset_session_thread,
+    mark_thread_synced, poll_run, run_reply_text
+)
 
 
 chat_bp = Blueprint('chat_bp', __name__)
@@ -65,19 +81,34 @@ def stream_claude_response(client, message_args, user_id):
     print(f"Message count: {len(message_args.get('messages', []))}")
     print(f"System message count: {len(message_args.get('system', [])) if 'system' in message_args else 0}")
 
+    acquire('anthropic', message_args.get('model'), estimate_request_tokens(message_args.get('messages'), message_args.get('system')))
     try:
         stream = client.messages.stream(**message_args)
         return stream
     except Exception as e:
+        if isinstance(e, anthropic.RateLimitError):
+            report_rate_limited('anthropic', message_args.get('model'), retry_after_seconds(e))
         print(f"\nError in stream_claude_response: {str(e)}")
         print("Headers if available:", getattr(e, 'response', {}).headers if hasattr(e, 'response') else 'No headers')
         raise
 
 
-def stream_openai_assistant(messages, user_id, assistant_id):
-    # Create a thread
-    thread = openai.beta.threads.create()
-    thread_id = thread.id
+def stream_openai_assistant(messages, user_id, assistant_id, chat_session_id=None):
+    # Reuse the chat session's thread so only messages it hasn't seen are sent
+    thread = None
+    if chat_session_id is not None:
+        thread = get_session_thread(chat_session_id)
+        pending = get_unsynced_messages(thread, messages)
+        if pending is None:
+            thread = reset_session_thread(thread)
+            pending = messages
+        thread_id = thread.thread_id
+        print(f"[Assistant] Thread {thread_id}: {thread.synced_messages} synced, {len(pending)} new")
+        # End the read so no pooled connection is held across the OpenAI calls below
+        db.session.commit()
+    else:
+        thread_id = get_openai_client().beta.threads.create().id
+        pending = messages
 
     # Get file_ids from session
     file_ids = session.get('openai_file_ids', [])
@@ -122,28 +153,25 @@ def stream_openai_assistant(messages, user_id, assistant_id):
         
         print(f"[Assistant] Attaching {len(file_ids)} files: {file_list_str}")
     
-    # Add user messages to thread
-    for idx, m in enumerate(messages):
-        if m["role"] == "user":
-            content = m["content"]
-            
-            # For the most recent message, add file info if available
-            if idx == len(messages) - 1 and file_info_message:
-                content = f"{file_info_message}\n\n{content}"
-                
-            # Create message with attachments if this is the last message
-            kwargs = {
-                "thread_id": thread_id,
-                "role": "user",
-                "content": content
-            }
-            
-            # Only attach files to the last message
-            if attachments and idx == len(messages) - 1:
-                kwargs["attachments"] = attachments
-                
-            openai.beta.threads.messages.create(**kwargs)
-    
+    # Build the new messages; the last one is the current prompt and carries the files
+    additional_messages = []
+    for idx, m in enumerate(pending):
+        content = m["content"]
+        if idx == len(pending) - 1 and file_info_message:
+            content = f"{file_info_message}\n\n{content}"
+        if not content:
+            continue
+        entry = {"role": m["role"], "content": content}
+        if attachments and idx == len(pending) - 1:
+            entry["attachments"] = attachments
+        additional_messages.append(entry)
+
+    # Adopting a long history into a fresh thread: post what doesn't fit inline first
+    overflow = additional_messages[:-MAX_ADDITIONAL_MESSAGES]
+    for entry in overflow:
+        get_openai_client().beta.threads.messages.create(thread_id=thread_id, **entry)
+    additional_messages = additional_messages[-MAX_ADDITIONAL_MESSAGES:]
+
     # Clear file session data after use
     for key in ["openai_file_ids", "openai_file_names", "openai_file_types"]:
         if key in session:
@@ -151,41 +179,116 @@ def stream_openai_assistant(messages, user_id, assistant_id):
             session.modified = True
 
     # Run the assistant
-    run = openai.beta.threads.runs.create(
-        thread_id=thread_id,
-        assistant_id=assistant_id,
-        stream=True
-    )
+    client = get_openai_client()
+    started = time.monotonic()
+    deadline = started + current_app.config.get('ASSISTANT_RUN_TIMEOUT_SECONDS', 120)
+    acquire('openai', 'assistants', estimate_request_tokens(additional_messages))
+    try:
+        run = client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            additional_messages=additional_messages,
+            stream=True
+        )
+    except openai.RateLimitError as e:
+        report_rate_limited('openai', 'assistants', retry_after_seconds(e))
+        raise
+    if thread is not None:
+        # The prompt is on the thread now, whether or not the run succeeds
+        mark_thread_synced(thread, len(messages))
 
     # Stream the response
     buffer = ""
-    for event in run:
-        if hasattr(event, 'data') and hasattr(event.data, 'delta') and getattr(event.data.delta, 'content', None):
-            delta = event.data.delta.content
-            if isinstance(delta, list):
-                parts = []
-                for part in delta:
-                    value = getattr(getattr(part, 'text', None), 'value', None)
-                    if value is not None:
-                        parts.append(value)
-                    else:
-                        parts.append(str(part))
-                delta = ''.join(parts)
-            buffer += delta
-            if len(buffer) >= 20 or buffer.endswith(('.', '!', '?', '\n')):
-                yield json.dumps({"chunk": buffer}) + "\n"
-                buffer = ""
-    if buffer:
-        yield json.dumps({"chunk": buffer}) + "\n"
+    response_text = ""
+    streamed_text = ""  # What the caller received, and so what the saved transcript will hold
+    run_id = None
+    finished = False
+    first_token_at = None
+    try:
+        try:
+            for event in run:
+                event_type = getattr(event, 'event', None)
+                if event_type == 'thread.run.created':
+                    run_id = event.data.id
+                elif event_type in ('thread.run.completed', 'thread.run.failed', 'thread.run.cancelled',
+                                    'thread.run.expired', 'thread.run.incomplete'):
+                    finished = True
+                elif event_type == 'thread.run.requires_action':
+                    # No tools are wired up, so the run would wait forever; cancelled below
+                    print(f"[Assistant] Run {run_id} requires action, cancelling")
+                    break
+                if event_type == 'thread.run.completed':
+                    log_api_usage(event.data.model, openai_usage(event.data.usage), prompt=messages[-1]["content"],
+                                  thread_id=thread_id, user_id=user_id)
+                if hasattr(event, 'data') and hasattr(event.data, 'delta') and getattr(event.data.delta, 'content', None):
+                    delta = event.data.delta.content
+                    if isinstance(delta, list):
+                        parts = []
+                        for part in delta:
+                            value = getattr(getattr(part, 'text', None), 'value', None)
+                            if value is not None:
+                                parts.append(value)
+                            else:
+                                parts.append(str(part))
+                        delta = ''.join(parts)
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                    buffer += delta
+                    response_text += delta
+                    if len(buffer) >= 20 or buffer.endswith(('.', '!', '?', '\n')):
+                        streamed_text += buffer
+                        yield json.dumps({"chunk": buffer}) + "\n"
+                        buffer = ""
+                if not finished and time.monotonic() > deadline:
+                    raise AssistantRunTimeout(f"Run {run_id} did not finish within the deadline")
+        except AssistantRunTimeout:
+            raise
+        except Exception as e:
+            if not run_id or finished:
+                raise
+            # Read timeout or dropped connection mid-run: the run carries on server-side, so
+            # wait for that run (a second one can't start while it is active) and send the rest
+            print(f"[Assistant] Stream of run {run_id} failed ({e}), polling it")
+            final = poll_run(client, thread_id, run_id, deadline)
+            finished = True
+            if final.status != 'completed':
+                raise RuntimeError(f"Assistant run {run_id} ended {final.status}")
+            if final.usage:
+                log_api_usage(final.model, openai_usage(final.usage), prompt=messages[-1]["content"],
+                              thread_id=thread_id, user_id=user_id)
+            reply = run_reply_text(client, thread_id, run_id)
+            buffer = reply[len(streamed_text):] if reply.startswith(streamed_text) else ""
+        if buffer:
+            streamed_text += buffer
+            yield json.dumps({"chunk": buffer}) + "\n"
+    except AssistantRunTimeout as e:
+        print(f"[Assistant] {e}")
+        yield json.dumps({"error": "The assistant took too long to respond. Please try again."}) + "\n"
+    finally:
+        run.close()
+        if thread is not None and streamed_text.strip():
+            # The reply, complete or cut short by stop/disconnect, is on the thread and is saved
+            # with the transcript; count it so the next turn doesn't post it again. A reply the
+            # caller never received isn't saved, so it isn't counted.
+            mark_thread_synced(thread, len(messages) + 1)
+        if run_id and not finished:
+            # Stopped, disconnected, timed out or waiting on a tool: don't let the run keep going
+            try:
+                client.beta.threads.runs.cancel(run_id=run_id, thread_id=thread_id)
+                print(f"[Assistant] Cancelled run {run_id}")
+            except Exception as e:
+                print(f"[Assistant] Could not cancel run {run_id}: {e}")
+        first_token = f"{first_token_at - started:.2f}s" if first_token_at else "none"
+        print(f"[Assistant] Run {run_id}: first token {first_token}, total {time.monotonic() - started:.2f}s")
 
 
-def stream_ai_response(messages, user_id, system_messages=None):
+def stream_ai_response(messages, user_id, system_messages=None, chat_session_id=None, thread_key=None):
     provider = current_app.config.get('MODEL_PROVIDER', 'anthropic')
     print(f"Using provider: {provider}")
     
     if provider == 'anthropic':
         api_key = current_app.config.get('CLAUDE_API_KEY')
-        client = anthropic.Anthropic(
+        client = get_anthropic_client(
             api_key=api_key,
             default_headers={
                 "anthropic-version": "2023-06-01",
@@ -199,27 +302,29 @@ def stream_ai_response(messages, user_id, system_messages=None):
         }
         if system_messages:
             message_args["system"] = system_messages
+        usage = {}
         with stream_claude_response(client, message_args, user_id) as stream:
             buffer = ""
-            for text in stream.text_stream:
+            for text in anthropic_stream_text(stream, usage):
                 buffer += text
                 if len(buffer) >= 20 or text.endswith(('.', '!', '?', '\n')):
                     yield json.dumps({"chunk": buffer}) + "\n"
                     buffer = ""
             if buffer:
                 yield json.dumps({"chunk": buffer}) + "\n"
+        log_api_usage(message_args["model"], usage, prompt=messages[-1]["content"],
+                      thread_id=thread_key, user_id=user_id)
     elif provider == 'openai':
-        openai.api_key = current_app.config.get('OPENAI_API_KEY')
         assistant_id = current_app.config.get('OPENAI_ASSISTANT_ID')
-        yield from stream_openai_assistant(messages, user_id, assistant_id)
+        with llm_slot(INTERACTIVE):
+            yield from stream_openai_assistant(messages, user_id, assistant_id, chat_session_id)
     else:
         yield json.dumps({"error": "Invalid MODEL_PROVIDER setting."}) + "\n"
 
 
-def stream_openai_chat_completion(messages, system_prompt=None):
+def stream_openai_chat_completion(messages, system_prompt=None, user_id=None, thread_id=None):
     """Stream response from OpenAI ChatCompletion endpoint (not Assistant API), compatible with openai>=1.0.0"""
-    from openai import OpenAI
-    client = OpenAI(api_key=current_app.config.get('OPENAI_API_KEY'))
+    client = get_openai_client()
     model = current_app.config.get('OPENAI_CHAT_MODEL', 'gpt-4o')
     max_tokens = current_app.config.get('OPENAI_CHAT_MAX_TOKENS', 16384)
     openai_messages = []
@@ -227,23 +332,134 @@ def stream_openai_chat_completion(messages, system_prompt=None):
         openai_messages.append({"role": "system", "content": system_prompt})
     for m in messages:
         openai_messages.append({"role": m["role"], "content": m["content"]})
-    response = client.chat.completions.create(
-        model=model,
-        messages=openai_messages,
+    acquire('openai', model, estimate_request_tokens(openai_messages))
+    try:
+        response = client.chat.completions.create(
+            model=model,
+            messages=openai_messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            temperature=0.7,
+            max_tokens=max_tokens
+        )
+    except openai.RateLimitError as e:
+        report_rate_limited('openai', model, retry_after_seconds(e))
+        raise
+    register_upstream(response)
+    buffer = ""
+    try:
+        for chunk in response:
+            if chunk.usage:
+                # Final chunk (include_usage): no choices, the whole request's token counts
+                log_api_usage(chunk.model, openai_usage(chunk.usage), prompt=messages[-1]["content"],
+                              thread_id=thread_id, user_id=user_id)
+            delta = chunk.choices[0].delta.content if chunk.choices and chunk.choices[0].delta else None
+            if delta:
+                buffer += delta
+                if len(buffer) >= 20 or buffer.endswith((".", "!", "?", "\n")):
+                    yield json.dumps({"chunk": buffer}) + "\n"
+                    buffer = ""
+        if buffer:
+            yield json.dumps({"chunk": buffer}) + "\n"
+    finally:
+        # Closing early (cancelled or abandoned request) drops the upstream connection
+        response.close()
+
+
+def stream_claude_chat(messages, system_prompt=None, user_id=None, thread_id=None):
+    """Stream a chat response from Anthropic, in the same chunk format as stream_openai_chat_completion"""
+    client = get_anthropic_client()
+    message_args = {
+        "model": current_app.config.get('CLAUDE_CHAT_MODEL'),
+        "max_tokens": current_app.config.get('CLAUDE_CHAT_MAX_TOKENS', 8192),
+        "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+    }
+    if system_prompt:
+        message_args["system"] = system_prompt
+    usage = {}
+    with stream_claude_response(client, message_args, user_id) as stream:
+        register_upstream(stream)
+        buffer = ""
+        for text in anthropic_stream_text(stream, usage):
+            buffer += text
+            if len(buffer) >= 20 or text.endswith(('.', '!', '?', '\n')):
+                yield json.dumps({"chunk": buffer}) + "\n"
+                buffer = ""
+        if buffer:
+            yield json.dumps({"chunk": buffer}) + "\n"
+    log_api_usage(message_args["model"], usage, prompt=messages[-1]["content"], thread_id=thread_id, user_id=user_id)
+
+
+class _GeminiUpstream:
+    """close() for a streamed Gemini response: cancels the transport iterator (gRPC call or REST response)"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def close(self):
+        iterator = getattr(self.response, '_iterator', None)
+        if iterator is not None and hasattr(iterator, 'cancel'):
+            iterator.cancel()
+
+
+def stream_gemini_chat(messages, system_prompt=None, user_id=None, thread_id=None):
+    """Stream a chat response from Gemini, in the same chunk format as stream_openai_chat_completion"""
+    import google.generativeai as genai
+    genai.configure(api_key=current_app.config.get('GEMINI_API_KEY'))
+    model_name = current_app.config.get('GEMINI_CHAT_MODEL', 'gemini-1.5-pro')
+    model = genai.GenerativeModel(model_name, system_instruction=system_prompt)
+    contents = [
+        {"role": "user" if m["role"] == "user" else "model", "parts": [{"text": m["content"]}]}
+        for m in messages
+    ]
+    acquire('gemini', model_name, estimate_request_tokens(messages, system_prompt))
+    response = model.generate_content(
+        contents,
         stream=True,
-        temperature=0.7,
-        max_tokens=max_tokens
+        generation_config=genai.types.GenerationConfig(
+            temperature=0.7,
+            max_output_tokens=current_app.config.get('GEMINI_MAX_TOKENS', 2048),
+        )
     )
+    # generate_content has already waited for the first chunk; from here a cancelled hedge stops the rest
+    register_upstream(_GeminiUpstream(response))
     buffer = ""
+    usage_metadata = None
     for chunk in response:
-        delta = chunk.choices[0].delta.content if chunk.choices[0].delta else None
-        if delta:
-            buffer += delta
+        # Each chunk carries the running totals; the last one has the whole request's usage
+        usage_metadata = getattr(chunk, 'usage_metadata', None) or usage_metadata
+        text = getattr(chunk, 'text', '') if chunk.parts else ''
+        if text:
+            buffer += text
             if len(buffer) >= 20 or buffer.endswith((".", "!", "?", "\n")):
                 yield json.dumps({"chunk": buffer}) + "\n"
                 buffer = ""
     if buffer:
         yield json.dumps({"chunk": buffer}) + "\n"
+    log_api_usage(model_name, gemini_usage(usage_metadata), prompt=messages[-1]["content"], thread_id=thread_id, user_id=user_id)
+
+
+def stream_chat_with_failover(messages, system_prompt=None, user_id=None, thread_id=None):
+    """
+    Stream the chat answer through the provider router: configured providers in CHAT_PROVIDERS order,
+    failing over on errors and hedging slow first tokens. user_id and thread_id label the APILog rows.
+    """
+    available = {
+        'openai': (current_app.config.get('OPENAI_API_KEY'), stream_openai_chat_completion),
+        'anthropic': (current_app.config.get('CLAUDE_API_KEY'), stream_claude_chat),
+        'gemini': (current_app.config.get('GEMINI_API_KEY'), stream_gemini_chat),
+    }
+    providers = []
+    for name in current_app.config.get('CHAT_PROVIDERS', ['openai']):
+        api_key, stream_fn = available.get(name, (None, None))
+        if api_key:
+            providers.append((name, lambda stream_fn=stream_fn: stream_fn(messages, system_prompt, user_id, thread_id)))
+    try:
+        with llm_slot(INTERACTIVE):
+            yield from stream_with_failover(providers)
+    except Exception as e:
+        print(f"All chat providers failed: {str(e)}")
+        yield json.dumps({"error": "The assistant is temporarily unavailable. Please try again."}) + "\n"
 
 
 # Routes
@@ -252,7 +468,6 @@ def stream_openai_chat_completion(messages, system_prompt=None):
 def index_page():
     """Render the main chat page at root URL"""
     # Remove welcome message initialization from session
-    session['chat_history'] = []  # Initialize with empty history
     session['user_id'] = str(uuid.uuid4())
     return render_template('index.html')
 
@@ -288,15 +503,15 @@ def new_chat():
             print(f"[DEBUG] /api/new_chat: No project found for id={project_id} and user_id={current_user.id}")
             return json.dumps({"error": "Invalid project"}), 404
 
-        # Clear session data without creating database record
-        session['current_session_id'] = None
-        session['chat_history'] = []
         # Clear any file-related session variables (always clear on new chat)
         for key in ['openai_file_ids', 'openai_file_names', 'openai_file_types']:
             if key in session:
                 del session[key]
         session.modified = True
 
+        # A message is probably coming: build its context and open provider connections now
+        schedule_prewarm(current_user.id, project.id)
+
         # List of 12 advanced, expert-focused quick start offers (documentary filmmaking)
         suggested_questions_pool = [
             "Let's outline a multi-threaded narrative structure for your documentary.",
@@ -332,6 +547,31 @@ def new_chat():
         return json.dumps({"error": str(e)}), 500
 
 
+def append_chat_message(chat_session_pk, role, content, attempts=3):
+    """
+    Add a message to a chat's history as stored now, not as read when the request began:
+    another tab may have saved a turn to the same chat meanwhile. Postgres holds a row lock
+    until commit; elsewhere an unchanged message_count claims the row (and SQLite's write
+    lock) and a changed one means another turn got in first, so the history is read again.
+    Returns the session, or None if the chat has been deleted meanwhile; the caller commits.
+    """
+    for attempt in range(attempts):
+        chat_session = db.session.get(ChatSession, chat_session_pk, with_for_update=True, populate_existing=True)
+        if chat_session is None:
+            print(f"[Chat] Session {chat_session_pk} was deleted, not saving the {role} message")
+            return None
+        claimed = db.session.query(ChatSession).filter(
+            ChatSession.id == chat_session_pk,
+            ChatSession.message_count == chat_session.message_count
+        ).update({ChatSession.message_count: ChatSession.message_count}, synchronize_session=False)
+        if claimed:
+            chat_session.add_message(role, content)
+            return chat_session
+        print(f"[Chat] Session {chat_session.session_id} changed while saving, retrying")
+        db.session.rollback()
+    raise RuntimeError(f"Chat session {chat_session_pk} kept changing while saving a message")
+
+
 @chat_bp.route('/api/chat', methods=['POST'])
 @csrf.exempt
 @login_required
@@ -529,49 +769,36 @@ When discussing a topic that has been previously discussed with a filmmaker, rem
 Do not repeat or summarize previous questions and answers from the current session unless the filmmaker requests it. You may use the provided user memory to inform your response if the filmmaker asks about their production history or recurring topics.
 """
 
-        # Get or create chat session
-        session_id = session.get('current_session_id')
-        if not session_id:
-            # This is the first message in a new chat, create the session
-            session_id = str(uuid.uuid4())
-            session['current_session_id'] = session_id
+        # The client names the chat it is continuing, so any worker can serve any turn and
+        # two tabs never share state; no session_id starts a new chat.
+        session_id = data.get('session_id')
+        if session_id:
+            chat_session = ChatSession.query.filter_by(
+                user_id=current_user.id,
+                session_id=session_id,
+                project_id=project_id
+            ).first()
+            if not chat_session:
+                return json.dumps({"error": "Chat not found"}), 404
+        else:
+            if not Project.query.filter_by(id=project_id, user_id=current_user.id).first():
+                return json.dumps({"error": "Invalid project"}), 404
             chat_session = ChatSession(
                 user_id=current_user.id,
                 project_id=project_id,
-                session_id=session_id,
+                session_id=str(uuid.uuid4()),
                 model=current_app.config.get('CLAUDE_MODEL'),
                 chat_history='[]'
             )
             db.session.add(chat_session)
+            record_project_activity(project_id, sessions=1)
+            record_daily_activity(current_user.organization_id, sessions=1)
             db.session.commit()
-        else:
-            chat_session = ChatSession.query.filter_by(
-                user_id=current_user.id,
-                session_id=session_id,
-                project_id=project_id
-            ).first()
-
-            if not chat_session:
-                # Session ID exists but no database record - create it
-                chat_session = ChatSession(
-                    user_id=current_user.id,
-                    project_id=project_id,
-                    session_id=session_id,
-                    model=current_app.config.get('CLAUDE_MODEL'),
-                    chat_history='[]'
-                )
-                db.session.add(chat_session)
-                db.session.commit()
 
-        # Get project and its system instructions
-        project = Project.query.get(project_id)
-        if not project:
-            return json.dumps({"error": "Invalid project"}), 404
-        
-        # Background project memory update (non-blocking)
+        # Background project memory update (non-blocking): runs on the background scheduler,
+        # this turn uses the memory as it stands
         try:
-            # Trigger project memory update in background
-            get_incremental_project_memory(project_id)
+            submit_background(f"project_memory:{project_id}", get_incremental_project_memory, project_id)
         except Exception as e:
             print(f"Background project memory update failed: {e}")
             # Continue with chat even if memory update fails
@@ -599,9 +826,11 @@ Do not repeat or summarize previous questions and answers from the current sessi
                 using_documents = False
 
         # Build system prompt with user memory, user background, and enhanced project context
-        user_memory = get_user_memory(current_user.id)
-        user_background = generate_user_background(current_user.id)
-        enhanced_project_context = get_enhanced_project_context(project_id)
+        # (usually already cached by the prewarm when the chat was opened)
+        chat_context = get_chat_context(current_user.id, project_id)
+        user_memory = chat_context['user_memory']
+        user_background = chat_context['user_background']
+        enhanced_project_context = chat_context['project_context']
         
         system_prompt_full = ""
         
@@ -618,6 +847,23 @@ Do not repeat or summarize previous questions and answers from the current sessi
                 "- Prioritize recent information for immediate questions\n\n"
             )
         
+        # Cheap recall stage: only past excerpts that match this prompt
+        if current_app.config.get('SEARCH_RECALL_ENABLED', True):
+            recall_context = get_search_recall_context(
+                current_user.id,
+                project_id,
+                prompt,
+                exclude_group_id=chat_session.id,
+                max_excerpts=current_app.config.get('SEARCH_RECALL_MAX_EXCERPTS', 5)
+            )
+            if recall_context:
+                system_prompt_full += (
+                    "==== RELEVANT PAST DISCUSSIONS ===="
+                    f"\n{recall_context}"
+                    "==== END OF RELEVANT PAST DISCUSSIONS ====\n\n"
+                    "Use these excerpts when the user asks when or whether something was discussed before.\n\n"
+                )
+
         if user_memory:
             system_prompt_full += (
                 "==== USER MEMORY: SUMMARY OF PREVIOUS CONVERSATIONS ===="
@@ -691,26 +937,36 @@ Remember to maintain your role as a documentary production assistant while incor
             "content": prompt
         }
         messages.append(current_message)
-        chat_history.append(current_message)
-        chat_session.chat_history = json.dumps(chat_history)
+        chat_session = append_chat_message(chat_session.id, "user", prompt)
+        if chat_session is None:
+            return json.dumps({"error": "Chat not found"}), 404
+        record_project_activity(project_id, messages=1, tokens=estimate_tokens(prompt))
+        record_daily_activity(current_user.organization_id, messages=1)
+        user_id = current_user.id
+        organization_id = current_user.organization_id
+        chat_session_pk = chat_session.id
+        session_key = chat_session.session_id
         db.session.commit()
+        # Hand the pooled connection back before the LLM call; the stream only re-acquires
+        # one briefly to save the answer. ORM objects are detached from here on, so the
+        # stream works from the plain values above.
+        db.session.close()
 
         def generate_and_save():
             full_ai_response = ""
+            stream_handle = register_stream(session_key)
             try:
+                # Tells the client which chat to stop via /api/chat/<session_id>/stop
+                yield json.dumps({"session_id": session_key}) + "\n"
                 if spreadsheet_attached:
                     # Route to OpenAI Assistant API (code interpreter)
-                    for chunk in stream_ai_response(messages, current_user.id, [{"type": "text", "text": system_prompt_full}]):
-                        try:
-                            data = json.loads(chunk)
-                            if 'chunk' in data:
-                                full_ai_response += data['chunk']
-                        except Exception:
-                            pass
-                        yield chunk
+                    upstream = stream_ai_response(messages, user_id, [{"type": "text", "text": system_prompt_full}], chat_session_pk, session_key)
                 else:
-                    # Route to OpenAI ChatCompletion endpoint
-                    for chunk in stream_openai_chat_completion(messages, system_prompt_full):
+                    # Route to the chat completion providers (OpenAI first, with failover)
+                    upstream = stream_chat_with_failover(messages, system_prompt_full, user_id, session_key)
+                # Closing the upstream generator closes the provider stream (or cancels the run)
+                with closing(upstream):
+                    for chunk in upstream:
                         try:
                             data = json.loads(chunk)
                             if 'chunk' in data:
@@ -718,14 +974,21 @@ Remember to maintain your role as a documentary production assistant while incor
                         except Exception:
                             pass
                         yield chunk
+                        if stop_requested(stream_handle):
+                            print(f"[Chat] Stop requested for {session_key}, closing upstream")
+                            break
+            except GeneratorExit:
+                print(f"[Chat] Client disconnected from {session_key}, closing upstream")
+                raise
             finally:
-                if full_ai_response.strip():
-                    chat_history.append({
-                        "role": "assistant",
-                        "content": full_ai_response
-                    })
-                    chat_session.chat_history = json.dumps(chat_history)
+                unregister_stream(stream_handle)
+                # Whatever was generated is kept, including a partial answer cut short by stop/disconnect
+                # The chat may have been deleted while the answer streamed; then there is nothing to save to
+                if full_ai_response.strip() and append_chat_message(chat_session_pk, "assistant", full_ai_response):
+                    record_project_activity(project_id, messages=1, tokens=estimate_tokens(full_ai_response))
+                    record_daily_activity(organization_id, messages=1)
                     db.session.commit()
+                db.session.close()
 
         return Response(
             stream_with_context(generate_and_save()),
@@ -737,49 +1000,111 @@ Remember to maintain your role as a documentary production assistant while incor
         return json.dumps({"error": str(e)}), 500
 
 
+@chat_bp.route('/api/chat/<session_id>/stop', methods=['POST'])
+@csrf.exempt
+@login_required
+def stop_chat(session_id):
+    """Stop the answer streaming in a chat; the part already generated is saved"""
+    chat_session = ChatSession.query.filter_by(user_id=current_user.id, session_id=session_id).first()
+    if not chat_session:
+        return jsonify({"error": "Chat not found"}), 404
+    request_stop(session_id)
+    return jsonify({"status": "stopping", "session_id": session_id})
+
+
+def encode_chat_cursor(pinned, updated_at, row_id):
+    """Opaque /api/chats cursor for the last row of a page"""
+    raw = json.dumps([bool(pinned), updated_at.isoformat(), row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_chat_cursor(cursor):
+    try:
+        pinned, updated_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return bool(pinned), datetime.fromisoformat(updated_at), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
 @chat_bp.route('/api/chats', methods=['GET'])
 @csrf.exempt
 @login_required
+@read_replica
 def list_chats():
-    """List all chats for the current project"""
+    """
+    List the chats in a project, pinned first and then most recently updated.
+    Pages with ?limit= and the opaque ?cursor= returned as next_cursor (null on the last page).
+    ?q= keeps only chats whose preview or any message matches it.
+    """
     try:
         project_id = request.args.get('project_id', type=int)
         if not project_id:
             return jsonify({"error": "Project ID is required"}), 400
 
-        query = ChatSession.query.filter_by(
-            user_id=current_user.id,
-            project_id=project_id
-        ).order_by(
-            db.desc(ChatSession.pinned),
-            db.desc(ChatSession.updated_at)
+        page_size = current_app.config.get('CHAT_LIST_PAGE_SIZE', 50)
+        limit = min(max(request.args.get('limit', page_size, type=int), 1), current_app.config.get('CHAT_LIST_MAX_PAGE_SIZE', 200))
+
+        # Only the list columns; the chat_history blob is never loaded here
+        query = db.session.query(
+            ChatSession.id,
+            ChatSession.session_id,
+            ChatSession.preview,
+            ChatSession.pinned,
+            ChatSession.message_count,
+            ChatSession.last_message_at,
+            ChatSession.created_at,
+            ChatSession.updated_at
+        ).filter(
+            ChatSession.user_id == current_user.id,
+            ChatSession.project_id == project_id
         )
 
-        chat_sessions = query.all()
-        chats = []
-
-        for chat in chat_sessions:
+        search_text = (request.args.get('q') or '').strip()
+        if search_text:
+            # Message matches come from the full-text index; the preview also catches terms it skips
+            matches = search(current_user.id, search_text, project_id=project_id, kinds=[KIND_CHAT],
+                             limit=current_app.config.get('CHAT_LIST_SEARCH_MAX_MATCHES', 500))
+            matched_sessions = {match['session_id'] for match in matches if match['session_id']}
+            query = query.filter(or_(
+                ChatSession.preview.icontains(search_text, autoescape=True),
+                ChatSession.session_id.in_(matched_sessions)
+            ))
+
+        cursor = request.args.get('cursor')
+        if cursor:
             try:
-                chat_history = chat.get_chat_history()
-                preview = "New Chat"
-                if chat_history and len(chat_history) > 0:
-                    preview = chat_history[0]['content']
-                    preview = preview[:100] + '...' if len(preview) > 100 else preview
-
-                chats.append({
-                    'id': chat.id,
-                    'session_id': chat.session_id,
-                    'preview': preview,
-                    'pinned': chat.pinned,
-                    'created_at': chat.created_at.isoformat(),
-                    'updated_at': chat.updated_at.isoformat()
-                })
-
-            except Exception as e:
-                print(f"Error processing chat {chat.id}: {str(e)}")
-                continue
+                pinned, updated_at, last_id = decode_chat_cursor(cursor)
+            except ValueError:
+                return jsonify({"error": "Invalid cursor"}), 400
+            # Keyset: rows after the last one sent, in (pinned, updated_at, id) descending order
+            query = query.filter(
+                tuple_(ChatSession.pinned, ChatSession.updated_at, ChatSession.id) < tuple_(pinned, updated_at, last_id)
+            )
 
-        return json.dumps({"chats": chats}), 200, {'Content-Type': 'application/json'}
+        rows = query.order_by(
+            ChatSession.pinned.desc(),
+            ChatSession.updated_at.desc(),
+            ChatSession.id.desc()
+        ).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_chat_cursor(last.pinned, last.updated_at, last.id)
+
+        chats = [{
+            'id': row.id,
+            'session_id': row.session_id,
+            'preview': row.preview or "New Chat",
+            'pinned': bool(row.pinned),
+            'message_count': row.message_count or 0,
+            'last_message_at': row.last_message_at.isoformat() if row.last_message_at else None,
+            'created_at': row.created_at.isoformat(),
+            'updated_at': row.updated_at.isoformat()
+        } for row in rows]
+
+        return json.dumps({"chats": chats, "next_cursor": next_cursor}), 200, {'Content-Type': 'application/json'}
 
     except Exception as e:
         print(f"Error listing chats: {str(e)}")
@@ -790,7 +1115,10 @@ def list_chats():
 @csrf.exempt
 @login_required
 def load_chat(session_id):
-    """Load a specific chat session"""
+    """
+    Open a chat: returns its newest messages (?limit=, oldest first) and, when there are
+    older ones, a next_cursor to pass back as ?before= for the previous page
+    """
     try:
         # Clear any file-related session variables (always clear on chat load)
         for key in ['openai_file_ids', 'openai_file_names', 'openai_file_types']:
@@ -798,20 +1126,48 @@ def load_chat(session_id):
                 del session[key]
         session.modified = True
 
-        chat_session = ChatSession.query.filter_by(
+        chat_session = db.session.query(
+            ChatSession.id, ChatSession.project_id, ChatSession.message_count
+        ).filter_by(
             user_id=current_user.id,
             session_id=session_id
         ).first_or_404()
 
-        # Load chat history into session
-        chat_history_key = f'chat_history_{current_user.id}'
-        session[chat_history_key] = chat_session.get_chat_history()
-        session['current_session_id'] = session_id
-        session.modified = True
+        page_size = current_app.config.get('CHAT_TRANSCRIPT_PAGE_SIZE', 50)
+        limit = min(max(request.args.get('limit', page_size, type=int), 1), current_app.config.get('CHAT_TRANSCRIPT_MAX_PAGE_SIZE', 200))
+        before = request.args.get('before', type=int)
+
+        query = db.session.query(ChatMessage.id, ChatMessage.role, ChatMessage.content).filter(
+            ChatMessage.chat_session_id == chat_session.id
+        )
+        if before:
+            query = query.filter(ChatMessage.id < before)
+        rows = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1].id
+        chat_history = [{"role": row.role, "content": row.content} for row in reversed(rows)]
+
+        if next_cursor is None and chat_session.message_count:
+            # Reached the oldest row; chats stored before per-message rows existed may have
+            # older messages only in the stored history (see `flask backfill-chat-messages`)
+            row_count = db.session.query(func.count(ChatMessage.id)).filter(
+                ChatMessage.chat_session_id == chat_session.id
+            ).scalar()
+            if row_count < chat_session.message_count:
+                print(f"[Chat] Session {session_id} has {row_count} of {chat_session.message_count} messages as rows, adding the rest from the stored history")
+                stored = db.session.get(ChatSession, chat_session.id).get_chat_history()
+                chat_history = stored[:max(len(stored) - row_count, 0)] + chat_history
+
+        schedule_prewarm(current_user.id, chat_session.project_id)
 
         return json.dumps({
             'status': 'success',
-            'chat_history': chat_session.get_chat_history()
+            'chat_history': chat_history,
+            'message_count': chat_session.message_count,
+            'next_cursor': next_cursor
         }), 200, {'Content-Type': 'application/json'}
     except Exception as e:
         print(f"Error loading chat: {str(e)}")
@@ -829,24 +1185,15 @@ def delete_chat(session_id):
             session_id=session_id
         ).first_or_404()
 
-        # Check if this was the current chat
-        was_current_chat = session.get('current_session_id') == session_id
-
         # Delete the chat
+        project_id = chat_session.project_id
         db.session.delete(chat_session)
         db.session.commit()
-
-        # Clear session if this was the current chat
-        if was_current_chat:
-            chat_history_key = f'chat_history_{current_user.id}'
-            session[chat_history_key] = []
-            session['current_session_id'] = None
-            session.modified = True
+        invalidate_recent_project_context(project_id)
 
         return json.dumps({
             'status': 'success',
-            'message': 'Chat deleted successfully',
-            'was_current_chat': was_current_chat
+            'message': 'Chat deleted successfully'
         }), 200, {'Content-Type': 'application/json'}
     except Exception as e:
         print(f"Error deleting chat: {str(e)}")
@@ -879,14 +1226,11 @@ def toggle_pin(session_id):
 @chat_bp.route('/api/download/openai/<file_id>')
 @login_required
 def download_openai_file(file_id):
-    api_key = current_app.config.get('OPENAI_API_KEY')
-    url = f'https://api.openai.com/v1/files/{file_id}/content'
-    headers = {'Authorization': f'Bearer {api_key}'}
-    r = requests.get(url, headers=headers, stream=True)
-    if r.status_code == 200:
-        return send_file(BytesIO(r.content), download_name=f'{file_id}.png', mimetype='image/png')
-    else:
+    try:
+        content = get_openai_client().files.content(file_id).read()
+    except openai.NotFoundError:
         return jsonify({'error': 'File not found'}), 404
+    return send_file(BytesIO(content), download_name=f'{file_id}.png', mimetype='image/png')
 
 
 def upload_document_to_openai(document):
@@ -898,9 +1242,8 @@ def upload_document_to_openai(document):
             temp_path = temp.name
         
         # Upload to OpenAI
-        openai.api_key = current_app.config.get('OPENAI_API_KEY')
         with open(temp_path, 'rb') as file:
-            response = openai.files.create(
+            response = get_openai_client().files.create(
                 file=file,
                 purpose="assistants"
             )
@@ -1067,6 +1410,12 @@ def upload_document():
                 content=content
             )
             db.session.add(document)
+            record_project_activity(
+                project_id,
+                documents=1,
+                tokens=estimate_tokens(content) if isinstance(content, str) else file_size // 4
+            )
+            record_daily_activity(current_user.organization_id, uploads=1)
             db.session.commit()
 
         # 5. Return document info
@@ -1156,6 +1505,7 @@ def update_profile():
         survey.learning_goals = request.form.get('learning_goals')
         
         db.session.commit()
+        invalidate_chat_context(user_id=current_user.id)
         flash('Profile updated successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -13,11 +13,14 @@ from datetime import datetime
 from functools import wraps
 import uuid
 from app.services.auth_decorators import login_required, admin_required
+from app.services.read_replica import read_replica
 from app.models.models import Document, DocumentChunk, Project
 from app.extensions import db
+from app.services.project_memory_service import record_project_activity
+from app.services.activity_rollup_service import record_daily_activity
+from app.services.llm_clients import get_openai_client
 from typing import Generator, List, Optional, Union
 from dataclasses import dataclass, asdict
-import openai
 import os
 
 document_bp = Blueprint('document_bp', __name__)
@@ -117,7 +120,7 @@ def chunk_document(content: str) -> Generator[Union[ProcessingProgress, Document
         yield chunk
 
 
-def process_file(file, project_id: int) -> Generator[Union[ProcessingProgress, tuple], None, None]:
+def process_file(file, project_id: int, user_id: int, organization_id: Optional[int] = None) -> Generator[Union[ProcessingProgress, tuple], None, None]:
     """Process file and yield progress updates"""
     filename = file.filename
     file_extension = filename.split('.')[-1].lower()
@@ -175,7 +178,7 @@ def process_file(file, project_id: int) -> Generator[Union[ProcessingProgress, t
 
         # Create database document record
         document = Document(
-            user_id=current_user.id,
+            user_id=user_id,
             project_id=project_id,
             filename=filename,
             file_type=file_extension,
@@ -211,6 +214,8 @@ def process_file(file, project_id: int) -> Generator[Union[ProcessingProgress, t
         document.total_chunks = len(chunks)
         document.token_count = total_tokens
         document.is_processed = True
+        record_project_activity(project_id, documents=1, tokens=total_tokens)
+        record_daily_activity(organization_id, uploads=1)
         db.session.commit()
 
         yield (document, chunks)
@@ -254,6 +259,12 @@ def upload_document():
         return jsonify({'error': 'Invalid project'}), 404
 
     file = request.files['file']
+    user_id = current_user.id
+    organization_id = current_user.organization_id
+    project_id = project.id
+    # Hand the pooled connection back before uploading to OpenAI and extracting the file;
+    # process_file re-acquires one only to write the document and its chunks
+    db.session.close()
 
     # Clear any previous file info in session before storing new upload
     for key in ['openai_file_ids', 'openai_file_names', 'openai_file_types']:
@@ -262,8 +273,7 @@ def upload_document():
     session.modified = True
 
     # Upload file to OpenAI and store file_id in session
-    openai.api_key = current_app.config.get('OPENAI_API_KEY')
-    openai_file = openai.files.create(file=(file.filename, file.stream, "application/octet-stream"), purpose='assistants')
+    openai_file = get_openai_client().files.create(file=(file.filename, file.stream, "application/octet-stream"), purpose='assistants')
     file_id = openai_file.id
     file.seek(0)  # Reset file pointer so backend processing works
     if 'openai_file_ids' not in session:
@@ -293,7 +303,7 @@ def upload_document():
             final_document = None
             final_chunks = None
 
-            for result in process_file(file, project.id):
+            for result in process_file(file, project_id, user_id, organization_id):
                 if isinstance(result, ProcessingProgress):
                     yield f"data: {json.dumps(asdict(result))}\n\n"
                 elif isinstance(result, tuple) and len(result) == 2:
@@ -322,6 +332,7 @@ def upload_document():
 
 @document_bp.route('/api/documents', methods=['GET'])
 @login_required
+@read_replica
 def get_documents():
     """Get all documents for the current user and project"""
     try:
@@ -82,8 +82,8 @@ def update_project_memory(project_id):
         # Verify project belongs to user
         project = Project.query.filter_by(id=project_id, user_id=current_user.id).first_or_404()
         
-        # Force memory update
-        memory = get_incremental_project_memory(project_id)
+        # Force memory update (waits for a rebuild already running in another worker)
+        memory = get_incremental_project_memory(project_id, wait=True)
         
         if memory:
             return jsonify({
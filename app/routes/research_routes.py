@@ -1,7 +1,9 @@
 from flask import Blueprint, request, jsonify, current_app, send_file
 from flask_login import login_required, current_user
 from app.services.perplexity_service import PerplexityService
+from app.services.rate_limiter import RateLimitExceeded
 from app.services.auth_decorators import login_required
+from app.services.read_replica import read_replica
 from app.extensions import db
 from app.models.models import ResearchSession
 from datetime import datetime
@@ -52,12 +54,17 @@ def research_topic():
             "session_id": research_session.id
         })
 
+    except RateLimitExceeded as e:
+        return jsonify({"error": "Research is busy right now, please try again in a moment."}), 429, {
+            'Retry-After': str(int(e.retry_after) + 1)
+        }
     except Exception as e:
         current_app.logger.error(f"Research error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @research_bp.route('/api/research/history', methods=['GET'])
 @login_required
+@read_replica
 def get_research_history():
     """Get research history for the current project"""
     try:
@@ -21,6 +21,9 @@ from typing import Generator, List, Optional, Union
 from app.admin.forms import SignupForm
 from app.models.models import User, Project, UserSurvey
 from app import db
+from app.services.rate_limiter import acquire, report_rate_limited, retry_after_seconds, estimate_request_tokens
+from app.services.llm_clients import get_anthropic_client
+from app.services.api_log_service import log_api_usage, anthropic_stream_text
 
 chat_bp = Blueprint('chat_bp', __name__)
 csrf = CSRFProtect()
@@ -694,17 +697,20 @@ def stream_claude_response(client, message_args, user_id):
     print(f"Message count: {len(message_args.get('messages', []))}")
     print(f"System message count: {len(message_args.get('system', [])) if 'system' in message_args else 0}")
 
+    acquire('anthropic', message_args.get('model'), estimate_request_tokens(message_args.get('messages'), message_args.get('system')))
     try:
         stream = client.messages.stream(**message_args)
         return stream
     except Exception as e:
+        if isinstance(e, anthropic.RateLimitError):
+            report_rate_limited('anthropic', message_args.get('model'), retry_after_seconds(e))
         print(f"\nError in stream_claude_response: {str(e)}")
         print("Headers if available:", getattr(e, 'response', {}).headers if hasattr(e, 'response') else 'No headers')
         raise
 
 def claude_stream(messages, user_id, system_messages=None):
     api_key = get_api_key()
-    client = anthropic.Anthropic(
+    client = get_anthropic_client(
         api_key=api_key,
         default_headers={
             "anthropic-version": "2023-06-01",
@@ -730,9 +736,10 @@ def claude_stream(messages, user_id, system_messages=None):
             }
 
             try:
+                usage = {}
                 with stream_claude_response(client, message_args, user_id) as stream:
                     buffer = ""
-                    for text in stream.text_stream:
+                    for text in anthropic_stream_text(stream, usage):
                         buffer += text
                         if len(buffer) >= 20 or text.endswith(('.', '!', '?', '\n')):
                             yield json.dumps({"chunk": buffer}) + "\n"
@@ -752,6 +759,9 @@ def claude_stream(messages, user_id, system_messages=None):
                             "content": final_message.content
                         })
                         session.modified = True
+                # user_id here is the anonymous session id, not a user row
+                log_api_usage(message_args["model"], usage, prompt=messages[-1]["content"] if messages else None,
+                              thread_id=user_id)
 
             except anthropic.RateLimitError as e:
                 print(f"Rate limit error: {str(e)}")
@@ -0,0 +1,46 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_login import current_user
+from app.services.auth_decorators import login_required
+from app.services.search_service import search, KIND_CHAT, KIND_RESEARCH
+
+search_bp = Blueprint('search_bp', __name__)
+
+MAX_SEARCH_RESULTS = 100
+
+
+@search_bp.route('/api/search', methods=['GET'])
+@login_required
+def search_history():
+    """Full-text search over the current user's chat messages and research"""
+    try:
+        query_text = (request.args.get('q') or '').strip()
+        if not query_text:
+            return jsonify({"error": "Query is required"}), 400
+
+        project_id = request.args.get('project_id', type=int)
+        limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_SEARCH_RESULTS)
+        kind = request.args.get('kind')
+        kinds = None
+        if kind:
+            if kind not in (KIND_CHAT, KIND_RESEARCH):
+                return jsonify({"error": "kind must be 'chat' or 'research'"}), 400
+            kinds = [kind]
+
+        results = search(
+            current_user.id,
+            query_text,
+            project_id=project_id,
+            kinds=kinds,
+            limit=limit,
+            match_any=request.args.get('match') == 'any'
+        )
+
+        return jsonify({
+            "status": "success",
+            "query": query_text,
+            "results": results
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Search error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
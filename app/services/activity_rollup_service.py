@@ -0,0 +1,140 @@
+from app.extensions import db
+from app.models.models import APILog, ChatMessage, ChatSession, DailyActivity, Document, LoginRecord, User
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from threading import Lock
+import time
+
+# Daily activity rollups for the admin dashboard. Writes add to today's row for the user's
+# organization as they happen; `flask rollup-activity` (hourly cron in render.yaml) recomputes recent days
+# from the source tables to correct any drift. The dashboard reads only the rollup rows.
+
+COUNTERS = ('sessions', 'messages', 'logins', 'uploads', 'tokens')
+
+# days -> {'built_at', 'activity'}
+_dashboard_cache = {}
+_dashboard_lock = Lock()
+
+
+def record_daily_activity(organization_id, sessions=0, messages=0, logins=0, uploads=0, tokens=0, day=None):
+    """
+    Add to an organization's counters for a day (default today, UTC).
+    Runs inside the caller's transaction; the caller commits.
+    """
+    counts = {'sessions': sessions, 'messages': messages, 'logins': logins, 'uploads': uploads, 'tokens': tokens}
+    if not any(counts.values()):
+        return
+    day = day or datetime.utcnow().date()
+    organization_id = organization_id or 0
+    values = {name: getattr(DailyActivity, name) + count for name, count in counts.items() if count}
+    values['updated_at'] = datetime.utcnow()
+    updated = DailyActivity.query.filter_by(day=day, organization_id=organization_id).update(values, synchronize_session=False)
+    if updated:
+        return
+
+    # First write for this organization today: create the row
+    try:
+        with db.session.begin_nested():
+            db.session.add(DailyActivity(day=day, organization_id=organization_id, **counts))
+    except IntegrityError:
+        # Another request created it first
+        DailyActivity.query.filter_by(day=day, organization_id=organization_id).update(values, synchronize_session=False)
+
+
+def record_api_tokens(rows):
+    """Add the tokens of a batch of APILog rows (dicts) to the rollups; the caller commits"""
+    user_ids = {row['user_id'] for row in rows if row.get('user_id')}
+    organizations = dict(
+        db.session.query(User.id, User.organization_id).filter(User.id.in_(user_ids)).all()
+    ) if user_ids else {}
+    totals = {}
+    for row in rows:
+        tokens = (row.get('prompt_tokens') or 0) + (row.get('completion_tokens') or 0)
+        if tokens:
+            key = (row['timestamp'].date(), organizations.get(row.get('user_id')) or 0)
+            totals[key] = totals.get(key, 0) + tokens
+    for (day, organization_id), tokens in totals.items():
+        record_daily_activity(organization_id, tokens=tokens, day=day)
+
+
+def _as_date(value):
+    # func.date() gives a date on Postgres and an ISO string on SQLite
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def rollup_daily_activity(days=2):
+    """
+    Recompute the last `days` days (today included) from the source tables and replace
+    their rollup rows. Returns the number of rows written.
+    """
+    start_day = datetime.utcnow().date() - timedelta(days=days - 1)
+    start = datetime.combine(start_day, datetime.min.time())
+    organization = func.coalesce(User.organization_id, 0)
+    sources = {
+        'sessions': (ChatSession.created_at, ChatSession.user_id, func.count(ChatSession.id)),
+        'messages': (ChatMessage.created_at, ChatMessage.user_id, func.count(ChatMessage.id)),
+        'logins': (LoginRecord.login_time, LoginRecord.user_id, func.count(LoginRecord.id)),
+        'uploads': (Document.created_at, Document.user_id, func.count(Document.id)),
+        'tokens': (APILog.timestamp, APILog.user_id,
+                   func.sum(func.coalesce(APILog.prompt_tokens, 0) + func.coalesce(APILog.completion_tokens, 0))),
+    }
+    totals = {}
+    for name, (timestamp, user_id, aggregate) in sources.items():
+        day = func.date(timestamp)
+        rows = (
+            db.session.query(day, organization, aggregate)
+            .select_from(timestamp.class_)
+            .outerjoin(User, User.id == user_id)
+            .filter(timestamp >= start)
+            .group_by(day, organization)
+            .all()
+        )
+        for row_day, organization_id, value in rows:
+            key = (_as_date(row_day), organization_id)
+            totals.setdefault(key, dict.fromkeys(COUNTERS, 0))[name] = int(value or 0)
+
+    try:
+        DailyActivity.query.filter(DailyActivity.day >= start_day).delete(synchronize_session=False)
+        db.session.add_all(
+            DailyActivity(day=day, organization_id=organization_id, **counts)
+            for (day, organization_id), counts in totals.items()
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    with _dashboard_lock:
+        _dashboard_cache.clear()
+    return len(totals)
+
+
+def get_daily_activity(days=14):
+    """
+    Totals per day (all organizations) for the last `days` days, oldest first, from the
+    rollups. Cached per process for DASHBOARD_CACHE_TTL_SECONDS.
+    """
+    ttl = current_app.config.get('DASHBOARD_CACHE_TTL_SECONDS', 60)
+    with _dashboard_lock:
+        cached = _dashboard_cache.get(days)
+    if cached and time.monotonic() - cached['built_at'] < ttl:
+        return cached['activity']
+
+    start_day = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = (
+        db.session.query(DailyActivity.day, *(func.sum(getattr(DailyActivity, name)) for name in COUNTERS))
+        .filter(DailyActivity.day >= start_day)
+        .group_by(DailyActivity.day)
+        .all()
+    )
+    by_day = {_as_date(row[0]): row[1:] for row in rows}
+    activity = []
+    for i in range(days):
+        day = start_day + timedelta(days=i)
+        values = by_day.get(day, (0,) * len(COUNTERS))
+        activity.append({'date': day.strftime('%Y-%m-%d'), **{name: int(value or 0) for name, value in zip(COUNTERS, values)}})
+
+    with _dashboard_lock:
+        _dashboard_cache[days] = {'built_at': time.monotonic(), 'activity': activity}
+    return activity
@@ -0,0 +1,182 @@
+from app.models.models import APILog
+from app.services.activity_rollup_service import record_api_tokens
+from app.extensions import db
+from collections import deque
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from threading import Event, Lock, Thread
+import atexit
+import os
+
+# APILog rows are queued in memory and written by a background thread in bulk inserts, so
+# logging usage never adds a commit to the request (or the stream) that made the LLM call.
+
+_queue = deque()
+_queue_lock = Lock()
+_wakeup = Event()
+_writer_pid = None
+
+
+def openai_usage(usage):
+    """Token counts from an OpenAI usage object (chat completion or assistant run)"""
+    if usage is None:
+        return None
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': usage.prompt_tokens,
+        'completion_tokens': usage.completion_tokens,
+        'cache_tokens': getattr(details, 'cached_tokens', None) if details else None,
+    }
+
+
+def anthropic_usage(usage):
+    """Token counts from an Anthropic usage object; prompt_tokens includes cache reads and writes"""
+    if usage is None:
+        return None
+    cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+    cache_write = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    return {
+        'prompt_tokens': usage.input_tokens + cache_read + cache_write,
+        'completion_tokens': usage.output_tokens,
+        'cache_tokens': cache_read,
+    }
+
+
+def gemini_usage(usage_metadata):
+    """Token counts from a Gemini response's usage_metadata"""
+    if usage_metadata is None:
+        return None
+    return {
+        'prompt_tokens': getattr(usage_metadata, 'prompt_token_count', None),
+        'completion_tokens': getattr(usage_metadata, 'candidates_token_count', None),
+        'cache_tokens': getattr(usage_metadata, 'cached_content_token_count', None),
+    }
+
+
+def anthropic_stream_text(stream, usage):
+    """
+    Yield the text deltas of an Anthropic message stream, filling the `usage` dict from
+    message_start (input and cache tokens) and the closing message_delta (output tokens)
+    """
+    for event in stream:
+        if event.type == 'message_start':
+            usage.update(anthropic_usage(event.message.usage))
+        elif event.type == 'message_delta' and getattr(event, 'usage', None):
+            usage['completion_tokens'] = event.usage.output_tokens
+        elif event.type == 'content_block_delta' and event.delta.type == 'text_delta':
+            yield event.delta.text
+
+
+def log_api_usage(model, usage, prompt=None, thread_id=None, user_id=None):
+    """
+    Queue an APILog row for one provider call. `usage` is the dict from openai_usage,
+    anthropic_usage or gemini_usage; calls the provider reported no usage for are skipped.
+    """
+    if not usage:
+        return
+    max_queue = current_app.config.get('API_LOG_MAX_QUEUE', 10000)
+    row = {
+        'timestamp': datetime.utcnow(),
+        'prompt': prompt if prompt is None or isinstance(prompt, str) else str(prompt),
+        'prompt_tokens': usage.get('prompt_tokens'),
+        'completion_tokens': usage.get('completion_tokens'),
+        'cache_tokens': usage.get('cache_tokens'),
+        'model': (model or '')[:50],
+        'thread_id': thread_id if thread_id is None else str(thread_id)[:100],
+        'user_id': user_id,
+    }
+    with _queue_lock:
+        if len(_queue) >= max_queue:
+            _queue.popleft()
+            print(f"[APILog] Queue full ({max_queue}), dropped the oldest entry")
+        _queue.append(row)
+        queued = len(_queue)
+    _start_writer(current_app._get_current_object())
+    if queued >= current_app.config.get('API_LOG_BATCH_SIZE', 200):
+        _wakeup.set()
+
+
+def _start_writer(app):
+    """Start the writer thread once per process (gunicorn forks workers after import)"""
+    global _writer_pid
+    with _queue_lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+    Thread(target=_write_loop, args=(app,), daemon=True, name='api-log-writer').start()
+    atexit.register(_flush_in_context, app)
+
+
+def _write_loop(app):
+    interval = app.config.get('API_LOG_FLUSH_SECONDS', 2.0)
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        _flush_in_context(app)
+
+
+def _flush_in_context(app):
+    try:
+        with app.app_context():
+            try:
+                flush_api_logs()
+            finally:
+                db.session.remove()
+    except Exception as e:
+        print(f"[APILog] Flush failed: {e}")
+
+
+def flush_api_logs():
+    """
+    Write everything queued so far in bulk inserts of API_LOG_BATCH_SIZE rows.
+    A batch the database rejects is retried row by row and the rows that fail again are dropped;
+    if the database is unreachable the batch goes back on the queue for the next flush.
+    Commits the current session, so call it from the writer thread or a CLI command, not mid-request.
+    """
+    batch_size = current_app.config.get('API_LOG_BATCH_SIZE', 200)
+    written = 0
+    while True:
+        with _queue_lock:
+            batch = [_queue.popleft() for _ in range(min(batch_size, len(_queue)))]
+        if not batch:
+            return written
+        try:
+            _insert_rows(batch)
+            written += len(batch)
+            continue
+        except OperationalError as e:
+            _requeue(batch, e)
+            return written
+        except Exception as e:
+            db.session.rollback()
+            print(f"[APILog] Failed to write {len(batch)} rows, retrying one at a time: {e}")
+        for i, row in enumerate(batch):
+            try:
+                _insert_rows([row])
+                written += 1
+            except OperationalError as e:
+                _requeue(batch[i:], e)
+                return written
+            except Exception as e:
+                db.session.rollback()
+                print(f"[APILog] Dropped row (model={row.get('model')}, thread_id={row.get('thread_id')}): {e}")
+
+
+def _insert_rows(rows):
+    db.session.execute(insert(APILog), rows)
+    record_api_tokens(rows)
+    db.session.commit()
+
+
+def _requeue(rows, error):
+    db.session.rollback()
+    with _queue_lock:
+        _queue.extendleft(reversed(rows))
+    print(f"[APILog] Database unavailable, {len(rows)} rows will retry: {error}")
+
+
+def pending_api_logs():
+    with _queue_lock:
+        return len(_queue)
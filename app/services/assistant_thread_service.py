@@ -0,0 +1,192 @@
+from app.models.models import AssistantThread
+from app.extensions import db
+from app.services.llm_clients import get_openai_client
+from datetime import datetime, timedelta
+from flask import current_app
+from threading import Lock, Thread
+from sqlalchemy.exc import IntegrityError
+import time
+
+# Assistants API threads are kept per chat session so each turn only posts what the thread
+# has not seen yet. New sessions take a pre-created thread from a small pool.
+MAX_ADDITIONAL_MESSAGES = 32  # Most messages a single runs.create call accepts inline
+
+# Run states that will not change again
+RUN_TERMINAL_STATUSES = {'completed', 'failed', 'cancelled', 'expired', 'incomplete'}
+
+_refill_lock = Lock()
+_refill_running = False
+
+
+class AssistantRunTimeout(Exception):
+    """A run was still going at its deadline (ASSISTANT_RUN_TIMEOUT_SECONDS) and has been cancelled"""
+
+
+def cancel_run(client, thread_id, run_id):
+    """Cancel an abandoned run so it stops consuming tokens and unlocks the thread"""
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        print(f"[Assistant] Run cancelled: {run_id}")
+    except Exception as e:
+        print(f"[Assistant] Error cancelling run {run_id}: {e}")
+
+
+def poll_run(client, thread_id, run_id, deadline, initial_delay=0.1, max_delay=2.0):
+    """
+    Wait for an existing run to finish, polling with adaptive backoff: quick checks while
+    short answers are likely, slowing down to max_delay for long runs. Runs waiting on a
+    tool call are cancelled (no tools are wired up); runs past `deadline` (monotonic) are
+    cancelled and raise AssistantRunTimeout.
+    """
+    delay = initial_delay
+    while True:
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+        if run.status in RUN_TERMINAL_STATUSES:
+            return run
+        if run.status == 'requires_action':
+            print(f"[Assistant] Run requires action, cancelling: {run_id}")
+            cancel_run(client, thread_id, run_id)
+            return run
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            cancel_run(client, thread_id, run_id)
+            raise AssistantRunTimeout(f"Run did not finish within the deadline (run {run_id}, status {run.status})")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 1.5, max_delay)
+
+
+def run_reply_text(client, thread_id, run_id):
+    """Text of the assistant message a finished run wrote"""
+    messages = client.beta.threads.messages.list(thread_id=thread_id, run_id=run_id, limit=1)
+    if not messages.data:
+        return ''
+    return ''.join(block.text.value for block in messages.data[0].content if getattr(block, 'text', None))
+
+
+def get_session_thread(chat_session_id):
+    """
+    Return the AssistantThread for a chat session (by ChatSession.id), assigning one from
+    the pool (or creating one) the first time the session uses the Assistants API
+    """
+    thread = AssistantThread.query.filter_by(chat_session_id=chat_session_id).first()
+    if thread:
+        return thread
+
+    thread = _claim_pooled_thread(chat_session_id)
+    if thread is None:
+        remote = get_openai_client().beta.threads.create()
+        thread = AssistantThread(thread_id=remote.id, chat_session_id=chat_session_id, synced_messages=0)
+        db.session.add(thread)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request for the same session assigned a thread first
+            db.session.rollback()
+            thread = AssistantThread.query.filter_by(chat_session_id=chat_session_id).first()
+        print(f"[Assistant] Created thread {thread.thread_id} (pool empty)")
+    else:
+        print(f"[Assistant] Assigned pooled thread {thread.thread_id}")
+
+    start_thread_pool_refill()
+    return thread
+
+
+def _claim_pooled_thread(chat_session_id, attempts=3):
+    """Atomically take an unassigned thread; concurrent claimers skip rows taken by others"""
+    max_age = current_app.config.get('ASSISTANT_THREAD_POOL_MAX_AGE_HOURS', 24)
+    cutoff = datetime.utcnow() - timedelta(hours=max_age)
+    for _ in range(attempts):
+        candidate = db.session.query(AssistantThread.id).filter(
+            AssistantThread.chat_session_id.is_(None),
+            AssistantThread.created_at >= cutoff
+        ).order_by(AssistantThread.created_at).first()
+        if candidate is None:
+            return None
+        try:
+            claimed = AssistantThread.query.filter(
+                AssistantThread.id == candidate.id,
+                AssistantThread.chat_session_id.is_(None)
+            ).update({'chat_session_id': chat_session_id}, synchronize_session=False)
+            db.session.commit()
+        except IntegrityError:
+            # The session already has a thread (assigned by a concurrent request)
+            db.session.rollback()
+            return AssistantThread.query.filter_by(chat_session_id=chat_session_id).first()
+        if claimed:
+            return db.session.get(AssistantThread, candidate.id)
+    return None
+
+
+def get_unsynced_messages(thread, messages):
+    """The part of the transcript the remote thread has not seen"""
+    if thread.synced_messages > len(messages):
+        # Transcript shrank (e.g. edited history); the thread can't be trusted to match it
+        return None
+    return messages[thread.synced_messages:]
+
+
+def reset_session_thread(thread):
+    """Point a session at a fresh remote thread, e.g. after its transcript diverged"""
+    remote = get_openai_client().beta.threads.create()
+    thread.thread_id = remote.id
+    thread.synced_messages = 0
+    db.session.commit()
+    return thread
+
+
+def mark_thread_synced(thread, message_count):
+    thread.synced_messages = message_count
+    thread.last_used_at = datetime.utcnow()
+    db.session.commit()
+
+
+def start_thread_pool_refill():
+    """Top the pool back up in the background so the next new session doesn't wait on threads.create"""
+    global _refill_running
+    with _refill_lock:
+        if _refill_running:
+            return
+        _refill_running = True
+    app = current_app._get_current_object()
+    Thread(target=_refill_thread_pool, args=(app,), daemon=True).start()
+
+
+def _refill_thread_pool(app):
+    global _refill_running
+    try:
+        with app.app_context():
+            try:
+                fill_thread_pool()
+            finally:
+                db.session.remove()
+    except Exception as e:
+        print(f"[Assistant] Thread pool refill failed: {e}")
+    finally:
+        with _refill_lock:
+            _refill_running = False
+
+
+def fill_thread_pool():
+    """Create threads until the pool holds ASSISTANT_THREAD_POOL_SIZE fresh ones; stale pooled rows are dropped"""
+    target = current_app.config.get('ASSISTANT_THREAD_POOL_SIZE', 5)
+    max_age = current_app.config.get('ASSISTANT_THREAD_POOL_MAX_AGE_HOURS', 24)
+    cutoff = datetime.utcnow() - timedelta(hours=max_age)
+
+    AssistantThread.query.filter(
+        AssistantThread.chat_session_id.is_(None),
+        AssistantThread.created_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+    available = AssistantThread.query.filter(AssistantThread.chat_session_id.is_(None)).count()
+    created = 0
+    client = get_openai_client()
+    for _ in range(max(target - available, 0)):
+        remote = client.beta.threads.create()
+        db.session.add(AssistantThread(thread_id=remote.id, synced_messages=0))
+        db.session.commit()
+        created += 1
+    if created:
+        print(f"[Assistant] Added {created} threads to the pool")
+    return created
@@ -1,62 +1,340 @@
-from app.models.models import ChatSession, UserChatMemory
+from app.models.models import ChatMessage, UserChatMemory, MemoryBatch
 from app.extensions import db
+from app.services.memory_lock_service import single_flight
+from app.services.rate_limiter import acquire, report_rate_limited, retry_after_seconds, estimate_request_tokens
+from app.services.llm_scheduler import llm_slot, BACKGROUND, BULK
+from app.services.llm_clients import get_openai_client
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from threading import Lock
+from sqlalchemy import func, or_
+import tenacity
+from tenacity import retry, stop_after_attempt, wait_exponential
+import io
+import json
 import openai
+import time
 
-def generate_user_memory(user_id):
-    memory = UserChatMemory.query.filter_by(user_id=user_id).first()
-    last_update = memory.last_updated if memory else None
+SUMMARY_PROMPT = (
+    "Summarize the key topics, facts, and user preferences from the following chat history. "
+    "Be concise, do not include sensitive information, and focus on recurring themes or important details:\n\n"
+)
+
+
+class RequestPacer:
+    """Spaces out requests from any number of threads to stay under a requests-per-minute budget"""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0
+        self.lock = Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _memory_settings():
+    from flask import current_app
+    return {
+        'model': current_app.config.get('OPENAI_SUMMATION_MODEL', 'gpt-4.1-nano'),
+        'max_tokens': current_app.config.get('USER_MEMORY_MAX_TOKENS', 512),
+        'chunk_chars': current_app.config.get('USER_MEMORY_CHUNK_CHARS', 24000),
+        'workers': current_app.config.get('USER_MEMORY_BATCH_WORKERS', 4),
+        'rpm': current_app.config.get('USER_MEMORY_BATCH_RPM', 60),
+    }
 
-    # Only fetch new chat sessions since last update
-    query = ChatSession.query.filter_by(user_id=user_id)
-    if last_update:
-        query = query.filter(ChatSession.created_at > last_update)
-    new_sessions = query.order_by(ChatSession.created_at).all()
 
-    if not new_sessions:
+def generate_user_memory(user_id, wait=False, pacer=None, priority=BACKGROUND):
+    """
+    Refresh the user's chat memory with messages written since the last update.
+    Only one worker rebuilds a user's memory at a time; concurrent callers get the
+    current memory, or wait for the in-flight rebuild when wait=True.
+    """
+    with single_flight(f"user_memory:{user_id}", wait=wait) as acquired:
+        if not acquired:
+            db.session.expire_all()
+            return UserChatMemory.query.filter_by(user_id=user_id).first()
+        return _generate_user_memory(user_id, pacer, priority)
+
+
+def _get_new_messages(user_id, memory):
+    query = ChatMessage.query.filter_by(user_id=user_id)
+    if memory and memory.last_updated:
+        query = query.filter(ChatMessage.created_at > memory.last_updated)
+    return query.order_by(ChatMessage.created_at, ChatMessage.id).all()
+
+
+def split_history_text(lines, max_chars):
+    """
+    Group formatted message lines into chunks of at most max_chars (a single oversized line is cut)
+    """
+    chunks = []
+    current = []
+    current_len = 0
+    for line in lines:
+        while len(line) > max_chars:
+            if current:
+                chunks.append('\n'.join(current))
+                current, current_len = [], 0
+            chunks.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and current_len + len(line) + 1 > max_chars:
+            chunks.append('\n'.join(current))
+            current, current_len = [], 0
+        current.append(line)
+        current_len += len(line) + 1
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def _generate_user_memory(user_id, pacer=None, priority=BACKGROUND):
+    memory = UserChatMemory.query.filter_by(user_id=user_id).first()
+    new_messages = _get_new_messages(user_id, memory)
+
+    if not new_messages:
         return memory  # No update needed
 
-    # Gather all previous memory (if any)
+    settings = _memory_settings()
     previous_memory = memory.memory_text if memory else ""
-    # Gather new chat content
-    new_messages = []
-    for session in new_sessions:
-        new_messages.extend(session.get_chat_history())
-    new_history_text = '\n'.join(
-        f"{msg['role'].capitalize()}: {msg['content']}" for msg in new_messages
-    )
+    lines = [f"{msg.role.capitalize()}: {msg.content}" for msg in new_messages]
+    chunks = split_history_text(lines, settings['chunk_chars'])
 
-    # Summarize: combine previous memory and new history
-    if previous_memory:
-        summary_input = previous_memory + '\n' + new_history_text
+    if len(chunks) == 1:
+        # Summarize: combine previous memory and new history
+        summary_input = previous_memory + '\n' + chunks[0] if previous_memory else chunks[0]
     else:
-        summary_input = new_history_text
-    summary = summarize_with_llm(summary_input)
+        # Too large for one call: summarize each chunk, then merge the partial summaries
+        partials = [summarize_with_llm(chunk, pacer=pacer, priority=priority) for chunk in chunks]
+        summary_input = '\n'.join(filter(None, [previous_memory] + partials))
+    summary = summarize_with_llm(summary_input, pacer=pacer, priority=priority)
+
+    # Only messages actually summarized are marked as done
+    return save_user_memory(user_id, summary, new_messages[-1].created_at)
+
 
+def save_user_memory(user_id, summary, covered_until):
+    memory = UserChatMemory.query.filter_by(user_id=user_id).first()
     if not memory:
-        memory = UserChatMemory(user_id=user_id, memory_text=summary, last_updated=datetime.utcnow())
+        memory = UserChatMemory(user_id=user_id, memory_text=summary, last_updated=covered_until)
         db.session.add(memory)
     else:
         memory.memory_text = summary
-        memory.last_updated = datetime.utcnow()
+        memory.last_updated = covered_until
     db.session.commit()
+    from app.services.prewarm_service import invalidate_chat_context
+    invalidate_chat_context(user_id=user_id)
     return memory
 
-def summarize_with_llm(history_text):
-    prompt = (
-        "Summarize the key topics, facts, and user preferences from the following chat history. "
-        "Be concise, do not include sensitive information, and focus on recurring themes or important details:\n\n"
-        f"{history_text}"
-    )
-    client = openai.OpenAI()  # Assumes API key is set in environment or config
-    response = client.chat.completions.create(
-        model="gpt-4.1-nano",  # Using summation model for memory generation
-        messages=[{"role": "system", "content": prompt}],
-        max_tokens=512,
-        temperature=0.2,
-    )
+
+def build_summary_request(history_text):
+    settings = _memory_settings()
+    return {
+        'model': settings['model'],
+        'messages': [{"role": "system", "content": SUMMARY_PROMPT + history_text}],
+        'max_tokens': settings['max_tokens'],
+        'temperature': 0.2,
+    }
+
+
+@retry(
+    retry=tenacity.retry_if_exception_type(openai.RateLimitError),
+    wait=wait_exponential(multiplier=1, min=2, max=30),
+    stop=stop_after_attempt(5),
+    before_sleep=lambda retry_state: print(f"Summarization rate limited, waiting {retry_state.next_action.sleep} seconds..."),
+)
+def summarize_with_llm(history_text, pacer=None, priority=BACKGROUND):
+    from flask import current_app
+    if pacer:
+        pacer.wait()
+    request_args = build_summary_request(history_text)
+    with llm_slot(priority):
+        acquire('openai', request_args['model'], estimate_request_tokens(history_text, output_tokens=request_args['max_tokens']),
+                max_wait=current_app.config.get('RATE_LIMIT_BACKGROUND_WAIT_SECONDS', 120), background=True)
+        client = get_openai_client()
+        try:
+            response = client.chat.completions.create(**request_args)
+        except openai.RateLimitError as e:
+            report_rate_limited('openai', request_args['model'], retry_after_seconds(e))
+            raise
     return response.choices[0].message.content.strip()
 
+
 def get_user_memory(user_id):
     memory = UserChatMemory.query.filter_by(user_id=user_id).first()
-    return memory.memory_text if memory else None 
\ No newline at end of file
+    return memory.memory_text if memory else None
+
+
+def find_users_with_new_activity(limit=None):
+    """
+    User ids with chat messages newer than their stored memory (or no memory yet)
+    """
+    query = db.session.query(ChatMessage.user_id).outerjoin(
+        UserChatMemory, UserChatMemory.user_id == ChatMessage.user_id
+    ).filter(
+        or_(UserChatMemory.last_updated.is_(None), ChatMessage.created_at > UserChatMemory.last_updated)
+    ).group_by(ChatMessage.user_id).order_by(func.min(ChatMessage.created_at))
+    if limit:
+        query = query.limit(limit)
+    return [row.user_id for row in query.all()]
+
+
+def refresh_user_memories(max_workers=None, requests_per_minute=None, limit=None):
+    """
+    Scheduled job: refresh UserChatMemory for every user with new activity.
+    Runs with bounded concurrency and paces LLM calls to the provider's rate limit.
+    """
+    from flask import current_app
+    app = current_app._get_current_object()
+    settings = _memory_settings()
+    max_workers = max_workers or settings['workers']
+    pacer = RequestPacer(requests_per_minute or settings['rpm'])
+
+    user_ids = find_users_with_new_activity(limit=limit)
+    results = {'users': len(user_ids), 'updated': 0, 'skipped': 0, 'failed': 0}
+    if not user_ids:
+        return results
+
+    def refresh(user_id):
+        with app.app_context():
+            try:
+                memory = generate_user_memory(user_id, pacer=pacer, priority=BULK)
+                return 'updated' if memory else 'skipped'
+            finally:
+                db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(refresh, user_id): user_id for user_id in user_ids}
+        for future in as_completed(futures):
+            try:
+                results[future.result()] += 1
+            except Exception as e:
+                print(f"User memory refresh failed for user {futures[future]}: {e}")
+                results['failed'] += 1
+    return results
+
+
+# Offline mode: the same work submitted through the provider's batch endpoint.
+# Requests are keyed "user:<id>:<covered-until>:<part>:<parts>" so results can be applied later.
+
+def _custom_id(user_id, covered_until, part, parts):
+    return f"user:{user_id}:{covered_until.isoformat()}:{part}:{parts}"
+
+
+def _parse_custom_id(custom_id):
+    _, user_id, rest = custom_id.split(':', 2)
+    covered_until, part, parts = rest.rsplit(':', 2)
+    return int(user_id), datetime.fromisoformat(covered_until), int(part), int(parts)
+
+
+def submit_user_memory_batch(limit=None):
+    """
+    Write one summarization request per user (per chunk for oversized inputs) and submit them as a batch
+    """
+    pending_users = set()
+    for batch in MemoryBatch.query.filter(MemoryBatch.status.in_(MemoryBatch.PENDING_STATUSES)).all():
+        pending_users.update(batch.get_user_ids())
+
+    user_ids = [uid for uid in find_users_with_new_activity(limit=limit) if uid not in pending_users]
+    if not user_ids:
+        return None
+
+    settings = _memory_settings()
+    lines = []
+    for user_id in user_ids:
+        memory = UserChatMemory.query.filter_by(user_id=user_id).first()
+        new_messages = _get_new_messages(user_id, memory)
+        if not new_messages:
+            continue
+        covered_until = new_messages[-1].created_at
+        history = [f"{msg.role.capitalize()}: {msg.content}" for msg in new_messages]
+        chunks = split_history_text(history, settings['chunk_chars'])
+        if len(chunks) == 1 and memory:
+            chunks = [memory.memory_text + '\n' + chunks[0]]
+        for part, chunk in enumerate(chunks):
+            lines.append(json.dumps({
+                'custom_id': _custom_id(user_id, covered_until, part, len(chunks)),
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': build_summary_request(chunk),
+            }))
+        db.session.expunge_all()
+
+    if not lines:
+        return None
+
+    client = get_openai_client()
+    input_file = client.files.create(
+        file=('user_memory_batch.jsonl', io.BytesIO('\n'.join(lines).encode('utf-8'))),
+        purpose='batch'
+    )
+    remote = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint='/v1/chat/completions',
+        completion_window='24h'
+    )
+
+    batch = MemoryBatch(
+        batch_id=remote.id,
+        status=remote.status,
+        request_count=len(lines),
+        user_ids=json.dumps(user_ids)
+    )
+    db.session.add(batch)
+    db.session.commit()
+    return batch
+
+
+def collect_user_memory_batches():
+    """
+    Apply the results of finished batches to UserChatMemory
+    """
+    client = get_openai_client()
+    applied = 0
+    for batch in MemoryBatch.query.filter(MemoryBatch.status.in_(MemoryBatch.PENDING_STATUSES)).all():
+        remote = client.batches.retrieve(batch.batch_id)
+        batch.status = remote.status
+        if remote.status != 'completed' or not remote.output_file_id:
+            db.session.commit()
+            continue
+
+        # Group partial summaries by user and cutoff
+        summaries = {}
+        for line in client.files.content(remote.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get('response') or {}
+            if response.get('status_code') != 200:
+                print(f"Batch request {item.get('custom_id')} failed: {item.get('error')}")
+                continue
+            user_id, covered_until, part, parts = _parse_custom_id(item['custom_id'])
+            content = response['body']['choices'][0]['message']['content'].strip()
+            entry = summaries.setdefault(user_id, {'covered_until': covered_until, 'parts': parts, 'texts': {}})
+            entry['texts'][part] = content
+
+        for user_id, entry in summaries.items():
+            if len(entry['texts']) != entry['parts']:
+                continue  # Incomplete; the next run picks these messages up again
+            memory = UserChatMemory.query.filter_by(user_id=user_id).first()
+            if memory and memory.last_updated and memory.last_updated >= entry['covered_until']:
+                continue  # Already refreshed online in the meantime
+            texts = [entry['texts'][i] for i in range(entry['parts'])]
+            if len(texts) == 1:
+                summary = texts[0]
+            else:
+                previous = [memory.memory_text] if memory else []
+                summary = summarize_with_llm('\n'.join(previous + texts), priority=BULK)
+            save_user_memory(user_id, summary, entry['covered_until'])
+            applied += 1
+
+        batch.completed_at = datetime.utcnow()
+        db.session.commit()
+    return applied
@@ -0,0 +1,41 @@
+from flask import current_app
+from threading import Lock
+import anthropic
+import openai
+
+# Provider clients shared across requests, so connections are pooled and kept alive.
+# Base URLs come from config (OPENAI_BASE_URL, ANTHROPIC_BASE_URL, PERPLEXITY_BASE_URL),
+# which lets the whole app be pointed at scripts/mock_llm_server.py.
+
+PERPLEXITY_DEFAULT_BASE_URL = "https://api.perplexity.ai"
+
+_clients = {}
+_clients_lock = Lock()
+
+
+def get_openai_client(api_key=None):
+    api_key = api_key or current_app.config.get('OPENAI_API_KEY')
+    base_url = current_app.config.get('OPENAI_BASE_URL') or None
+    key = ('openai', api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = openai.OpenAI(api_key=api_key, base_url=base_url)
+            _clients[key] = client
+        return client
+
+
+def get_anthropic_client(api_key=None, default_headers=None):
+    api_key = api_key or current_app.config.get('CLAUDE_API_KEY')
+    base_url = current_app.config.get('ANTHROPIC_BASE_URL') or None
+    key = ('anthropic', api_key, base_url, tuple(sorted((default_headers or {}).items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = anthropic.Anthropic(api_key=api_key, base_url=base_url, default_headers=default_headers)
+            _clients[key] = client
+        return client
+
+
+def get_perplexity_base_url():
+    return current_app.config.get('PERPLEXITY_BASE_URL') or PERPLEXITY_DEFAULT_BASE_URL
@@ -0,0 +1,156 @@
+from flask import current_app
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Condition, Lock
+import time
+
+# Priority classes for outbound LLM work in this process.
+# interactive: a user is waiting on the answer (chat streams, research).
+# background: work triggered by user activity that can lag (project memory refresh).
+# bulk: scheduled jobs (user memory batch refresh).
+# Each class has a concurrency cap. Background and bulk calls are held back while
+# interactive requests are queued or interactive time-to-first-token is above target,
+# up to a maximum deferral so they are never starved outright.
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+BULK = 'bulk'
+
+_cond = Condition()
+_in_flight = {INTERACTIVE: 0, BACKGROUND: 0, BULK: 0}
+_waiting_interactive = 0
+_ttft_samples = deque(maxlen=50)  # (recorded_at, seconds) for interactive first tokens
+
+_executor = None
+_executor_lock = Lock()
+_pending_jobs = set()
+
+
+def _settings():
+    config = current_app.config
+    return {
+        'caps': config.get('LLM_CONCURRENCY', {INTERACTIVE: 32, BACKGROUND: 4, BULK: 2}),
+        'ttft_target': config.get('LLM_INTERACTIVE_TTFT_TARGET_SECONDS', 3.0),
+        'window': config.get('LLM_LATENCY_WINDOW_SECONDS', 60),
+        'max_defer': {
+            BACKGROUND: config.get('LLM_BACKGROUND_MAX_DEFER_SECONDS', 120),
+            BULK: config.get('LLM_BULK_MAX_DEFER_SECONDS', 600),
+        },
+        'bulk_max_interactive': config.get('LLM_BULK_MAX_INTERACTIVE', 4),
+    }
+
+
+def record_interactive_ttft(seconds):
+    """Feed a user-facing time-to-first-token sample into the degradation check"""
+    with _cond:
+        _ttft_samples.append((time.monotonic(), seconds))
+
+
+def interactive_degraded(settings=None):
+    """True when recent interactive p90 TTFT is above target"""
+    settings = settings or _settings()
+    cutoff = time.monotonic() - settings['window']
+    with _cond:
+        recent = sorted(seconds for recorded_at, seconds in _ttft_samples if recorded_at >= cutoff)
+    if len(recent) < 3:
+        return False
+    p90 = recent[min(int(len(recent) * 0.9), len(recent) - 1)]
+    return p90 > settings['ttft_target']
+
+
+def _admissible(priority, settings, deferred_too_long):
+    if _in_flight[priority] >= settings['caps'].get(priority, 1):
+        return False
+    if priority == INTERACTIVE or deferred_too_long:
+        return True
+    if _waiting_interactive:
+        return False
+    if priority == BULK and _in_flight[INTERACTIVE] >= settings['bulk_max_interactive']:
+        return False
+    return not interactive_degraded(settings)
+
+
+@contextmanager
+def llm_slot(priority=INTERACTIVE):
+    """
+    Hold a concurrency slot of the given class for the duration of one outbound LLM call
+    """
+    global _waiting_interactive
+    settings = _settings()
+    started = time.monotonic()
+    max_defer = settings['max_defer'].get(priority)
+    announced = False
+
+    with _cond:
+        if priority == INTERACTIVE:
+            _waiting_interactive += 1
+        try:
+            while True:
+                deferred_too_long = max_defer is not None and time.monotonic() - started >= max_defer
+                if _admissible(priority, settings, deferred_too_long):
+                    break
+                if not announced and priority != INTERACTIVE:
+                    print(f"[Scheduler] Deferring {priority} LLM call (interactive in flight: {_in_flight[INTERACTIVE]})")
+                    announced = True
+                # Wake on slot release, and periodically to re-check interactive latency
+                _cond.wait(timeout=1.0)
+        finally:
+            if priority == INTERACTIVE:
+                _waiting_interactive -= 1
+        _in_flight[priority] += 1
+
+    if announced:
+        print(f"[Scheduler] Running {priority} LLM call after {time.monotonic() - started:.1f}s")
+    try:
+        yield
+    finally:
+        with _cond:
+            _in_flight[priority] -= 1
+            _cond.notify_all()
+
+
+def submit_background(key, fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) off the request thread, with an app context.
+    A job whose key is already queued or running is not submitted again.
+    """
+    global _executor
+    app = current_app._get_current_object()
+    with _executor_lock:
+        if key in _pending_jobs:
+            return False
+        _pending_jobs.add(key)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config.get('LLM_BACKGROUND_WORKERS', 2),
+                thread_name_prefix='llm-background'
+            )
+
+    def run():
+        from app.extensions import db
+        try:
+            with app.app_context():
+                try:
+                    fn(*args, **kwargs)
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            print(f"[Scheduler] Background job {key} failed: {e}")
+        finally:
+            with _executor_lock:
+                _pending_jobs.discard(key)
+
+    _executor.submit(run)
+    return True
+
+
+def get_scheduler_stats():
+    with _cond:
+        in_flight = dict(_in_flight)
+        waiting = _waiting_interactive
+    return {
+        'in_flight': in_flight,
+        'waiting_interactive': waiting,
+        'interactive_degraded': interactive_degraded(),
+        'pending_background_jobs': len(_pending_jobs),
+    }
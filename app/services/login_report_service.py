@@ -0,0 +1,96 @@
+from app.extensions import db
+from app.models.models import LoginRecord, User
+from sqlalchemy import and_, func, select
+import sqlite3
+
+# Admin login report: one page of users with their login count, latest login and most recent
+# logins. Window functions get it all in one statement; databases without them (SQLite before
+# 3.25) use a grouped query plus a correlated LIMIT subquery instead. Either way the number of
+# queries does not depend on the number of users or logins.
+
+
+def supports_window_functions(dialect):
+    if dialect.name == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 25, 0)
+    return True
+
+
+def users_page(page, per_page):
+    """Subquery: the users on one page, by username"""
+    return (
+        select(User.id, User.username)
+        .order_by(User.username, User.id)
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+        .subquery('page_users')
+    )
+
+
+def login_summary_statement(page_users, recent):
+    """One row per (user, recent login) with the user's total, newest first; users without logins get one row"""
+    ranked = (
+        select(
+            LoginRecord.user_id,
+            LoginRecord.login_time,
+            func.row_number().over(partition_by=LoginRecord.user_id, order_by=LoginRecord.login_time.desc()).label('position'),
+            func.count().over(partition_by=LoginRecord.user_id).label('total_logins'),
+        )
+        .where(LoginRecord.user_id.in_(select(page_users.c.id)))
+        .subquery('ranked')
+    )
+    return (
+        select(page_users.c.id, page_users.c.username, ranked.c.login_time, ranked.c.total_logins)
+        .outerjoin(ranked, and_(ranked.c.user_id == page_users.c.id, ranked.c.position <= recent))
+        .order_by(page_users.c.username, page_users.c.id, ranked.c.login_time.desc())
+    )
+
+
+def _fallback_rows(page_users, recent):
+    """Same rows as login_summary_statement, without window functions (two queries)"""
+    totals = dict(db.session.execute(
+        select(LoginRecord.user_id, func.count(LoginRecord.id))
+        .where(LoginRecord.user_id.in_(select(page_users.c.id)))
+        .group_by(LoginRecord.user_id)
+    ).all())
+    newer = LoginRecord.__table__.alias('newer')
+    latest_ids = (
+        select(newer.c.id)
+        .where(newer.c.user_id == page_users.c.id)
+        .order_by(newer.c.login_time.desc())
+        .limit(recent)
+        .correlate(page_users)
+        .scalar_subquery()
+    )
+    rows = db.session.execute(
+        select(page_users.c.id, page_users.c.username, LoginRecord.login_time)
+        .outerjoin(LoginRecord, and_(LoginRecord.user_id == page_users.c.id, LoginRecord.id.in_(latest_ids)))
+        .order_by(page_users.c.username, page_users.c.id, LoginRecord.login_time.desc())
+    ).all()
+    return [(row.id, row.username, row.login_time, totals.get(row.id)) for row in rows]
+
+
+def get_login_summaries(page=1, per_page=50, recent=3):
+    """
+    Returns (summaries, total_users). Each summary has username, total_logins,
+    most_recent_login and recent_logins (newest first, at most `recent`).
+    """
+    total_users = db.session.query(func.count(User.id)).scalar()
+    page_users = users_page(page, per_page)
+    if supports_window_functions(db.session.get_bind().dialect):
+        rows = db.session.execute(login_summary_statement(page_users, recent)).all()
+    else:
+        rows = _fallback_rows(page_users, recent)
+
+    summaries = []
+    for user_id, username, login_time, total_logins in rows:
+        if not summaries or summaries[-1]['user_id'] != user_id:
+            summaries.append({
+                'user_id': user_id,
+                'username': username,
+                'total_logins': total_logins or 0,
+                'most_recent_login': login_time,
+                'recent_logins': [],
+            })
+        if login_time is not None:
+            summaries[-1]['recent_logins'].append(login_time)
+    return summaries, total_users
@@ -0,0 +1,148 @@
+from app.models.models import MemoryLock
+from app.extensions import db
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from threading import Event, Thread
+import hashlib
+import os
+import time
+import uuid
+
+# Single-flight locks for expensive memory rebuilds, shared across gunicorn workers.
+# Postgres uses session-level advisory locks; other databases use rows in nomadchat_memory_lock.
+# A lock row expires MEMORY_LOCK_TTL_SECONDS after it was last renewed; its holder renews it
+# every third of that while the block runs, so only a crashed worker's lock can be taken over.
+
+POLL_INTERVAL_SECONDS = 0.5
+
+
+def _advisory_key(key):
+    """Map a lock name onto the signed 64-bit integer Postgres advisory locks take"""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def _lock_settings():
+    from flask import current_app
+    ttl = current_app.config.get('MEMORY_LOCK_TTL_SECONDS', 300)
+    wait_timeout = current_app.config.get('MEMORY_LOCK_WAIT_SECONDS', 60)
+    return ttl, wait_timeout
+
+
+@contextmanager
+def single_flight(key, wait=False, timeout=None):
+    """
+    Hold a cross-worker lock named `key` for the duration of the block.
+
+    Yields True when this caller owns the lock. When another worker holds it, yields False
+    immediately (wait=False) or after waiting up to `timeout` seconds for it (wait=True);
+    either way the caller should fall back to reading the current data.
+    """
+    ttl, wait_timeout = _lock_settings()
+    if timeout is None:
+        timeout = wait_timeout
+    deadline = time.monotonic() + (timeout if wait else 0)
+
+    if db.engine.dialect.name == 'postgresql':
+        with _advisory_lock(key, deadline) as acquired:
+            yield acquired
+    else:
+        with _table_lock(key, ttl, deadline) as acquired:
+            yield acquired
+
+
+@contextmanager
+def _advisory_lock(key, deadline):
+    lock_id = _advisory_key(key)
+    # A dedicated connection: advisory locks belong to the database session that took them
+    conn = db.engine.connect()
+    acquired = False
+    try:
+        while True:
+            acquired = bool(conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {'id': lock_id}).scalar())
+            conn.commit()
+            if acquired or time.monotonic() >= deadline:
+                break
+            time.sleep(POLL_INTERVAL_SECONDS)
+        yield acquired
+    finally:
+        try:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': lock_id})
+                conn.commit()
+        finally:
+            conn.close()
+
+
+@contextmanager
+def _table_lock(key, ttl, deadline):
+    owner = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+    acquired = False
+    try:
+        while True:
+            acquired = _try_insert_lock(key, owner, ttl)
+            if acquired or time.monotonic() >= deadline:
+                break
+            time.sleep(POLL_INTERVAL_SECONDS)
+        if acquired:
+            heartbeat = Event()
+            Thread(target=_renew_lock, args=(db.engine, key, owner, ttl, heartbeat), daemon=True,
+                   name=f"memory-lock-{key}").start()
+        yield acquired
+    finally:
+        if acquired:
+            heartbeat.set()
+            with db.engine.begin() as conn:
+                conn.execute(
+                    MemoryLock.__table__.delete().where(
+                        MemoryLock.lock_key == key,
+                        MemoryLock.owner == owner
+                    )
+                )
+
+
+def _renew_lock(engine, key, owner, ttl, stop):
+    """Push the lock's expiry forward until `stop` is set, so a long rebuild keeps its lock"""
+    while not stop.wait(ttl / 3):
+        try:
+            with engine.begin() as conn:
+                renewed = conn.execute(
+                    MemoryLock.__table__.update().where(
+                        MemoryLock.lock_key == key,
+                        MemoryLock.owner == owner
+                    ).values(expires_at=datetime.utcnow() + timedelta(seconds=ttl))
+                ).rowcount
+        except OperationalError as e:
+            print(f"[MemoryLock] Could not renew {key}: {e}")
+            continue
+        if not renewed:
+            print(f"[MemoryLock] Lost {key} while still running")
+            return
+
+
+def _try_insert_lock(key, owner, ttl):
+    now = datetime.utcnow()
+    try:
+        # Separate transaction so the lock is visible to other workers immediately
+        with db.engine.begin() as conn:
+            # Take over locks left behind by crashed workers
+            conn.execute(
+                MemoryLock.__table__.delete().where(
+                    MemoryLock.lock_key == key,
+                    MemoryLock.expires_at < now
+                )
+            )
+            conn.execute(
+                MemoryLock.__table__.insert().values(
+                    lock_key=key,
+                    owner=owner,
+                    acquired_at=now,
+                    expires_at=now + timedelta(seconds=ttl)
+                )
+            )
+        return True
+    except (IntegrityError, OperationalError):
+        # Held by someone else (or the database is busy writing it)
+        return False
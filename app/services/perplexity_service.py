@@ -2,6 +2,9 @@ import os
 import requests
 from typing import Dict, Optional
 from flask import current_app
+from app.services.rate_limiter import acquire, report_rate_limited, retry_after_seconds
+from app.services.llm_scheduler import llm_slot, INTERACTIVE
+from app.services.llm_clients import get_perplexity_base_url
 
 class PerplexityService:
     def __init__(self):
@@ -9,7 +12,7 @@ class PerplexityService:
         if not self.api_key:
             raise ValueError("Perplexity API key is not set in config or environment")
         
-        self.base_url = "https://api.perplexity.ai"
+        self.base_url = get_perplexity_base_url()
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -40,12 +43,16 @@ class PerplexityService:
                 ],
                 "reasoning_effort": "high"
             }
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload
-            )
-            
+            with llm_slot(INTERACTIVE):
+                acquire('perplexity', payload['model'])
+                response = requests.post(
+                    f"{self.base_url}/chat/completions",
+                    headers=self.headers,
+                    json=payload
+                )
+
+            if response.status_code == 429:
+                report_rate_limited('perplexity', payload['model'], retry_after_seconds(response))
             if response.status_code != 200:
                 raise Exception(f"Perplexity API error: {response.text}")
 
@@ -0,0 +1,149 @@
+from app.extensions import db
+from app.services.chat_memory_service import get_user_memory
+from app.services.llm_clients import get_openai_client, get_anthropic_client
+from app.services.project_memory_service import get_project_memory, get_recent_project_context, combine_project_context
+from app.services.user_background_service import generate_user_background
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from threading import Lock
+import anthropic
+import httpx
+import openai
+import time
+
+# Opening a chat (/api/new_chat, /api/chats/<id>) means a message is probably coming, so the
+# setup /api/chat would otherwise do before its first token runs then instead: the
+# system-prompt context for (user, project) is assembled and cached, and the provider
+# connections are opened (or kept alive) in the shared clients' pools.
+# Both live in the worker process; the TTL bounds staleness for changes made in other workers.
+
+# (user_id, project_id) -> {'built_at', 'user_memory', 'user_background', 'project_memory'}
+_context_cache = {}
+_context_lock = Lock()
+
+# (provider, api_key, base_url) -> monotonic time of the last keep-alive request
+_warmed_at = {}
+_warmed_lock = Lock()
+
+# Own small pool: prewarming must not queue behind memory summaries on the background scheduler
+_executor = None
+_pending = set()
+_executor_lock = Lock()
+
+
+def _load_context(user_id, project_id):
+    return {
+        'built_at': time.monotonic(),
+        'user_memory': get_user_memory(user_id),
+        'user_background': generate_user_background(user_id),
+        'project_memory': get_project_memory(project_id),
+    }
+
+
+def get_chat_context(user_id, project_id):
+    """
+    User memory, user background and project context for the chat system prompt.
+    The slow-changing parts come from the prewarm cache while fresh; recent project
+    context is always checked (it has its own cache keyed on the newest message).
+    """
+    ttl = current_app.config.get('PREWARM_CONTEXT_TTL_SECONDS', 120)
+    key = (user_id, project_id)
+    with _context_lock:
+        cached = _context_cache.get(key)
+    if not cached or time.monotonic() - cached['built_at'] >= ttl:
+        cached = _load_context(user_id, project_id)
+        with _context_lock:
+            _context_cache[key] = cached
+    return {
+        'user_memory': cached['user_memory'],
+        'user_background': cached['user_background'],
+        'project_context': combine_project_context(cached['project_memory'], get_recent_project_context(project_id)),
+    }
+
+
+def invalidate_chat_context(user_id=None, project_id=None):
+    """Drop cached context for a user (memory or profile changed) or a project (memory rebuilt)"""
+    with _context_lock:
+        for key in [k for k in _context_cache if k[0] == user_id or k[1] == project_id]:
+            del _context_cache[key]
+
+
+def warm_provider_connections():
+    """
+    Make a cheap authenticated request to each configured chat provider so the shared client
+    has a live TLS connection when the first message arrives. Any HTTP status will do.
+    Throttled to one request per provider per PREWARM_CONNECTION_INTERVAL_SECONDS.
+    """
+    interval = current_app.config.get('PREWARM_CONNECTION_INTERVAL_SECONDS', 60)
+    targets = {
+        'openai': (current_app.config.get('OPENAI_API_KEY'), current_app.config.get('OPENAI_BASE_URL')),
+        'anthropic': (current_app.config.get('CLAUDE_API_KEY'), current_app.config.get('ANTHROPIC_BASE_URL')),
+    }
+    warmed = []
+    for name in current_app.config.get('CHAT_PROVIDERS', ['openai']):
+        if name not in targets or not targets[name][0]:
+            continue
+        key = (name,) + targets[name]
+        now = time.monotonic()
+        with _warmed_lock:
+            if now - _warmed_at.get(key, float('-inf')) < interval:
+                continue
+            _warmed_at[key] = now
+        try:
+            if name == 'openai':
+                client = get_openai_client().with_options(max_retries=0, timeout=10)
+                client.get('/models', cast_to=httpx.Response)
+            else:
+                client = get_anthropic_client().with_options(max_retries=0, timeout=10)
+                client.get('/v1/models', cast_to=httpx.Response)
+            warmed.append(name)
+        except (openai.APIStatusError, anthropic.APIStatusError):
+            # An error status still leaves the connection open in the pool
+            warmed.append(name)
+        except Exception as e:
+            print(f"[Prewarm] Could not reach {name}: {e}")
+    return warmed
+
+
+def prewarm_chat(user_id, project_id):
+    """Background job: cache the chat context and warm provider connections"""
+    if project_id is not None:
+        context = _load_context(user_id, project_id)
+        with _context_lock:
+            _context_cache[(user_id, project_id)] = context
+        get_recent_project_context(project_id)
+    warm_provider_connections()
+
+
+def schedule_prewarm(user_id, project_id):
+    """
+    Queue prewarm_chat off the request thread. A prewarm already queued or running
+    for the same (user, project) is not submitted again.
+    """
+    global _executor
+    if not current_app.config.get('PREWARM_ENABLED', True):
+        return False
+    app = current_app._get_current_object()
+    key = (user_id, project_id)
+    with _executor_lock:
+        if key in _pending:
+            return False
+        _pending.add(key)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prewarm')
+
+    def run():
+        try:
+            with app.app_context():
+                try:
+                    prewarm_chat(user_id, project_id)
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            print(f"[Prewarm] Failed for user {user_id}, project {project_id}: {e}")
+        finally:
+            with _executor_lock:
+                _pending.discard(key)
+
+    _executor.submit(run)
+    return True
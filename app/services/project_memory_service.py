@@ -1,54 +1,141 @@
-from app.models.models import ChatSession, ProjectMemory, Project, Document
+from app.models.models import ChatSession, ChatMessage, ProjectMemory, ProjectActivity, Project, Document
 from app.extensions import db
+from app.services.memory_lock_service import single_flight
+from app.services.rate_limiter import acquire, report_rate_limited, retry_after_seconds, estimate_request_tokens
+from app.services.llm_scheduler import llm_slot, BACKGROUND
+from app.services.llm_clients import get_openai_client
 from datetime import datetime, timedelta
+from threading import Lock
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 import openai
 import json
+import time
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate for activity counters (roughly 4 characters per token)
+    """
+    return len(text or "") // 4
+
+def record_project_activity(project_id, sessions=0, messages=0, documents=0, tokens=0):
+    """
+    Add newly written content to the project's activity counters.
+    Runs inside the caller's transaction; the caller commits.
+    """
+    values = {
+        'new_sessions': ProjectActivity.new_sessions + sessions,
+        'new_messages': ProjectActivity.new_messages + messages,
+        'new_documents': ProjectActivity.new_documents + documents,
+        'new_tokens': ProjectActivity.new_tokens + tokens,
+        'updated_at': datetime.utcnow()
+    }
+    updated = ProjectActivity.query.filter_by(project_id=project_id).update(values, synchronize_session=False)
+    if updated:
+        return
+    
+    # First write for this project: create the counter row
+    try:
+        with db.session.begin_nested():
+            db.session.add(ProjectActivity(
+                project_id=project_id,
+                new_sessions=sessions,
+                new_messages=messages,
+                new_documents=documents,
+                new_tokens=tokens
+            ))
+    except IntegrityError:
+        # Another request created it first
+        ProjectActivity.query.filter_by(project_id=project_id).update(values, synchronize_session=False)
+
+def mark_project_memory_built(project_id, snapshot):
+    """
+    Subtract the counters a memory build consumed, keeping anything written meanwhile
+    """
+    activity = ProjectActivity.query.filter_by(project_id=project_id).first()
+    if not activity:
+        activity = ProjectActivity(project_id=project_id)
+        db.session.add(activity)
+    activity.new_sessions = max((activity.new_sessions or 0) - snapshot.get('new_sessions', 0), 0)
+    activity.new_messages = max((activity.new_messages or 0) - snapshot.get('new_messages', 0), 0)
+    activity.new_documents = max((activity.new_documents or 0) - snapshot.get('new_documents', 0), 0)
+    activity.new_tokens = max((activity.new_tokens or 0) - snapshot.get('new_tokens', 0), 0)
+    activity.last_memory_build = datetime.utcnow()
+
+def get_project_activity_snapshot(project_id):
+    """
+    Read the current counters as a plain dict
+    """
+    activity = ProjectActivity.query.filter_by(project_id=project_id).first()
+    if not activity:
+        return {}
+    return {
+        'new_sessions': activity.new_sessions or 0,
+        'new_messages': activity.new_messages or 0,
+        'new_documents': activity.new_documents or 0,
+        'new_tokens': activity.new_tokens or 0
+    }
 
 def should_update_project_memory(project_id):
     """
-    Check if project memory should be updated based on smart logic:
-    - Configurable number of new chat sessions since last update, OR
-    - Configurable hours have passed since last update, OR
-    - Force update is requested
+    Check if project memory should be updated from the write-time activity counters:
+    - Memory has never been built, OR
+    - Enough new sessions, messages, documents or tokens since the last build, OR
+    - Configurable hours have passed and there is some new content
+    This is a single-row read; nothing is counted at request time.
     """
     from flask import current_app
     
-    memory = ProjectMemory.query.filter_by(project_id=project_id).first()
-    if not memory:
-        return True  # No memory exists, create it
+    activity = ProjectActivity.query.filter_by(project_id=project_id).first()
+    if not activity or activity.last_memory_build is None:
+        return True  # No memory built yet, create it
+    
+    new_content = activity.new_sessions + activity.new_messages + activity.new_documents
+    if not new_content:
+        return False
     
     # Get configurable thresholds
     update_hours = current_app.config.get('PROJECT_MEMORY_UPDATE_HOURS', 24)
     update_sessions = current_app.config.get('PROJECT_MEMORY_UPDATE_SESSIONS', 3)
+    update_messages = current_app.config.get('PROJECT_MEMORY_UPDATE_MESSAGES', 20)
+    update_tokens = current_app.config.get('PROJECT_MEMORY_UPDATE_TOKENS', 4000)
     
-    # Check if enough hours have passed
-    if datetime.utcnow() - memory.last_updated > timedelta(hours=update_hours):
+    if (activity.new_sessions >= update_sessions
+            or activity.new_messages >= update_messages
+            or activity.new_tokens >= update_tokens
+            or activity.new_documents > 0):
         return True
     
-    # Count new chat sessions since last update
-    new_sessions = ChatSession.query.filter(
-        ChatSession.project_id == project_id,
-        ChatSession.created_at > memory.last_updated
-    ).count()
-    
-    # Update if enough new sessions
-    if new_sessions >= update_sessions:
+    # Check if enough hours have passed
+    if datetime.utcnow() - activity.last_memory_build > timedelta(hours=update_hours):
         return True
     
     return False
 
-def get_incremental_project_memory(project_id):
+def get_incremental_project_memory(project_id, wait=False):
     """
-    Get project memory with smart update logic
+    Get project memory with smart update logic.
+    Only one worker rebuilds a project's memory at a time; concurrent callers read the
+    current memory instead, or wait for the in-flight rebuild when wait=True.
     """
     memory = ProjectMemory.query.filter_by(project_id=project_id).first()
-    if not memory:
-        return generate_project_memory(project_id)
-    
-    if should_update_project_memory(project_id):
-        return update_project_memory_incrementally(project_id, memory)
-    
-    return memory
+    if memory and not should_update_project_memory(project_id):
+        return memory
+    
+    with single_flight(f"project_memory:{project_id}", wait=wait) as acquired:
+        # Re-read: another worker may have rebuilt it while we checked or waited
+        db.session.expire_all()
+        memory = ProjectMemory.query.filter_by(project_id=project_id).first()
+        if not acquired:
+            return memory
+        
+        if not memory:
+            return generate_project_memory(project_id)
+        
+        if should_update_project_memory(project_id):
+            return update_project_memory_incrementally(project_id, memory)
+        
+        return memory
 
 def generate_project_memory(project_id):
     """
@@ -58,6 +145,8 @@ def generate_project_memory(project_id):
     if not project:
         return None
     
+    activity_snapshot = get_project_activity_snapshot(project_id)
+    
     # Gather project info and chat history
     project_info = f"Project: {project.name}\nDescription: {project.description or 'No description'}\nSystem Instructions: {project.system_instructions or 'None'}"
     
@@ -82,6 +171,8 @@ def generate_project_memory(project_id):
     
     # Generate structured memory using LLM
     structured_memory = generate_structured_project_memory(memory_content, project.name)
+    if structured_memory is None:
+        return None
     
     # Create memory record
     memory = ProjectMemory(
@@ -96,35 +187,38 @@ def generate_project_memory(project_id):
     )
     
     db.session.add(memory)
+    mark_project_memory_built(project_id, activity_snapshot)
     db.session.commit()
+    _invalidate_chat_context(project_id)
     return memory
 
 def update_project_memory_incrementally(project_id, existing_memory):
     """
     Update project memory incrementally with only new content
     """
-    # Get new content since last update
-    new_sessions = ChatSession.query.filter(
-        ChatSession.project_id == project_id,
-        ChatSession.created_at > existing_memory.last_updated
-    ).order_by(ChatSession.created_at).all()
+    activity_snapshot = get_project_activity_snapshot(project_id)
+    
+    # Get new content since last update (new turns in older sessions count too)
+    new_messages = ChatMessage.query.filter(
+        ChatMessage.project_id == project_id,
+        ChatMessage.created_at > existing_memory.last_updated
+    ).order_by(ChatMessage.created_at, ChatMessage.id).all()
     
     new_documents = Document.query.filter(
         Document.project_id == project_id,
         Document.created_at > existing_memory.last_updated
     ).all()
     
-    if not new_sessions and not new_documents:
+    if not new_messages and not new_documents:
+        mark_project_memory_built(project_id, activity_snapshot)
+        db.session.commit()
         return existing_memory  # No new content
     
     # Gather new content
     new_content = ""
-    if new_sessions:
-        new_messages = []
-        for session in new_sessions:
-            new_messages.extend(session.get_chat_history())
+    if new_messages:
         new_content += f"\n\nNew Chat Content:\n"
-        new_content += '\n'.join([f"{msg['role'].capitalize()}: {msg['content']}" for msg in new_messages])
+        new_content += '\n'.join([f"{msg.role.capitalize()}: {msg.content}" for msg in new_messages])
     
     if new_documents:
         new_content += f"\n\nNew Documents:\n"
@@ -134,6 +228,8 @@ def update_project_memory_incrementally(project_id, existing_memory):
     # Combine with existing memory and update
     combined_content = existing_memory.memory_text + new_content
     updated_memory = generate_structured_project_memory(combined_content, existing_memory.project.name)
+    if updated_memory is None:
+        return existing_memory
     
     # Update existing memory
     existing_memory.memory_text = updated_memory['memory_text']
@@ -143,14 +239,24 @@ def update_project_memory_incrementally(project_id, existing_memory):
     existing_memory.key_topics = updated_memory.get('key_topics', existing_memory.key_topics)
     existing_memory.last_updated = datetime.utcnow()
     existing_memory.last_chat_count = ChatSession.query.filter_by(project_id=project_id).count()
+    mark_project_memory_built(project_id, activity_snapshot)
     
     db.session.commit()
+    _invalidate_chat_context(project_id)
     return existing_memory
 
+def _invalidate_chat_context(project_id):
+    # Imported here: prewarm_service builds on this module
+    from app.services.prewarm_service import invalidate_chat_context
+    invalidate_chat_context(project_id=project_id)
+
 def generate_structured_project_memory(content, project_name):
     """
-    Generate structured project memory using LLM
+    Generate structured project memory using LLM.
+    Returns None when no summary could be made (rate limited, scheduler busy, API error);
+    callers then keep the current memory and activity counters so the next trigger retries.
     """
+    from flask import current_app
     prompt = f"""
 Create a comprehensive, structured summary of this documentary project based on the provided content. 
 Focus on documentary filmmaking context and organize the information clearly.
@@ -173,13 +279,20 @@ Focus on documentary filmmaking context and be concise but comprehensive.
 """
     
     try:
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
-            model="gpt-4.1-nano",  # Using summation model for project memory
-            messages=[{"role": "system", "content": prompt}],
-            max_tokens=1000,
-            temperature=0.3,
-        )
+        with llm_slot(BACKGROUND):
+            acquire('openai', 'gpt-4.1-nano', estimate_request_tokens(prompt, output_tokens=1000),
+                    max_wait=current_app.config.get('RATE_LIMIT_BACKGROUND_WAIT_SECONDS', 120), background=True)
+            client = get_openai_client()
+            try:
+                response = client.chat.completions.create(
+                    model="gpt-4.1-nano",  # Using summation model for project memory
+                    messages=[{"role": "system", "content": prompt}],
+                    max_tokens=1000,
+                    temperature=0.3,
+                )
+            except openai.RateLimitError as e:
+                report_rate_limited('openai', 'gpt-4.1-nano', retry_after_seconds(e))
+                raise
         
         result = response.choices[0].message.content.strip()
         
@@ -197,15 +310,8 @@ Focus on documentary filmmaking context and be concise but comprehensive.
             }
             
     except Exception as e:
-        print(f"Error generating structured memory: {e}")
-        # Fallback to simple summary
-        return {
-            "memory_text": f"Project memory for {project_name}. Content available but structured analysis failed.",
-            "status": None,
-            "goals": None,
-            "timeline": None,
-            "key_topics": None
-        }
+        print(f"Error generating structured memory for {project_name}, leaving memory as is: {e}")
+        return None
 
 def get_project_memory(project_id):
     """
@@ -229,12 +335,26 @@ def get_project_memory(project_id):
     
     return memory_text
 
+# Formatted recent-context blocks, keyed by (project_id, hours_back, max_messages, char_limit)
+_recent_context_cache = {}
+_recent_context_lock = Lock()
+RECENT_CONTEXT_CACHE_SECONDS = 60
+
+def invalidate_recent_project_context(project_id):
+    """
+    Drop cached recent-context blocks for a project (e.g. after a chat is deleted)
+    """
+    with _recent_context_lock:
+        for key in [k for k in _recent_context_cache if k[0] == project_id]:
+            del _recent_context_cache[key]
+
 def get_recent_project_context(project_id, hours_back=None, max_messages=None):
     """
     Get recent chat context from the last N hours for immediate recall
-    This provides quick access to recent information without waiting for memory updates
+    This provides quick access to recent information without waiting for memory updates.
+    Reads only the newest ChatMessage rows (truncated in SQL), so the cost does not
+    depend on how long the underlying sessions are.
     """
-    from datetime import datetime, timedelta
     from flask import current_app
     
     # Use configurable defaults or fallback to reasonable defaults
@@ -242,62 +362,67 @@ def get_recent_project_context(project_id, hours_back=None, max_messages=None):
         hours_back = current_app.config.get('RECENT_CONTEXT_HOURS', 24)
     if max_messages is None:
         max_messages = current_app.config.get('RECENT_CONTEXT_MAX_MESSAGES', 50)
+    char_limit = current_app.config.get('RECENT_CONTEXT_MESSAGE_CHARS', 500)
     
-    # Get recent chat sessions
     cutoff_time = datetime.utcnow() - timedelta(hours=hours_back)
-    recent_sessions = ChatSession.query.filter(
-        ChatSession.project_id == project_id,
-        ChatSession.created_at >= cutoff_time
-    ).order_by(ChatSession.created_at.desc()).all()
-    
-    if not recent_sessions:
-        return None
     
-    # Collect recent messages
-    recent_messages = []
-    total_messages = 0
+    # Cheap probe: newest message in the project (one index lookup)
+    newest = db.session.query(ChatMessage.id).filter(
+        ChatMessage.project_id == project_id,
+        ChatMessage.created_at >= cutoff_time
+    ).order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).first()
     
-    for session in recent_sessions:
-        if total_messages >= max_messages:
-            break
-            
-        try:
-            chat_history = session.get_chat_history()
-            for msg in reversed(chat_history):  # Start with most recent
-                if total_messages >= max_messages:
-                    break
-                recent_messages.append({
-                    'role': msg['role'],
-                    'content': msg['content'],
-                    'session_time': session.created_at
-                })
-                total_messages += 1
-        except Exception as e:
-            print(f"Error reading chat history for session {session.id}: {e}")
-            continue
-    
-    if not recent_messages:
+    if not newest:
         return None
     
-    # Reverse to get chronological order
-    recent_messages.reverse()
+    # Reuse the formatted block while nothing new was written and nothing aged out
+    cache_key = (project_id, hours_back, max_messages, char_limit)
+    now = time.monotonic()
+    with _recent_context_lock:
+        cached = _recent_context_cache.get(cache_key)
+    if (cached and cached['newest_id'] == newest.id and cached['oldest_at'] >= cutoff_time
+            and now - cached['built_at'] < RECENT_CONTEXT_CACHE_SECONDS):
+        return cached['text']
+    
+    rows = db.session.query(
+        ChatMessage.role,
+        func.substr(ChatMessage.content, 1, char_limit).label('content'),
+        ChatMessage.content_length,
+        ChatMessage.created_at
+    ).filter(
+        ChatMessage.project_id == project_id,
+        ChatMessage.created_at >= cutoff_time
+    ).order_by(
+        ChatMessage.created_at.desc(), ChatMessage.id.desc()
+    ).limit(max_messages).all()
+    
+    if not rows:
+        return None
     
-    # Format recent context
+    # Format recent context in chronological order
     context_text = f"RECENT PROJECT CONTEXT (Last {hours_back} hours):\n"
     context_text += "=" * 50 + "\n"
     
-    for msg in recent_messages:
-        role = msg['role'].capitalize()
-        content = msg['content']
+    for row in reversed(rows):
+        role = row.role.capitalize()
+        content = row.content or ""
         # Truncate very long messages
-        if len(content) > 500:
-            content = content[:500] + "..."
+        if row.content_length > char_limit:
+            content = content + "..."
         context_text += f"{role}: {content}\n\n"
     
     context_text += "=" * 50 + "\n"
     context_text += "Use this recent context to provide immediate, relevant responses.\n"
     context_text += "This information is from recent chat sessions and should be prioritized for current questions.\n\n"
     
+    with _recent_context_lock:
+        _recent_context_cache[cache_key] = {
+            'newest_id': newest.id,
+            'oldest_at': rows[-1].created_at,
+            'built_at': now,
+            'text': context_text
+        }
+    
     return context_text
 
 def get_enhanced_project_context(project_id):
@@ -310,7 +435,12 @@ def get_enhanced_project_context(project_id):
     # Get recent context
     recent_context = get_recent_project_context(project_id)
     
-    # Combine them
+    return combine_project_context(long_term_memory, recent_context)
+
+def combine_project_context(long_term_memory, recent_context):
+    """
+    Format long-term memory and recent context as one system-prompt block (None when both are empty)
+    """
     enhanced_context = ""
     
     if long_term_memory:
@@ -323,4 +453,4 @@ def get_enhanced_project_context(project_id):
     if not enhanced_context:
         return None
     
-    return enhanced_context 
\ No newline at end of file
+    return enhanced_context 
@@ -0,0 +1,345 @@
+from flask import current_app
+from app.services.rate_limiter import RateLimitExceeded
+from app.services.llm_scheduler import record_interactive_ttft
+from collections import deque
+from queue import Queue, Empty
+from threading import Event, Lock, Thread, local
+import time
+
+# Routes a streamed chat request across providers (OpenAI, Anthropic, Gemini).
+# Each provider is passed in as (name, factory) where factory() returns the provider's
+# stream generator (json lines with "chunk"). Health is tracked per process:
+# a rolling window of time-to-first-token samples and outcomes, plus a circuit breaker
+# that skips a provider for a while after repeated failures.
+# Provider streams hand their open HTTP response to register_upstream(), so a hedged request
+# that loses the race is closed at once instead of at its first chunk.
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ProviderHealth:
+    def __init__(self, name, window=50):
+        self.name = name
+        self.ttft_samples = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True for success, False for failure
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.lock = Lock()
+
+    def available(self):
+        """Whether a request could be sent now (an expired open circuit allows a trial)"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() >= self.open_until
+            return not self.trial_in_flight
+
+    def begin_request(self):
+        """Claim the right to send; while the circuit is not closed only one trial request goes through"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.open_until:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self, ttft):
+        with self.lock:
+            if self.state != CLOSED:
+                self.outcomes.clear()  # Recovered: judge it on what happens from here on
+            self.ttft_samples.append(ttft)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            self.trial_in_flight = False
+
+    def record_failure(self, failure_threshold, open_seconds):
+        with self.lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= failure_threshold:
+                if self.state != OPEN:
+                    print(f"[Router] Circuit open for {self.name} ({self.consecutive_failures} consecutive failures)")
+                self.state = OPEN
+                self.open_until = time.monotonic() + open_seconds
+
+    def release_trial(self):
+        """A trial request was cancelled before it told us anything"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def success_rate(self):
+        if not self.outcomes:
+            return 1.0
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def ttft_percentile(self, percentile):
+        if not self.ttft_samples:
+            return None
+        ordered = sorted(self.ttft_samples)
+        index = min(int(len(ordered) * percentile / 100), len(ordered) - 1)
+        return ordered[index]
+
+    def snapshot(self):
+        return {
+            'provider': self.name,
+            'state': self.state,
+            'success_rate': round(self.success_rate(), 3),
+            'consecutive_failures': self.consecutive_failures,
+            'ttft_p50': self.ttft_percentile(50),
+            'ttft_p95': self.ttft_percentile(95),
+            'samples': len(self.ttft_samples),
+        }
+
+
+_health = {}
+_health_lock = Lock()
+
+
+def get_health(name):
+    with _health_lock:
+        if name not in _health:
+            _health[name] = ProviderHealth(name)
+        return _health[name]
+
+
+def get_provider_health():
+    """Health snapshot for every provider seen by this process"""
+    with _health_lock:
+        providers = list(_health.values())
+    return [health.snapshot() for health in providers]
+
+
+def _settings():
+    config = current_app.config
+    return {
+        'hedging': config.get('PROVIDER_HEDGING_ENABLED', False),
+        'percentile': config.get('PROVIDER_HEDGE_PERCENTILE', 95),
+        'hedge_min': config.get('PROVIDER_HEDGE_MIN_SECONDS', 2.0),
+        'hedge_max': config.get('PROVIDER_HEDGE_MAX_SECONDS', 10.0),
+        'first_token_timeout': config.get('PROVIDER_FIRST_TOKEN_TIMEOUT_SECONDS', 30),
+        'idle_timeout': config.get('PROVIDER_STREAM_IDLE_TIMEOUT_SECONDS', 60),
+        'failure_threshold': config.get('PROVIDER_CIRCUIT_FAILURES', 3),
+        'open_seconds': config.get('PROVIDER_CIRCUIT_OPEN_SECONDS', 30),
+    }
+
+
+def hedge_delay(name, settings):
+    """How long to wait for the first token before firing a backup: the provider's TTFT percentile, clamped"""
+    observed = get_health(name).ttft_percentile(settings['percentile'])
+    if observed is None or len(get_health(name).ttft_samples) < 5:
+        return settings['hedge_max']
+    return min(max(observed, settings['hedge_min']), settings['hedge_max'])
+
+
+def order_providers(providers):
+    """
+    Configured order, with unhealthy providers moved to the back and open circuits dropped
+    """
+    ranked = []
+    for index, (name, factory) in enumerate(providers):
+        health = get_health(name)
+        if not health.available():
+            print(f"[Router] Skipping {name}: circuit {health.state}")
+            continue
+        # A provider due for a trial keeps its place; the circuit reopens quickly if it is still down
+        demoted = health.state == CLOSED and health.success_rate() < 0.5
+        ranked.append((demoted, index, name, factory))
+    ranked.sort(key=lambda item: (item[0], item[1]))
+    return [(name, factory) for _, _, name, factory in ranked]
+
+
+_running = local()  # The _Attempt whose thread this is
+
+
+def register_upstream(response):
+    """
+    Called by a provider stream once its request is sent: `response` (anything with close())
+    is closed from the router's thread if this attempt is cancelled before it finishes
+    """
+    attempt = getattr(_running, 'attempt', None)
+    if attempt is not None:
+        attempt.set_upstream(response)
+
+
+class _Attempt:
+    """One provider request running in its own thread, reporting into a shared event queue"""
+
+    def __init__(self, name, factory, app, events):
+        self.name = name
+        self.cancelled = Event()
+        self.started = time.monotonic()
+        self.first_token_at = None
+        self.upstream = None
+        self.upstream_lock = Lock()
+        self.thread = Thread(target=self._run, args=(factory, app, events), daemon=True)
+        self.thread.start()
+
+    def _run(self, factory, app, events):
+        _running.attempt = self
+        with app.app_context():
+            try:
+                stream = factory()
+                try:
+                    for chunk in stream:
+                        if self.cancelled.is_set():
+                            break
+                        events.put((self, 'chunk', chunk))
+                finally:
+                    stream.close()
+                events.put((self, 'done', None))
+            except Exception as e:
+                events.put((self, 'error', e))
+
+    def set_upstream(self, response):
+        with self.upstream_lock:
+            self.upstream = response
+            cancelled = self.cancelled.is_set()
+        if cancelled:
+            self._close_upstream(response)
+
+    def cancel(self):
+        with self.upstream_lock:
+            self.cancelled.set()
+            response = self.upstream
+        if response is not None:
+            # Unblocks a thread still waiting on its first chunk; it ends with an error nobody reads
+            self._close_upstream(response)
+
+    def _close_upstream(self, response):
+        try:
+            response.close()
+        except Exception as e:
+            print(f"[Router] Closing {self.name} request failed: {e}")
+
+
+def stream_with_failover(providers):
+    """
+    Stream from the first healthy provider. Errors before the first token fail over to the next one;
+    with hedging on, a backup request is fired when the first token is later than the primary's
+    usual TTFT percentile, the faster stream wins and the other is cancelled.
+    """
+    settings = _settings()
+    queue = list(order_providers(providers))
+    if not queue:
+        raise RuntimeError("No chat provider is currently available")
+
+    app = current_app._get_current_object()
+    request_started = time.monotonic()
+    events = Queue()
+    racing = []
+    last_error = None
+
+    def launch():
+        """Start the next provider that will take a request; None when none is left"""
+        while queue:
+            name, factory = queue.pop(0)
+            if get_health(name).begin_request():
+                break
+        else:
+            return None
+        print(f"[Router] Sending request to {name}")
+        attempt = _Attempt(name, factory, app, events)
+        racing.append(attempt)
+        return attempt
+
+    def fail(attempt, error):
+        print(f"[Router] {attempt.name} failed: {error}")
+        if isinstance(error, RateLimitExceeded):
+            # Refused locally for capacity; says nothing about the provider's health
+            get_health(attempt.name).release_trial()
+            return
+        get_health(attempt.name).record_failure(settings['failure_threshold'], settings['open_seconds'])
+
+    winner = None
+    try:
+        primary = launch()
+        if primary is None:
+            raise RuntimeError("No chat provider is currently available")
+        hedge_at = None
+        if settings['hedging'] and queue:
+            hedge_at = primary.started + hedge_delay(primary.name, settings)
+        give_up_at = primary.started + settings['first_token_timeout']
+
+        # Race for the first token
+        while winner is None:
+            now = time.monotonic()
+            wait_until = min(hedge_at, give_up_at) if hedge_at else give_up_at
+            try:
+                attempt, kind, payload = events.get(timeout=max(wait_until - now, 0))
+            except Empty:
+                now = time.monotonic()
+                if hedge_at and now >= hedge_at:
+                    print(f"[Router] No first token from {primary.name} after {now - primary.started:.2f}s, hedging")
+                    launch()
+                    hedge_at = None
+                elif now >= give_up_at:
+                    for attempt in racing:
+                        attempt.cancel()
+                        fail(attempt, "no first token before timeout")
+                    racing.clear()
+                    last_error = TimeoutError("No first token before timeout")
+                    primary = launch()
+                    if primary is None:
+                        raise last_error
+                    give_up_at = primary.started + settings['first_token_timeout']
+                continue
+
+            if attempt not in racing:
+                continue  # Late event from a cancelled attempt
+            if kind == 'chunk':
+                winner = attempt
+                winner.first_token_at = time.monotonic()
+                for other in racing:
+                    if other is not winner:
+                        other.cancel()
+                        get_health(other.name).release_trial()
+                        print(f"[Router] Cancelled slower request to {other.name}")
+                print(f"[Router] First token from {winner.name} after {winner.first_token_at - winner.started:.2f}s")
+                record_interactive_ttft(winner.first_token_at - request_started)
+                yield payload
+                break
+
+            # Ended without producing anything: count as a failure and move on
+            racing.remove(attempt)
+            last_error = payload if kind == 'error' else RuntimeError("Empty response")
+            fail(attempt, last_error)
+            if not racing:
+                primary = launch()
+                if primary is None:
+                    raise last_error
+                give_up_at = primary.started + settings['first_token_timeout']
+                hedge_at = None
+                if settings['hedging'] and queue:
+                    hedge_at = primary.started + hedge_delay(primary.name, settings)
+
+        # Relay the winner's stream
+        while True:
+            attempt, kind, payload = events.get(timeout=settings['idle_timeout'])
+            if attempt is not winner:
+                continue
+            if kind == 'chunk':
+                yield payload
+            elif kind == 'done':
+                get_health(winner.name).record_success(winner.first_token_at - winner.started)
+                return
+            else:
+                # Text already reached the client, so there is nothing to fail over to
+                fail(winner, payload)
+                raise payload
+    except Empty:
+        fail(winner, "stream stalled")
+        raise TimeoutError(f"{winner.name} stopped streaming")
+    finally:
+        for attempt in racing:
+            attempt.cancel()
+            get_health(attempt.name).release_trial()
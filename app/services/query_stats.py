@@ -0,0 +1,196 @@
+from contextlib import contextmanager
+from flask import current_app, request
+from functools import lru_cache
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from threading import Lock, local
+import re
+import time
+
+# Per-request SQL instrumentation: query count, DB time and rows (as reported by the driver;
+# SQLite reports none for SELECTs), grouped by statement fingerprint. A fingerprint executed
+# QUERY_STATS_REPEAT_THRESHOLD or more times in one request is flagged as a likely N+1.
+# Totals go to X-DB-* response headers in debug mode and to the per-worker /admin/query-stats
+# report. count_queries() / assert_max_queries() collect the same numbers around any block.
+
+_local = local()
+_listeners_registered = False
+
+# "<METHOD> <endpoint>" -> totals, for /admin/query-stats (this worker only)
+_report = {}
+_report_lock = Lock()
+MAX_REPEATED_PER_ENDPOINT = 20
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(\.\d+)?\b'), '?'),
+    (re.compile(r'(%\(\w+\)s|:\w+|\$\d+)'), '?'),
+    (re.compile(r'\(\s*\?(\s*,\s*\?)+\s*\)'), '(?, ...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement):
+    """Statement with literals, bound parameters and IN lists collapsed, so repeats compare equal"""
+    for pattern, replacement in _LITERALS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+class QueryStats:
+    """Queries seen while this collector is active"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.by_fingerprint = {}  # fingerprint -> [count, seconds]
+
+    def add(self, statement, seconds, rows):
+        self.queries += 1
+        self.seconds += seconds
+        self.rows += max(rows, 0)
+        entry = self.by_fingerprint.setdefault(fingerprint(statement), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def repeated(self, threshold=None):
+        """[(fingerprint, count, seconds)] executed at least `threshold` times, most frequent first"""
+        if threshold is None:
+            threshold = current_app.config.get('QUERY_STATS_REPEAT_THRESHOLD', 5)
+        found = [(fp, count, seconds) for fp, (count, seconds) in self.by_fingerprint.items() if count >= threshold]
+        return sorted(found, key=lambda item: -item[1])
+
+    def summary(self):
+        lines = [f"{self.queries} queries, {self.seconds * 1000:.1f} ms, {self.rows} rows"]
+        for fp, (count, seconds) in sorted(self.by_fingerprint.items(), key=lambda item: -item[1][0]):
+            lines.append(f"  {count}x {seconds * 1000:.1f} ms  {fp[:200]}")
+        return '\n'.join(lines)
+
+
+def _collectors():
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _collectors():
+        conn.info.setdefault('query_stats_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collectors = _collectors()
+    started = conn.info.get('query_stats_started')
+    if not collectors or not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    rows = cursor.rowcount if cursor.rowcount is not None else 0
+    for stats in collectors:
+        stats.add(statement, seconds, rows)
+
+
+def _register_listeners():
+    global _listeners_registered
+    if not _listeners_registered:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listeners_registered = True
+
+
+@contextmanager
+def count_queries():
+    """Collect the queries run on this thread inside the block: `with count_queries() as stats:`"""
+    _register_listeners()
+    stats = QueryStats()
+    _collectors().append(stats)
+    try:
+        yield stats
+    finally:
+        _collectors().remove(stats)
+
+
+@contextmanager
+def assert_max_queries(limit, repeat_threshold=None):
+    """Fail (AssertionError) when the block runs more than `limit` queries, or repeats one statement `repeat_threshold` times"""
+    with count_queries() as stats:
+        yield stats
+    if stats.queries > limit:
+        raise AssertionError(f"Expected at most {limit} queries, got {stats.summary()}")
+    if repeat_threshold and stats.repeated(repeat_threshold):
+        raise AssertionError(f"Statement repeated {repeat_threshold}+ times (N+1?): {stats.summary()}")
+
+
+def _start_request():
+    if not (current_app.config.get('QUERY_STATS_ENABLED') or current_app.debug):
+        return
+    stats = QueryStats()
+    _collectors().append(stats)
+    request.environ['nomadchat.query_stats'] = stats
+
+
+def _add_headers(response):
+    stats = request.environ.get('nomadchat.query_stats')
+    if stats and current_app.debug:
+        repeated = stats.repeated()
+        response.headers['X-DB-Queries'] = str(stats.queries)
+        response.headers['X-DB-Time-Ms'] = f"{stats.seconds * 1000:.1f}"
+        response.headers['X-DB-Rows'] = str(stats.rows)
+        response.headers['X-DB-Repeated'] = str(repeated[0][1] if repeated else 0)
+    return response
+
+
+def _finish_request(exc=None):
+    # Runs after a streamed body has finished, so queries made while streaming are included
+    stats = request.environ.pop('nomadchat.query_stats', None)
+    if stats is None:
+        return
+    if stats in _collectors():
+        _collectors().remove(stats)
+    endpoint = f"{request.method} {request.endpoint or request.path}"
+    repeated = stats.repeated()
+    for fp, count, seconds in repeated:
+        print(f"[QueryStats] {endpoint}: {count}x in one request ({seconds * 1000:.1f} ms): {fp[:200]}")
+    with _report_lock:
+        entry = _report.setdefault(endpoint, {
+            'endpoint': endpoint, 'requests': 0, 'queries': 0, 'max_queries': 0,
+            'seconds': 0.0, 'rows': 0, 'repeated': {},
+        })
+        entry['requests'] += 1
+        entry['queries'] += stats.queries
+        entry['max_queries'] = max(entry['max_queries'], stats.queries)
+        entry['seconds'] += stats.seconds
+        entry['rows'] += stats.rows
+        for fp, count, seconds in repeated:
+            if fp not in entry['repeated'] and len(entry['repeated']) >= MAX_REPEATED_PER_ENDPOINT:
+                continue
+            flagged = entry['repeated'].setdefault(fp, {'requests': 0, 'max_count': 0})
+            flagged['requests'] += 1
+            flagged['max_count'] = max(flagged['max_count'], count)
+
+
+def query_report():
+    """Per-endpoint totals since this worker started, most queries per request first"""
+    with _report_lock:
+        entries = [dict(entry, repeated=dict(entry['repeated'])) for entry in _report.values()]
+    for entry in entries:
+        entry['avg_queries'] = entry['queries'] / entry['requests']
+        entry['avg_ms'] = entry['seconds'] * 1000 / entry['requests']
+    return sorted(entries, key=lambda entry: -entry['avg_queries'])
+
+
+def reset_query_report():
+    with _report_lock:
+        _report.clear()
+
+
+def init_query_stats(app):
+    """
+    Install the request hooks; requests are instrumented while QUERY_STATS_ENABLED is set or
+    the app runs in debug mode. Call before other before_request hooks so their queries count.
+    """
+    _register_listeners()
+    app.before_request(_start_request)
+    app.after_request(_add_headers)
+    app.teardown_request(_finish_request)
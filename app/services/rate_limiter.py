@@ -0,0 +1,298 @@
+from flask import current_app
+from threading import Lock
+import atexit
+import json
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to per-process limits
+    fcntl = None
+
+# Token buckets for outbound LLM and research calls, keyed "<provider>:<model>" and limited
+# in requests and tokens per minute (RATE_LIMITS). The buckets live in a small state file
+# shared by every worker on the host, guarded by flock. To keep that file off the hot path
+# each process leases a slice of capacity and spends it locally until it runs out. Whatever
+# a lease has left when it expires goes back to the shared bucket.
+
+LEASE_FRACTION = 0.05  # Share of a minute's capacity leased per trip to the shared store
+LEASE_SECONDS = 10  # Leased capacity still unused after this long is returned to the bucket
+DEFAULT_BLOCK_SECONDS = 10  # Back-off applied to everyone when a provider says 429 without Retry-After
+
+
+class RateLimitExceeded(Exception):
+    """Admission refused: capacity won't be available within the caller's wait budget"""
+
+    def __init__(self, key, retry_after):
+        super().__init__(f"Rate limit for {key} reached, capacity in {retry_after:.1f}s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+def _refill(bucket, limits, now):
+    elapsed = max(now - bucket['updated'], 0)
+    bucket['requests'] = min(limits['rpm'], bucket['requests'] + elapsed * limits['rpm'] / 60.0)
+    if limits.get('tpm'):
+        bucket['tokens'] = min(limits['tpm'], bucket['tokens'] + elapsed * limits['tpm'] / 60.0)
+    bucket['updated'] = now
+
+
+def _take_from_bucket(state, key, limits, want, need):
+    """
+    Take up to `want` (requests, tokens) if at least `need` is available.
+    Returns (granted_requests, granted_tokens, wait_seconds).
+    """
+    now = time.time()
+    bucket = state.get(key)
+    if bucket is None:
+        bucket = {'requests': limits['rpm'], 'tokens': limits.get('tpm') or 0, 'updated': now, 'blocked_until': 0}
+        state[key] = bucket
+    _refill(bucket, limits, now)
+
+    if bucket.get('blocked_until', 0) > now:
+        return 0, 0, bucket['blocked_until'] - now
+
+    tpm = limits.get('tpm')
+    waits = []
+    if bucket['requests'] < need[0]:
+        waits.append((need[0] - bucket['requests']) * 60.0 / limits['rpm'])
+    if tpm and bucket['tokens'] < need[1]:
+        waits.append((need[1] - bucket['tokens']) * 60.0 / tpm)
+    if waits:
+        return 0, 0, max(waits)
+
+    granted_requests = min(want[0], int(bucket['requests']))
+    granted_tokens = min(want[1], int(bucket['tokens'])) if tpm else want[1]
+    bucket['requests'] -= granted_requests
+    if tpm:
+        bucket['tokens'] -= granted_tokens
+    return granted_requests, granted_tokens, 0
+
+
+def _return_to_bucket(state, key, limits, requests, tokens):
+    """Put unspent leased capacity back, never above the bucket's size"""
+    bucket = state.get(key)
+    if bucket is None:
+        return
+    _refill(bucket, limits, time.time())
+    bucket['requests'] = min(limits['rpm'], bucket['requests'] + requests)
+    if limits.get('tpm'):
+        bucket['tokens'] = min(limits['tpm'], bucket['tokens'] + tokens)
+
+
+class _FileStore:
+    """Buckets shared by all processes on the host through an flock-guarded JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _update(self, fn):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    state = {}
+                result = fn(state)
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def take(self, key, limits, want, need):
+        return self._update(lambda state: _take_from_bucket(state, key, limits, want, need))
+
+    def give_back(self, key, limits, requests, tokens):
+        self._update(lambda state: _return_to_bucket(state, key, limits, requests, tokens))
+
+    def block(self, key, limits, until):
+        def apply(state):
+            _take_from_bucket(state, key, limits, (0, 0), (0, 0))
+            state[key]['blocked_until'] = max(state[key].get('blocked_until', 0), until)
+        self._update(apply)
+
+
+class _MemoryStore:
+    """Per-process buckets, used where file locking isn't available"""
+
+    def __init__(self):
+        self.state = {}
+        self.lock = Lock()
+
+    def take(self, key, limits, want, need):
+        with self.lock:
+            return _take_from_bucket(self.state, key, limits, want, need)
+
+    def give_back(self, key, limits, requests, tokens):
+        with self.lock:
+            _return_to_bucket(self.state, key, limits, requests, tokens)
+
+    def block(self, key, limits, until):
+        with self.lock:
+            _take_from_bucket(self.state, key, limits, (0, 0), (0, 0))
+            self.state[key]['blocked_until'] = max(self.state[key].get('blocked_until', 0), until)
+
+
+_store = None
+_store_lock = Lock()
+_leases = {}  # key -> {'requests', 'tokens', 'expires', 'limits'}
+_leases_lock = Lock()
+
+
+def _get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            path = current_app.config.get('RATE_LIMIT_STATE_FILE') or os.path.join(
+                tempfile.gettempdir(), 'nomadchat_rate_limits.json'
+            )
+            _store = _FileStore(path) if fcntl else _MemoryStore()
+        return _store
+
+
+def _release_leases(expired_only=True):
+    """Hand the unspent part of this process's leases back to the shared buckets"""
+    now = time.time()
+    with _leases_lock:
+        released = [
+            (key, _leases.pop(key)) for key in list(_leases)
+            if not expired_only or _leases[key]['expires'] <= now
+        ]
+    for key, lease in released:
+        requests, tokens = int(lease['requests']), int(lease['tokens'])
+        if _store is not None and (requests > 0 or tokens > 0):
+            _store.give_back(key, lease['limits'], max(requests, 0), max(tokens, 0))
+
+
+atexit.register(_release_leases, expired_only=False)
+
+
+def get_limits(provider, model):
+    """
+    Bucket key and limits for a provider/model, falling back to the provider-wide "<provider>:*" entry.
+    Returns (None, None) for calls that aren't limited.
+    """
+    limits = current_app.config.get('RATE_LIMITS') or {}
+    for key in (f"{provider}:{model}", f"{provider}:*"):
+        if key in limits:
+            return key, limits[key]
+    return None, None
+
+
+def estimate_request_tokens(*parts, output_tokens=None):
+    """Rough token count (4 chars per token) of prompt parts: strings, message dicts or lists of either"""
+    chars = 0
+    stack = list(parts)
+    while stack:
+        part = stack.pop()
+        if isinstance(part, str):
+            chars += len(part)
+        elif isinstance(part, dict):
+            stack.extend(value for name, value in part.items() if name in ('content', 'text', 'parts'))
+        elif isinstance(part, (list, tuple)):
+            stack.extend(part)
+    if output_tokens is None:
+        output_tokens = current_app.config.get('RATE_LIMIT_OUTPUT_TOKENS_ESTIMATE', 1000)
+    return chars // 4 + output_tokens
+
+
+def acquire(provider, model, tokens=0, max_wait=None, background=False):
+    """
+    Admission control before an outbound call: take one request and `tokens` tokens from the
+    provider's bucket, waiting up to max_wait seconds for capacity. Raises RateLimitExceeded
+    when the wait would be longer, so callers can fail over or tell the user instead of
+    sending a request that will come back 429.
+
+    Background calls go straight to the shared bucket and only succeed while it holds more
+    than RATE_LIMIT_INTERACTIVE_RESERVE of its capacity, leaving the rest for users.
+    """
+    key, limits = get_limits(provider, model)
+    if not limits:
+        return
+    if max_wait is None:
+        max_wait = current_app.config.get('RATE_LIMIT_INTERACTIVE_WAIT_SECONDS', 5)
+
+    tpm = limits.get('tpm')
+    if tpm:
+        tokens = min(tokens, tpm)
+    deadline = time.monotonic() + max_wait
+
+    if background:
+        reserve = current_app.config.get('RATE_LIMIT_INTERACTIVE_RESERVE', 0.2)
+        need = (1 + limits['rpm'] * reserve, tokens + (tpm or 0) * reserve)
+        while True:
+            granted_requests, granted_tokens, wait = _get_store().take(key, limits, (1, tokens), need)
+            if not wait:
+                return
+            if wait > deadline - time.monotonic():
+                print(f"[RateLimit] Refusing background {key} call, capacity in {wait:.1f}s")
+                raise RateLimitExceeded(key, wait)
+            time.sleep(wait)
+
+    _release_leases()
+    while True:
+        now = time.time()
+        with _leases_lock:
+            lease = _leases.get(key)
+            if lease and lease['expires'] > now and lease['requests'] >= 1 and (not tpm or lease['tokens'] >= tokens):
+                lease['requests'] -= 1
+                lease['tokens'] -= tokens
+                return
+
+        want = (max(1, int(limits['rpm'] * LEASE_FRACTION)), max(tokens, int((tpm or 0) * LEASE_FRACTION)))
+        granted_requests, granted_tokens, wait = _get_store().take(key, limits, want, (1, tokens))
+        if not wait:
+            with _leases_lock:
+                lease = _leases.get(key)
+                if not lease:
+                    lease = {'requests': 0, 'tokens': 0, 'limits': limits}
+                    _leases[key] = lease
+                # A lease that expired while we waited keeps its balance; topping it up renews it
+                lease['requests'] += granted_requests
+                lease['tokens'] += granted_tokens
+                lease['expires'] = now + LEASE_SECONDS
+            continue
+
+        if wait > deadline - time.monotonic():
+            print(f"[RateLimit] Refusing {key} call, capacity in {wait:.1f}s")
+            raise RateLimitExceeded(key, wait)
+        print(f"[RateLimit] {key} waiting {wait:.2f}s for capacity")
+        time.sleep(wait)
+
+
+def report_rate_limited(provider, model, retry_after=None):
+    """
+    The provider answered 429 anyway (limits set too high, or shared with other apps):
+    hold every worker off this bucket until retry_after, instead of each retrying on its own
+    """
+    key, limits = get_limits(provider, model)
+    if not limits:
+        return
+    until = time.time() + (retry_after or DEFAULT_BLOCK_SECONDS)
+    with _leases_lock:
+        lease = _leases.pop(key, None)
+    store = _get_store()
+    if lease:
+        store.give_back(key, limits, max(int(lease['requests']), 0), max(int(lease['tokens']), 0))
+    store.block(key, limits, until)
+    print(f"[RateLimit] {key} rate limited by provider, holding off for {until - time.time():.1f}s")
+
+
+def retry_after_seconds(error):
+    """Retry-After from a provider error (SDK exception) or HTTP response (requests), if it sent one"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        response = error
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,76 @@
+from flask import current_app, g, has_app_context, has_request_context, session as http_session
+from flask_sqlalchemy.session import Session
+from functools import wraps
+from sqlalchemy import event
+import time
+
+# Optional read replica (DATABASE_REPLICA_URL, bind key 'replica').
+# Views marked @read_replica send their SELECTs to the replica; everything else, every
+# flush/DML and every transaction that has already written stays on the primary.
+# Read-your-writes: a request that commits a write stamps the user's session, and for
+# READ_REPLICA_AFTER_WRITE_SECONDS afterwards that user's reads stay on the primary too.
+REPLICA_BIND = 'replica'
+WRITE_STAMP_KEY = '_db_write_at'
+
+
+def replica_configured():
+    return has_app_context() and REPLICA_BIND in current_app.config.get('SQLALCHEMY_BINDS', {})
+
+
+class RoutingSession(Session):
+    """db.session class: picks the replica engine for reads in @read_replica views"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica(clause):
+            return self._db.engines[REPLICA_BIND]
+        if getattr(clause, 'is_dml', False):
+            self.info['wrote'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _use_replica(self, clause):
+        if self._flushing or self.info.get('wrote'):
+            return False
+        if clause is not None and not getattr(clause, 'is_select', False):
+            return False
+        return has_app_context() and g.get('use_read_replica', False) and REPLICA_BIND in self._db.engines
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _flushed(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _committed(db_session):
+    if not db_session.info.pop('wrote', False) or not has_request_context():
+        return
+    # The rest of this request and the user's next few requests must see the write
+    g.use_read_replica = False
+    if replica_configured():
+        http_session[WRITE_STAMP_KEY] = time.time()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _rolled_back(db_session):
+    db_session.info.pop('wrote', None)
+
+
+def wrote_recently():
+    """True while the current user's last committed write may not have reached the replica"""
+    stamp = http_session.get(WRITE_STAMP_KEY)
+    return stamp is not None and time.time() - stamp < current_app.config.get('READ_REPLICA_AFTER_WRITE_SECONDS', 10)
+
+
+def read_replica(view):
+    """Mark a read-only view: its queries go to the replica when one is configured"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_read_replica = replica_configured() and not wrote_recently()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def end_replica_reads(response):
+    """after_request hook: later work in the request (e.g. saving the session) uses the primary"""
+    g.pop('use_read_replica', None)
+    return response
@@ -0,0 +1,352 @@
+from app.models.models import ChatMessage, ChatSession, ResearchSession
+from app.extensions import db
+from sqlalchemy import bindparam, event, select, text
+from sqlalchemy.orm import Session
+import re
+
+# Full-text index over chat messages and research sessions.
+# SQLite uses an FTS5 virtual table, Postgres a tsvector column with a GIN index.
+# Any other backend (or SQLite built without FTS5) falls back to a plain table searched with LIKE.
+SEARCH_TABLE = 'nomadchat_search_index'
+
+KIND_CHAT = 'chat'
+KIND_RESEARCH = 'research'
+
+STOPWORDS = {
+    'a', 'about', 'all', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'been', 'but', 'by', 'can',
+    'could', 'did', 'do', 'does', 'for', 'from', 'had', 'has', 'have', 'how', 'i', 'if', 'in', 'is',
+    'it', 'its', 'me', 'my', 'of', 'on', 'or', 'our', 'so', 'talk', 'talked', 'that', 'the', 'their',
+    'them', 'then', 'there', 'these', 'this', 'to', 'us', 'was', 'we', 'were', 'what', 'when',
+    'where', 'which', 'who', 'why', 'will', 'with', 'would', 'you', 'your', 'discuss', 'discussed',
+    'discussing', 'recently', 'again', 'remember', 'last', 'time'
+}
+
+_backend = None
+_listeners_registered = False
+
+
+def init_search_index(app):
+    """
+    Create the search index for the configured database and start indexing writes
+    """
+    global _backend
+    with app.app_context():
+        engine = db.engine
+        dialect = engine.dialect.name
+        with engine.begin() as conn:
+            if dialect == 'sqlite' and _sqlite_has_fts5(conn):
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                    "body, kind UNINDEXED, ref_id UNINDEXED, group_id UNINDEXED, "
+                    "project_id UNINDEXED, user_id UNINDEXED, created_at UNINDEXED, "
+                    "tokenize='porter unicode61')"
+                ))
+                _backend = 'fts5'
+            elif dialect == 'postgresql':
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                    "id SERIAL PRIMARY KEY, kind VARCHAR(20) NOT NULL, ref_id INTEGER NOT NULL, "
+                    "group_id INTEGER, project_id INTEGER, user_id INTEGER NOT NULL, "
+                    "created_at TIMESTAMP, body TEXT NOT NULL, "
+                    "body_tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', body)) STORED, "
+                    "UNIQUE (kind, ref_id))"
+                ))
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_search_index_tsv ON {SEARCH_TABLE} USING GIN (body_tsv)"
+                ))
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_search_index_user_project ON {SEARCH_TABLE} (user_id, project_id)"
+                ))
+                _backend = 'tsvector'
+            else:
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                    "kind VARCHAR(20) NOT NULL, ref_id INTEGER NOT NULL, group_id INTEGER, "
+                    "project_id INTEGER, user_id INTEGER NOT NULL, created_at TIMESTAMP, body TEXT NOT NULL)"
+                ))
+                _backend = 'like'
+    print(f"Search index backend: {_backend}")
+    _register_listeners()
+
+
+def _sqlite_has_fts5(conn):
+    try:
+        conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS temp._fts5_probe USING fts5(x)"))
+        conn.execute(text("DROP TABLE IF EXISTS temp._fts5_probe"))
+        return True
+    except Exception:
+        return False
+
+
+def _register_listeners():
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(ChatMessage, 'after_insert', _index_chat_message)
+    event.listen(ChatMessage, 'after_update', _reindex_chat_message)
+    event.listen(ChatMessage, 'after_delete', _unindex_chat_message)
+    event.listen(ResearchSession, 'after_insert', _index_research_session)
+    event.listen(ResearchSession, 'after_update', _reindex_research_session)
+    event.listen(ResearchSession, 'after_delete', _unindex_research_session)
+    # Bulk query.delete() bypasses the mapper events above
+    event.listen(Session, 'do_orm_execute', _unindex_bulk_delete)
+    _listeners_registered = True
+
+
+def _insert_row(connection, kind, ref_id, group_id, project_id, user_id, created_at, body):
+    if _backend is None or not body:
+        return
+    connection.execute(text(
+        f"INSERT INTO {SEARCH_TABLE} (body, kind, ref_id, group_id, project_id, user_id, created_at) "
+        "VALUES (:body, :kind, :ref_id, :group_id, :project_id, :user_id, :created_at)"
+    ), {
+        'body': body, 'kind': kind, 'ref_id': ref_id, 'group_id': group_id,
+        'project_id': project_id, 'user_id': user_id, 'created_at': created_at
+    })
+
+
+def _delete_row(connection, kind, ref_id):
+    if _backend is None:
+        return
+    connection.execute(text(
+        f"DELETE FROM {SEARCH_TABLE} WHERE kind = :kind AND ref_id = :ref_id"
+    ), {'kind': kind, 'ref_id': ref_id})
+
+
+def _delete_rows(connection, kind, column, ids):
+    """Remove the index rows of one kind whose ref_id or group_id is in ids"""
+    if _backend is None or not ids:
+        return
+    connection.execute(text(
+        f"DELETE FROM {SEARCH_TABLE} WHERE kind = :kind AND {column} IN :ids"
+    ).bindparams(bindparam('ids', expanding=True)), {'kind': kind, 'ids': list(ids)})
+
+
+def _research_body(research):
+    return f"{research.topic}\n{research.research_content or ''}"
+
+
+def _index_chat_message(mapper, connection, target):
+    _insert_row(connection, KIND_CHAT, target.id, target.chat_session_id, target.project_id,
+                target.user_id, target.created_at, target.content)
+
+
+def _reindex_chat_message(mapper, connection, target):
+    _delete_row(connection, KIND_CHAT, target.id)
+    _index_chat_message(mapper, connection, target)
+
+
+def _unindex_chat_message(mapper, connection, target):
+    _delete_row(connection, KIND_CHAT, target.id)
+
+
+def _index_research_session(mapper, connection, target):
+    _insert_row(connection, KIND_RESEARCH, target.id, target.id, target.project_id,
+                target.user_id, target.created_at, _research_body(target))
+
+
+def _reindex_research_session(mapper, connection, target):
+    _delete_row(connection, KIND_RESEARCH, target.id)
+    _index_research_session(mapper, connection, target)
+
+
+def _unindex_research_session(mapper, connection, target):
+    _delete_row(connection, KIND_RESEARCH, target.id)
+
+
+# Bulk-deleted model -> (index kind, index column its ids match); deleting chat sessions
+# removes their messages through the foreign key cascade
+_BULK_DELETE_KINDS = {
+    ChatMessage: (KIND_CHAT, 'ref_id'),
+    ChatSession: (KIND_CHAT, 'group_id'),
+    ResearchSession: (KIND_RESEARCH, 'ref_id'),
+}
+
+
+def _unindex_bulk_delete(orm_execute_state):
+    """Before an ORM bulk DELETE of indexed rows, remove their index rows in the same transaction"""
+    if _backend is None or not orm_execute_state.is_delete or orm_execute_state.bind_mapper is None:
+        return
+    model = orm_execute_state.bind_mapper.class_
+    if model not in _BULK_DELETE_KINDS:
+        return
+    kind, column = _BULK_DELETE_KINDS[model]
+    ids_query = select(model.id)
+    whereclause = orm_execute_state.statement.whereclause
+    if whereclause is not None:
+        ids_query = ids_query.where(whereclause)
+    connection = orm_execute_state.session.connection(bind_arguments=orm_execute_state.bind_arguments)
+    ids = connection.execute(ids_query).scalars().all()
+    _delete_rows(connection, kind, column, ids)
+
+
+def rebuild_search_index(batch_size=500):
+    """
+    Re-index every chat message and research session (used after enabling search on an existing database)
+    """
+    if _backend is None:
+        raise RuntimeError("Search index has not been initialized")
+
+    with db.engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+
+    total = 0
+    last_id = 0
+    while True:
+        messages = ChatMessage.query.filter(ChatMessage.id > last_id).order_by(ChatMessage.id).limit(batch_size).all()
+        if not messages:
+            break
+        with db.engine.begin() as conn:
+            for msg in messages:
+                _index_chat_message(None, conn, msg)
+        last_id = messages[-1].id
+        total += len(messages)
+        db.session.expunge_all()
+
+    last_id = 0
+    while True:
+        sessions = ResearchSession.query.filter(ResearchSession.id > last_id).order_by(ResearchSession.id).limit(batch_size).all()
+        if not sessions:
+            break
+        with db.engine.begin() as conn:
+            for research in sessions:
+                _index_research_session(None, conn, research)
+        last_id = sessions[-1].id
+        total += len(sessions)
+        db.session.expunge_all()
+
+    return total
+
+
+def extract_search_terms(query_text, max_terms=12):
+    """
+    Reduce free text to distinct keywords usable in any backend's query syntax
+    """
+    terms = []
+    for word in re.findall(r"\w+", (query_text or "").lower()):
+        if len(word) < 3 or word in STOPWORDS or word in terms:
+            continue
+        terms.append(word)
+        if len(terms) >= max_terms:
+            break
+    return terms
+
+
+def search(user_id, query_text, project_id=None, kinds=None, limit=20, match_any=False,
+           exclude_group_id=None):
+    """
+    Ranked full-text search over the user's chat messages and research sessions.
+
+    Returns a list of dicts with kind, ids, created_at, a highlighted snippet and a score
+    (higher is better). match_any ORs the terms together instead of requiring all of them.
+    """
+    terms = extract_search_terms(query_text)
+    if not terms or _backend is None:
+        return []
+
+    filters = ["user_id = :user_id"]
+    params = {'user_id': user_id, 'limit': limit}
+    if project_id is not None:
+        filters.append("project_id = :project_id")
+        params['project_id'] = project_id
+    if kinds:
+        kind_params = []
+        for i, kind in enumerate(kinds):
+            params[f'kind_{i}'] = kind
+            kind_params.append(f":kind_{i}")
+        filters.append(f"kind IN ({', '.join(kind_params)})")
+    if exclude_group_id is not None:
+        filters.append("NOT (kind = :chat_kind AND group_id = :exclude_group_id)")
+        params['chat_kind'] = KIND_CHAT
+        params['exclude_group_id'] = exclude_group_id
+    where = " AND ".join(filters)
+
+    if _backend == 'fts5':
+        joiner = ' OR ' if match_any else ' '
+        params['match'] = joiner.join(f'"{term}"' for term in terms)
+        sql = (
+            f"SELECT kind, ref_id, group_id, project_id, created_at, "
+            f"snippet({SEARCH_TABLE}, 0, '[', ']', '...', 16) AS snippet, "
+            f"bm25({SEARCH_TABLE}) AS rank "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match AND {where} "
+            f"ORDER BY rank LIMIT :limit"
+        )
+    elif _backend == 'tsvector':
+        joiner = ' | ' if match_any else ' & '
+        params['tsquery'] = joiner.join(terms)
+        # Rank and limit first, then build headlines only for the rows returned
+        sql = (
+            f"SELECT kind, ref_id, group_id, project_id, created_at, "
+            f"ts_headline('english', body, to_tsquery('english', :tsquery), "
+            f"'StartSel=[, StopSel=], MaxWords=30, MinWords=10') AS snippet, rank "
+            f"FROM (SELECT kind, ref_id, group_id, project_id, created_at, body, "
+            f"ts_rank_cd(body_tsv, to_tsquery('english', :tsquery)) AS rank "
+            f"FROM {SEARCH_TABLE} WHERE body_tsv @@ to_tsquery('english', :tsquery) AND {where} "
+            f"ORDER BY rank DESC LIMIT :limit) ranked ORDER BY rank DESC"
+        )
+    else:
+        like_filters = []
+        for i, term in enumerate(terms):
+            params[f'term_{i}'] = f"%{term}%"
+            like_filters.append(f"LOWER(body) LIKE :term_{i}")
+        joiner = ' OR ' if match_any else ' AND '
+        sql = (
+            f"SELECT kind, ref_id, group_id, project_id, created_at, SUBSTR(body, 1, 200) AS snippet, 0 AS rank "
+            f"FROM {SEARCH_TABLE} WHERE ({joiner.join(like_filters)}) AND {where} "
+            f"ORDER BY created_at DESC LIMIT :limit"
+        )
+
+    rows = db.session.execute(text(sql), params).fetchall()
+
+    # Resolve chat session identifiers in one query
+    chat_group_ids = {row.group_id for row in rows if row.kind == KIND_CHAT}
+    session_keys = {}
+    if chat_group_ids:
+        session_keys = dict(
+            db.session.query(ChatSession.id, ChatSession.session_id)
+            .filter(ChatSession.id.in_(chat_group_ids))
+            .all()
+        )
+
+    results = []
+    for row in rows:
+        score = -row.rank if _backend == 'fts5' else row.rank
+        results.append({
+            'kind': row.kind,
+            'id': row.ref_id,
+            'project_id': row.project_id,
+            'session_id': session_keys.get(row.group_id) if row.kind == KIND_CHAT else None,
+            'research_id': row.group_id if row.kind == KIND_RESEARCH else None,
+            'created_at': str(row.created_at) if row.created_at else None,
+            'snippet': row.snippet,
+            'score': float(score or 0)
+        })
+    return results
+
+
+def get_search_recall_context(user_id, project_id, prompt, exclude_group_id=None, max_excerpts=5):
+    """
+    Cheap recall stage: find past excerpts matching the prompt and format them for the system prompt
+    """
+    try:
+        hits = search(
+            user_id,
+            prompt,
+            project_id=project_id,
+            limit=max_excerpts,
+            match_any=True,
+            exclude_group_id=exclude_group_id
+        )
+    except Exception as e:
+        print(f"Search recall failed: {e}")
+        return None
+
+    if not hits:
+        return None
+
+    context_text = ""
+    for hit in hits:
+        source = "Research" if hit['kind'] == KIND_RESEARCH else "Chat"
+        when = (hit['created_at'] or '')[:16]
+        context_text += f"- [{source}, {when}] {hit['snippet']}\n"
+    return context_text
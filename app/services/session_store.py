@@ -0,0 +1,42 @@
+from app.extensions import db, flask_session
+import os
+import tempfile
+
+# Server-side sessions: the cookie carries only an opaque random id and the session data
+# (file ids, current chat, login state, CSRF token) lives in a store, msgpack-encoded.
+#   sqlalchemy  - a table in the app database; works across hosts, expired rows purged periodically
+#   filesystem  - files under SESSION_FILE_DIR; shared by the workers on one host
+#   redis       - SESSION_REDIS_URL; shared, with native TTL
+#   cookie      - Flask's signed-cookie sessions (no store)
+SESSION_BACKENDS = ('sqlalchemy', 'filesystem', 'redis', 'cookie')
+
+
+def init_session_store(app):
+    """Install the configured SESSION_BACKEND as the app's session interface"""
+    backend = app.config.get('SESSION_BACKEND', 'sqlalchemy').lower()
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"Unknown SESSION_BACKEND {backend!r}, expected one of {', '.join(SESSION_BACKENDS)}")
+    if backend == 'cookie':
+        print("[Session] Using signed-cookie sessions")
+        return backend
+
+    if backend == 'sqlalchemy':
+        app.config['SESSION_TYPE'] = 'sqlalchemy'
+        app.config['SESSION_SQLALCHEMY'] = db
+    elif backend == 'filesystem':
+        from cachelib.file import FileSystemCache
+        directory = app.config.get('SESSION_FILE_DIR') or os.path.join(tempfile.gettempdir(), 'nomadchat_sessions')
+        app.config['SESSION_TYPE'] = 'cachelib'
+        app.config['SESSION_CACHELIB'] = FileSystemCache(
+            directory, threshold=app.config.get('SESSION_FILE_THRESHOLD', 10000), mode=0o600
+        )
+    elif backend == 'redis':
+        import redis
+        if not app.config.get('SESSION_REDIS_URL'):
+            raise ValueError("SESSION_BACKEND is redis but SESSION_REDIS_URL is not set")
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.from_url(app.config['SESSION_REDIS_URL'])
+
+    flask_session.init_app(app)
+    print(f"[Session] Using server-side sessions ({backend})")
+    return backend
@@ -0,0 +1,76 @@
+from flask import current_app
+from threading import Event, Lock
+import os
+import re
+import tempfile
+import time
+
+# Chat answers currently streaming, so POST /api/chat/<session>/stop can end one server-side.
+# The stop request may reach a different worker than the one streaming, so it also leaves a
+# marker file (CHAT_STOP_DIR) that streams look for every CHAT_STOP_POLL_SECONDS.
+
+_streams = {}
+_lock = Lock()
+
+
+class StreamHandle:
+    def __init__(self, key, marker_path):
+        self.key = key
+        self.marker_path = marker_path
+        self.stop_event = Event()
+        self.checked_at = 0.0
+
+    def stop_requested(self, poll_seconds):
+        if self.stop_event.is_set():
+            return True
+        now = time.monotonic()
+        if now - self.checked_at >= poll_seconds:
+            self.checked_at = now
+            if os.path.exists(self.marker_path):
+                self.stop_event.set()
+        return self.stop_event.is_set()
+
+
+def _marker_path(key):
+    directory = current_app.config.get('CHAT_STOP_DIR') or os.path.join(tempfile.gettempdir(), 'nomadchat_chat_stops')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, re.sub(r'[^A-Za-z0-9_-]', '_', key))
+
+
+def _remove_marker(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def register_stream(key):
+    """Track a starting stream; a stop left over from an earlier answer in the same chat is discarded"""
+    handle = StreamHandle(key, _marker_path(key))
+    _remove_marker(handle.marker_path)
+    with _lock:
+        _streams[key] = handle
+    return handle
+
+
+def unregister_stream(handle):
+    with _lock:
+        if _streams.get(handle.key) is handle:
+            del _streams[handle.key]
+    _remove_marker(handle.marker_path)
+
+
+def stop_requested(handle):
+    return handle.stop_requested(current_app.config.get('CHAT_STOP_POLL_SECONDS', 0.5))
+
+
+def request_stop(key):
+    """Ask the stream for `key` to end; returns True when it is running in this process"""
+    with _lock:
+        handle = _streams.get(key)
+    if handle:
+        handle.stop_event.set()
+        return True
+    with open(_marker_path(key), 'w') as f:
+        f.write(str(time.time()))
+    return False
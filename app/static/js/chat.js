@@ -3,12 +3,20 @@ const baseUrl = window.location.origin;
 let isFirstAIMessage = true;
 let currentAIMessage = '';
 let isProcessing = false;
+let streamController = null; // AbortController for the chat answer being streamed
+let streamSessionId = null; // Chat the server is streaming into, for /api/chat/<session_id>/stop
 let currentProject = null;
 let projectModal = null;
 let editingProjectId = null;
 let deleteModal = null;
 let chatToDelete = null;
 let allChats = []; // Store all chats for search functionality
+let chatListCursor = null; // /api/chats cursor for the next page (null when everything is loaded)
+let chatSearchResults = []; // Chats matching the sidebar search, from /api/chats?q=
+let chatSearchCursor = null; // Cursor for the next page of search results
+let chatSearchRequest = 0; // Bumped per search so a slow response can't replace a newer one
+let currentChatSessionId = null; // Chat on screen, sent with each message (null starts a new chat)
+let earlierMessagesCursor = null; // ?before= cursor for its older messages (null when all are shown)
 
 const allowedTypes = ['.txt', '.pdf', '.doc', '.docx', '.csv', '.xlsx'];
 const maxFileSize = window.MAX_FILE_SIZE_BYTES || (10 * 1024 * 1024); // 10MB default
@@ -737,6 +745,7 @@ async function sendMessage(customRequestData = null) {
         requestData = {
             ...customRequestData,
             project_id: currentProject,
+            session_id: currentChatSessionId,
             documentIds: documentStore.getActiveDocumentIds()
         };
     } else {
@@ -753,11 +762,15 @@ async function sendMessage(customRequestData = null) {
         requestData = {
             prompt: prompt,
             project_id: currentProject,
+            session_id: currentChatSessionId,
             documentIds: documentIds
         };
     }
 
     isProcessing = true;
+    streamController = new AbortController();
+    streamSessionId = null;
+    setStopButtonVisible(true);
     let processingIndicator = null;
     let buffer = '';
     let hasStartedResponse = false;
@@ -771,7 +784,8 @@ async function sendMessage(customRequestData = null) {
                 'X-CSRFToken': getCsrfToken()
             },
             credentials: 'same-origin',
-            body: JSON.stringify(requestData)
+            body: JSON.stringify(requestData),
+            signal: streamController.signal
         });
 
         const reader = response.body.getReader();
@@ -812,7 +826,10 @@ async function sendMessage(customRequestData = null) {
 
                 try {
                     const data = JSON.parse(line);
-                    if (data.error) {
+                    if (data.session_id) {
+                        streamSessionId = data.session_id;
+                        currentChatSessionId = data.session_id;
+                    } else if (data.error) {
                         if (processingIndicator) processingIndicator.remove();
                         addMessageToChatHistory('System', data.error);
                         break;
@@ -879,15 +896,50 @@ async function sendMessage(customRequestData = null) {
             }
         }
     } catch (error) {
-        console.error('Error:', error);
-        addMessageToChatHistory('System', error.message);
+        if (error.name === 'AbortError') {
+            // Stopped by the user; keep whatever was already shown
+            if (aiMessageElement && buffer) {
+                aiMessageElement.innerHTML = marked.parse(renderImageFileLinks(buffer));
+                addCopyButton(aiMessageElement, buffer);
+            }
+        } else {
+            console.error('Error:', error);
+            addMessageToChatHistory('System', error.message);
+        }
     } finally {
         isProcessing = false;
+        streamController = null;
+        setStopButtonVisible(false);
         if (processingIndicator) processingIndicator.remove();
         removeThinkingMessage();
     }
 }
 
+function setStopButtonVisible(visible) {
+    const stopButton = document.getElementById('stopButton');
+    if (stopButton) stopButton.style.display = visible ? '' : 'none';
+}
+
+// Stop the answer being streamed. The server ends the stream and saves the partial answer;
+// if it can't be reached, dropping the connection stops generation as well.
+async function stopStreaming() {
+    const controller = streamController;
+    if (!controller) return;
+    if (streamSessionId) {
+        try {
+            const response = await fetch(`${baseUrl}/api/chat/${streamSessionId}/stop`, {
+                method: 'POST',
+                headers: { 'X-CSRFToken': getCsrfToken() },
+                credentials: 'same-origin'
+            });
+            if (response.ok) return;
+        } catch (error) {
+            console.error('Error stopping chat:', error);
+        }
+    }
+    controller.abort();
+}
+
 // Project Management Functions
 async function loadProjects() {
     try {
@@ -1009,6 +1061,7 @@ async function switchProject(projectId) {
     }
 
     // Clear current chat and start a new one
+    currentChatSessionId = null;
     document.getElementById('chatHistory').innerHTML = '';
     
     // Clear document store and update UI
@@ -1089,6 +1142,7 @@ async function loadChatList() {
         if (chatList && data.chats) {
             // Store all chats for search functionality
             allChats = data.chats;
+            chatListCursor = data.next_cursor;
             
             if (data.chats.length === 0) {
                 chatList.innerHTML = '<div class="text-muted">No previous chats in this project</div>';
@@ -1101,6 +1155,29 @@ async function loadChatList() {
     }
 }
 
+// Append the next page of the chat list
+async function loadMoreChats() {
+    if (!currentProject) return;
+    const searchTerm = document.getElementById('chatSearchInput')?.value?.trim() || '';
+    if (searchTerm) {
+        await loadMoreSearchResults(searchTerm);
+        return;
+    }
+    if (!chatListCursor) return;
+
+    try {
+        const response = await fetch(`${baseUrl}/api/chats?project_id=${currentProject}&cursor=${encodeURIComponent(chatListCursor)}`);
+        if (!response.ok) throw new Error('Failed to load more chats');
+
+        const data = await response.json();
+        allChats = allChats.concat(data.chats || []);
+        chatListCursor = data.next_cursor;
+        renderChatList(allChats);
+    } catch (error) {
+        console.error('Error loading more chats:', error);
+    }
+}
+
 // Function to render chat list with search filtering
 function renderChatList(chatsToRender) {
     const chatList = document.getElementById('previousChats');
@@ -1111,31 +1188,15 @@ function renderChatList(chatsToRender) {
         return;
     }
     
-    // Separate pinned and unpinned chats
-    const pinnedChats = chatsToRender.filter(chat => chat.pinned);
-    const unpinnedChats = chatsToRender.filter(chat => !chat.pinned);
-    
-    // Sort unpinned chats by date (most recent first)
-    unpinnedChats.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
-    
-    // Take the most recent unpinned chats to fill remaining slots
-    const maxUnpinnedChats = 50 - pinnedChats.length;
-    const recentUnpinnedChats = unpinnedChats.slice(0, Math.max(0, maxUnpinnedChats));
-    
-    // Combine pinned chats with recent unpinned chats
-    const displayChats = [...pinnedChats, ...recentUnpinnedChats];
-    
-    // Sort by date for display (pinned chats will appear at top due to their age)
-    displayChats.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
-    
-    chatList.innerHTML = displayChats.map(chat => `
+    // The server sends pinned chats first, then the most recently updated
+    chatList.innerHTML = chatsToRender.map(chat => `
         <div class="chat-preview p-2 mb-2 border rounded">
             <div class="d-flex justify-content-between align-items-center">
                 <div class="chat-preview-content" onclick="loadChat('${chat.session_id}')">
                     <div class="chat-header d-flex align-items-center">
                         ${chat.pinned ? '<i class="bi bi-star-fill text-warning me-2"></i>' : ''}
                         <div class="small text-muted">
-                            ${getRelativeDateDescription(chat.created_at)}
+                            ${getRelativeDateDescription(chat.last_message_at || chat.created_at)}
                         </div>
                     </div>
                     <div class="chat-text">
@@ -1154,59 +1215,56 @@ function renderChatList(chatsToRender) {
         </div>
     `).join('');
     
-    // Add a note if we're limiting the display
-    if (allChats.length > displayChats.length) {
-        const hiddenCount = allChats.length - displayChats.length;
+    // Older chats (or search results) are fetched a page at a time
+    if (searchTerm ? chatSearchCursor : chatListCursor) {
         chatList.innerHTML += `
-            <div class="text-muted small text-center mt-2 p-2 border-top">
-                Showing ${displayChats.length} of ${allChats.length} chats (${hiddenCount} older chats hidden)
+            <div class="text-center mt-2 p-2 border-top">
+                <button class="btn btn-link btn-sm" onclick="loadMoreChats()">Load older chats</button>
             </div>
         `;
     }
 }
 
-// Function to search chats
+// Search every chat in the project on the server, not just the pages loaded so far
 async function searchChats(searchTerm) {
+    const request = ++chatSearchRequest;
     if (!searchTerm.trim()) {
-        // If search is empty, show all chats with normal limit
         renderChatList(allChats);
         return;
     }
-    
-    const searchLower = searchTerm.toLowerCase();
-    const matchingChats = [];
-    
-    // Search through all chats
-    for (const chat of allChats) {
-        // Check if search term matches preview (visible content)
-        if (chat.preview && chat.preview.toLowerCase().includes(searchLower)) {
-            matchingChats.push(chat);
-            continue;
-        }
-        
-        // If not found in preview, fetch full chat content to search
-        try {
-            const response = await fetch(`${baseUrl}/api/chats/${chat.session_id}`);
-            if (response.ok) {
-                const chatData = await response.json();
-                const chatHistory = chatData.chat_history || [];
-                
-                // Search through all messages in the chat
-                const hasMatch = chatHistory.some(message => 
-                    message.content && message.content.toLowerCase().includes(searchLower)
-                );
-                
-                if (hasMatch) {
-                    matchingChats.push(chat);
-                }
-            }
-        } catch (error) {
-            console.error(`Error fetching chat ${chat.session_id} for search:`, error);
-        }
+    if (!currentProject) return;
+
+    try {
+        const response = await fetch(`${baseUrl}/api/chats?project_id=${currentProject}&q=${encodeURIComponent(searchTerm.trim())}`);
+        if (!response.ok) throw new Error('Failed to search chats');
+
+        const data = await response.json();
+        if (request !== chatSearchRequest) return;
+        chatSearchResults = data.chats || [];
+        chatSearchCursor = data.next_cursor;
+        renderChatList(chatSearchResults);
+    } catch (error) {
+        console.error('Error searching chats:', error);
+    }
+}
+
+// Append the next page of search results
+async function loadMoreSearchResults(searchTerm) {
+    if (!chatSearchCursor) return;
+    const request = chatSearchRequest;
+
+    try {
+        const response = await fetch(`${baseUrl}/api/chats?project_id=${currentProject}&q=${encodeURIComponent(searchTerm)}&cursor=${encodeURIComponent(chatSearchCursor)}`);
+        if (!response.ok) throw new Error('Failed to load more search results');
+
+        const data = await response.json();
+        if (request !== chatSearchRequest) return;
+        chatSearchResults = chatSearchResults.concat(data.chats || []);
+        chatSearchCursor = data.next_cursor;
+        renderChatList(chatSearchResults);
+    } catch (error) {
+        console.error('Error loading more search results:', error);
     }
-    
-    // Render matching chats
-    renderChatList(matchingChats);
 }
 
 async function togglePin(sessionId, currentPinned) {
@@ -1253,8 +1311,8 @@ async function deleteChat(sessionId) {
 
         if (!response.ok) throw new Error('Failed to delete chat');
 
-        const data = await response.json();
-        if (data.was_current_chat) {
+        if (sessionId === currentChatSessionId) {
+            currentChatSessionId = null;
             document.getElementById('chatHistory').innerHTML = '';
         }
 
@@ -1322,12 +1380,57 @@ async function loadChat(sessionId) {
         for (const msg of chatHistory) {
             addMessageToChatHistory(msg.role === 'user' ? 'User' : 'AI', msg.content);
         }
+        currentChatSessionId = sessionId;
+        setEarlierMessagesCursor(data.next_cursor);
         scrollToBottom();
     } catch (error) {
         addMessageToChatHistory('System', 'Error loading chat: ' + error.message);
     }
 }
 
+// Only the newest messages come with loadChat; older pages are prepended on request
+function setEarlierMessagesCursor(cursor) {
+    earlierMessagesCursor = cursor;
+    const chatHistoryDiv = document.querySelector('#chatHistory .chat-history-messages');
+    if (!chatHistoryDiv) return;
+    chatHistoryDiv.querySelector('.load-earlier-messages')?.remove();
+    if (cursor) {
+        const wrapper = document.createElement('div');
+        wrapper.className = 'load-earlier-messages text-center mb-2';
+        wrapper.innerHTML = '<button class="btn btn-link btn-sm">Load earlier messages</button>';
+        wrapper.querySelector('button').addEventListener('click', loadEarlierMessages);
+        chatHistoryDiv.prepend(wrapper);
+    }
+}
+
+async function loadEarlierMessages() {
+    if (!currentChatSessionId || !earlierMessagesCursor) return;
+    try {
+        const response = await fetch(`${baseUrl}/api/chats/${currentChatSessionId}?before=${earlierMessagesCursor}`);
+        if (!response.ok) throw new Error('Failed to load earlier messages');
+        const data = await response.json();
+        const olderHistory = await enhanceChatHistoryWithResearch(data.chat_history || [], currentProject);
+
+        // Render the older page on its own, then put the messages already shown back after it
+        const chatHistoryDiv = document.querySelector('#chatHistory .chat-history-messages');
+        chatHistoryDiv.querySelector('.load-earlier-messages')?.remove();
+        const shown = Array.from(chatHistoryDiv.childNodes);
+        const previousHeight = chatHistoryDiv.scrollHeight;
+        const savedState = { isFirstAIMessage, currentAIMessage };
+        chatHistoryDiv.innerHTML = '';
+        for (const msg of olderHistory) {
+            addMessageToChatHistory(msg.role === 'user' ? 'User' : 'AI', msg.content, true);
+        }
+        shown.forEach(node => chatHistoryDiv.appendChild(node));
+        ({ isFirstAIMessage, currentAIMessage } = savedState);
+        setEarlierMessagesCursor(data.next_cursor);
+        // Keep the message the user was reading in place
+        chatHistoryDiv.scrollTop = chatHistoryDiv.scrollHeight - previousHeight;
+    } catch (error) {
+        console.error('Error loading earlier messages:', error);
+    }
+}
+
 // Event Handlers
 function handleFileUpload(event) {
     const fileInput = event.target;
@@ -1400,6 +1503,11 @@ function initializeEventListeners() {
         });
     }
 
+    const stopButton = document.getElementById('stopButton');
+    if (stopButton) {
+        stopButton.addEventListener('click', stopStreaming);
+    }
+
     const fileInput = document.getElementById('fileInput');
     if (fileInput) {
         fileInput.addEventListener('change', handleFileUpload);
@@ -1594,6 +1702,7 @@ async function clearChatAndUploads() {
 
         const data = await response.json();
         if (data.status === 'success') {
+            currentChatSessionId = null;
             clearChatHistoryMessages();
             document.getElementById('prompt').value = '';
 
@@ -0,0 +1,58 @@
+"""
+Compare two benchmark result files written by benchmarks/run_benchmark.py.
+
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+import argparse
+import json
+
+METRICS = ('throughput_rps', 'latency_p50', 'latency_p95', 'latency_p99', 'ttft_p50', 'ttft_p95', 'db_queries_per_request')
+
+
+def _change(before, after):
+    if before is None or after is None:
+        return '-'
+    if not before:
+        return 'n/a'
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def compare(before, after):
+    for worker_class in sorted(set(before['results']) | set(after['results'])):
+        old = before['results'].get(worker_class)
+        new = after['results'].get(worker_class)
+        print(f"\n=== {worker_class} ===")
+        if not old or not new:
+            print("  only present in one run")
+            continue
+        print(f"  overall throughput: {old['throughput_rps']} -> {new['throughput_rps']} req/s ({_change(old['throughput_rps'], new['throughput_rps'])})")
+        for operation in sorted(set(old['operations']) | set(new['operations'])):
+            old_op = old['operations'].get(operation, {})
+            new_op = new['operations'].get(operation, {})
+            print(f"  {operation}")
+            for metric in METRICS:
+                a, b = old_op.get(metric), new_op.get(metric)
+                if a is None and b is None:
+                    continue
+                print(f"    {metric:<24} {str(a):>10} -> {str(b):<10} {_change(a, b)}")
+        old_rss = max((w['peak_rss_kb'] or 0 for w in old['workers']), default=0)
+        new_rss = max((w['peak_rss_kb'] or 0 for w in new['workers']), default=0)
+        print(f"  peak worker rss: {old_rss} -> {new_rss} kB ({_change(old_rss, new_rss)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs")
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"before: {before.get('git_commit')} {before.get('started_at')}")
+    print(f"after:  {after.get('git_commit')} {after.get('started_at')}")
+    compare(before, after)
+
+
+if __name__ == '__main__':
+    main()
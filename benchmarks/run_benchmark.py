@@ -0,0 +1,380 @@
+"""
+End-to-end load test: seeds a database, starts the mock LLM provider and gunicorn, and drives
+/api/chat, /api/chats, /api/upload, /api/documents and /api/research at a fixed concurrency,
+once per gunicorn worker class.
+
+    python -m benchmarks.run_benchmark --worker-classes sync,gthread --concurrency 16 --duration 60
+
+Reports throughput, p50/p95/p99 latency, chat time-to-first-token, database queries per request
+and RSS per worker, and writes everything to benchmarks/results/<timestamp>.json. Compare two runs
+with benchmarks/compare.py.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+DEFAULT_MIX = 'chat=4,chats=3,documents=2,upload=1,research=1'
+
+# Worker classes that need an extra package installed
+WORKER_CLASS_MODULES = {'gevent': 'gevent', 'eventlet': 'eventlet'}
+
+# Operation name -> server endpoint as reported by benchmarks/wsgi.py
+OPERATION_ENDPOINTS = {
+    'chat': 'POST /api/chat',
+    'chats': 'GET /api/chats',
+    'documents': 'GET /api/documents',
+    'upload': 'POST /api/upload',
+    'research': 'POST /api/research',
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(pct / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+    return round(ordered[index], 4)
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATION_ENDPOINTS:
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class VirtualUser:
+    """One logged-in browser session issuing requests against the app"""
+
+    def __init__(self, base_url, username, password, project_ids, rng):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.project_ids = project_ids
+        self.rng = rng
+        self.http = requests.Session()
+
+    def login(self):
+        page = self.http.get(f'{self.base_url}/admin/login')
+        form = {'username': self.username, 'password': self.password}
+        token = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', page.text)
+        if token:
+            form['csrf_token'] = token.group(1)
+        response = self.http.post(f'{self.base_url}/admin/login', data=form, allow_redirects=False)
+        if response.status_code != 302:
+            raise RuntimeError(f"Login failed for {self.username}: HTTP {response.status_code}")
+
+    def run(self, operation):
+        """Perform one operation; returns (status, seconds, time_to_first_byte_or_None, bytes)"""
+        project_id = self.rng.choice(self.project_ids)
+        started = time.perf_counter()
+        ttfb = None
+        if operation == 'chat':
+            if self.rng.random() < 0.3:
+                self.http.post(f'{self.base_url}/api/new_chat', json={'project_id': project_id})
+            response = self.http.post(f'{self.base_url}/api/chat', stream=True, json={
+                'prompt': f"How should I plan the {self.rng.choice(['edit', 'shoot', 'budget', 'pitch'])} for this film?",
+                'project_id': project_id,
+            })
+            size = 0
+            for chunk in response.iter_content(chunk_size=None):
+                # The stream opens with a {"session_id": ...} line; time to the first answer text
+                if ttfb is None and b'"chunk"' in chunk:
+                    ttfb = time.perf_counter() - started
+                size += len(chunk)
+            response.close()
+        elif operation == 'chats':
+            response = self.http.get(f'{self.base_url}/api/chats', params={'project_id': project_id})
+            size = len(response.content)
+        elif operation == 'documents':
+            response = self.http.get(f'{self.base_url}/api/documents', params={'project_id': project_id})
+            size = len(response.content)
+        elif operation == 'upload':
+            content = ('Synthetic benchmark upload. ' * self.rng.randint(20, 400)).encode('utf-8')
+            name = f'upload-{self.username}-{self.rng.randint(0, 10 ** 9)}.txt'
+            response = self.http.post(f'{self.base_url}/api/upload', data={'project_id': project_id},
+                                      files={'file': (name, content, 'text/plain')})
+            size = len(response.content)
+        else:
+            response = self.http.post(f'{self.base_url}/api/research', json={
+                'topic': f"history of {self.rng.choice(['jazz', 'rail', 'whaling', 'radio'])}",
+                'project_id': project_id,
+            })
+            size = len(response.content)
+        return response.status_code, time.perf_counter() - started, ttfb, size
+
+
+def drive_load(users, mix, concurrency, duration, warmup, seed):
+    """Run `concurrency` loops of weighted-random operations; only samples after warmup are kept"""
+    samples = []
+    samples_lock = threading.Lock()
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    def loop(index):
+        user = users[index % len(users)]
+        rng = random.Random(seed + index)
+        while time.monotonic() < stop_at:
+            operation = rng.choices(names, weights)[0]
+            issued = time.monotonic()
+            try:
+                status, seconds, ttfb, size = user.run(operation)
+            except requests.RequestException as e:
+                status, seconds, ttfb, size = f'error: {type(e).__name__}', time.monotonic() - issued, None, 0
+            if issued >= measure_from:
+                with samples_lock:
+                    samples.append({'operation': operation, 'status': status, 'seconds': seconds, 'ttfb': ttfb, 'bytes': size})
+
+    threads = [threading.Thread(target=loop, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def summarize(samples, duration, server_stats):
+    operations = {}
+    for name in sorted({s['operation'] for s in samples}):
+        rows = [s for s in samples if s['operation'] == name]
+        ok = [s for s in rows if isinstance(s['status'], int) and s['status'] < 400]
+        latencies = [s['seconds'] for s in ok]
+        ttfbs = [s['ttfb'] for s in ok if s['ttfb'] is not None]
+        statuses = {}
+        for s in rows:
+            statuses[str(s['status'])] = statuses.get(str(s['status']), 0) + 1
+        endpoint = server_stats['endpoints'].get(OPERATION_ENDPOINTS[name], {})
+        operations[name] = {
+            'requests': len(rows),
+            'errors': len(rows) - len(ok),
+            'statuses': statuses,
+            'throughput_rps': round(len(ok) / duration, 3),
+            'latency_p50': percentile(latencies, 50),
+            'latency_p95': percentile(latencies, 95),
+            'latency_p99': percentile(latencies, 99),
+            'ttft_p50': percentile(ttfbs, 50),
+            'ttft_p95': percentile(ttfbs, 95),
+            'ttft_p99': percentile(ttfbs, 99),
+            'db_queries_per_request': round(endpoint['queries'] / endpoint['requests'], 2) if endpoint.get('requests') else None,
+            'db_queries_max': endpoint.get('max_queries'),
+        }
+    ok_total = sum(op['requests'] - op['errors'] for op in operations.values())
+    return {
+        'throughput_rps': round(ok_total / duration, 3),
+        'requests': len(samples),
+        'errors': sum(op['errors'] for op in operations.values()),
+        'operations': operations,
+    }
+
+
+def collect_server_stats(stats_dir):
+    """Merge the per-worker files written by benchmarks/wsgi.py"""
+    merged = {'endpoints': {}, 'workers': []}
+    for name in sorted(os.listdir(stats_dir)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(stats_dir, name)) as f:
+            worker = json.load(f)
+        merged['workers'].append({
+            'pid': worker.get('pid'),
+            'requests': worker.get('requests'),
+            'rss_kb': worker.get('rss_kb'),
+            'peak_rss_kb': worker.get('peak_rss_kb'),
+        })
+        for endpoint, entry in worker['endpoints'].items():
+            total = merged['endpoints'].setdefault(endpoint, {'requests': 0, 'queries': 0, 'max_queries': 0})
+            total['requests'] += entry['requests']
+            total['queries'] += entry['queries']
+            total['max_queries'] = max(total['max_queries'], entry['max_queries'])
+    return merged
+
+
+def run_worker_class(worker_class, args, env, manifest):
+    stats_dir = tempfile.mkdtemp(prefix=f'bench-{worker_class}-')
+    command = [
+        sys.executable, '-m', 'gunicorn', 'benchmarks.wsgi:app',
+        '--bind', f'127.0.0.1:{args.port}',
+        '--workers', str(args.workers),
+        '--worker-class', worker_class,
+        '--timeout', '120',
+    ]
+    if worker_class == 'gthread':
+        command += ['--threads', str(args.threads)]
+    if worker_class in WORKER_CLASS_MODULES:
+        command += ['--worker-connections', str(args.worker_connections)]
+    log_path = os.path.join(RESULTS_DIR, f'gunicorn-{worker_class}.log')
+    print(f"[Bench] Starting gunicorn ({worker_class}, {args.workers} workers), log: {log_path}")
+    with open(log_path, 'w') as log:
+        # Fresh rate limit buckets per worker class, so one run doesn't start with another's spent capacity
+        server_env = dict(env, BENCH_STATS_DIR=stats_dir, RATE_LIMIT_STATE_FILE=os.path.join(stats_dir, 'rate_limits.state'))
+        server = subprocess.Popen(command, cwd=ROOT, env=server_env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not wait_for_port(args.port, timeout=60):
+            raise RuntimeError(f"gunicorn ({worker_class}) did not start, see {log_path}")
+
+        base_url = f'http://127.0.0.1:{args.port}'
+        users = []
+        for i, entry in enumerate(manifest['users'][:max(args.concurrency, 1)]):
+            user = VirtualUser(base_url, entry['username'], manifest['password'], entry['project_ids'], random.Random(args.seed + i))
+            user.login()
+            users.append(user)
+
+        print(f"[Bench] Driving {args.concurrency} concurrent users for {args.duration}s (+{args.warmup}s warmup)")
+        samples = drive_load(users, parse_mix(args.mix), args.concurrency, args.duration, args.warmup, args.seed)
+        time.sleep(1.5)  # let workers flush their final stats
+        server_stats = collect_server_stats(stats_dir)
+        result = summarize(samples, args.duration, server_stats)
+        result['workers'] = server_stats['workers']
+        result['db_queries_by_endpoint'] = server_stats['endpoints']
+        return result
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        shutil.rmtree(stats_dir, ignore_errors=True)
+
+
+def print_summary(worker_class, result):
+    print(f"\n=== {worker_class}: {result['throughput_rps']} req/s, {result['errors']} errors ===")
+    print(f"{'operation':<10} {'reqs':>6} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'ttft50':>8} {'queries':>8}")
+    for name, op in result['operations'].items():
+        cells = [op['latency_p50'], op['latency_p95'], op['latency_p99'], op['ttft_p50'], op['db_queries_per_request']]
+        cells = ['-' if value is None else value for value in cells]
+        print(f"{name:<10} {op['requests']:>6} {op['errors']:>5} {op['throughput_rps']:>8} "
+              f"{cells[0]:>8} {cells[1]:>8} {cells[2]:>8} {cells[3]:>8} {cells[4]:>8}")
+    for worker in result['workers']:
+        print(f"worker {worker['pid']}: rss {worker['rss_kb']} kB, peak {worker['peak_rss_kb']} kB, {worker['requests']} requests")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the app against the mock LLM provider")
+    parser.add_argument('--worker-classes', default='sync,gthread')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help="Threads per gthread worker")
+    parser.add_argument('--worker-connections', type=int, default=100, help="For gevent/eventlet workers")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Weighted operations (default {DEFAULT_MIX})")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--database-url', help="Use an existing, already seeded database (with --manifest)")
+    parser.add_argument('--manifest', help="Seed manifest for --database-url")
+    parser.add_argument('--seed-users', type=int, default=20)
+    parser.add_argument('--seed-sessions', type=int, default=5000)
+    parser.add_argument('--seed-documents', type=int, default=2000)
+    parser.add_argument('--mock-port', type=int, default=8765)
+    parser.add_argument('--mock-ttft', type=float, default=0.4)
+    parser.add_argument('--mock-tps', type=float, default=60)
+    parser.add_argument('--mock-tokens', type=int, default=150)
+    parser.add_argument('--output', help="Result file (default benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='bench-')
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_KEY': 'bench', 'CLAUDE_API_KEY': 'bench', 'PERPLEXITY_API_KEY': 'bench',
+        'OPENAI_BASE_URL': f'http://127.0.0.1:{args.mock_port}/v1',
+        'ANTHROPIC_BASE_URL': f'http://127.0.0.1:{args.mock_port}',
+        'PERPLEXITY_BASE_URL': f'http://127.0.0.1:{args.mock_port}',
+        'CHAT_PROVIDERS': 'openai,anthropic',
+        'PYTHONPATH': ROOT,
+    })
+
+    if args.database_url:
+        if not args.manifest:
+            raise SystemExit("--database-url needs the --manifest written when it was seeded")
+        env['DATABASE_URL'] = args.database_url
+        manifest_path = args.manifest
+    else:
+        env['DATABASE_URL'] = 'sqlite:///' + os.path.join(work_dir, 'bench.db')
+        manifest_path = os.path.join(work_dir, 'seed_manifest.json')
+        subprocess.check_call([
+            sys.executable, '-m', 'benchmarks.seed_data', '--manifest', manifest_path,
+            '--users', str(max(args.seed_users, args.concurrency)), '--sessions', str(args.seed_sessions),
+            '--documents', str(args.seed_documents), '--seed', str(args.seed),
+        ], cwd=ROOT, env=env)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'scripts', 'mock_llm_server.py'), '--port', str(args.mock_port),
+        '--ttft', str(args.mock_ttft), '--tps', str(args.mock_tps), '--tokens', str(args.mock_tokens),
+    ], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    results = {}
+    try:
+        if not wait_for_port(args.mock_port):
+            raise RuntimeError("Mock LLM server did not start")
+        for worker_class in [w.strip() for w in args.worker_classes.split(',') if w.strip()]:
+            module = WORKER_CLASS_MODULES.get(worker_class)
+            if module and importlib.util.find_spec(module) is None:
+                print(f"[Bench] Skipping {worker_class}: {module} is not installed")
+                continue
+            results[worker_class] = run_worker_class(worker_class, args, env, manifest)
+            print_summary(worker_class, results[worker_class])
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+        if not args.database_url:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'started_at': datetime.utcnow().isoformat(),
+        'git_commit': git_commit(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'database_url')},
+        'dataset': manifest.get('counts'),
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, datetime.utcnow().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n[Bench] Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
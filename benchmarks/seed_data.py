@@ -0,0 +1,135 @@
+"""
+Seed a database with synthetic users, projects, chat sessions and documents for load tests.
+
+Usage: DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.seed_data --sessions 5000 --documents 2000
+
+Writes a manifest (usernames, password, project ids) that benchmarks/run_benchmark.py logs in with.
+The data is generated from a fixed seed, so the same arguments always produce the same dataset.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORDS = (
+    "documentary archive interview budget schedule grant festival edit rough cut subject "
+    "location permit release footage score colour grade distributor treatment pitch "
+    "broadcaster crew camera sound drone transcript timeline impact campaign outreach"
+).split()
+
+USERNAME_PREFIX = 'bench_user_'
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _paragraph(rng, sentences):
+    return ' '.join(_sentence(rng, rng.randint(8, 20)) for _ in range(sentences))
+
+
+def seed(users=20, projects_per_user=3, sessions=5000, messages_per_session=6, documents=2000,
+         password='bench-password', random_seed=42, batch_size=500):
+    """Insert the synthetic dataset and return the manifest describing it"""
+    from app import create_app
+    from app.extensions import db
+    from app.models.models import User, Project, ChatSession, Document
+
+    rng = random.Random(random_seed)
+    app = create_app()
+    with app.app_context():
+        if User.query.filter(User.username.like(f'{USERNAME_PREFIX}%')).first():
+            raise SystemExit("Benchmark users already exist in this database; seed a fresh one")
+
+        manifest = {'password': password, 'users': []}
+        projects = []
+        for i in range(users):
+            user = User(username=f'{USERNAME_PREFIX}{i}', role='user', is_active=True,
+                        firstname='Bench', lastname=str(i), signup_date=datetime.utcnow())
+            user.set_password(password)
+            db.session.add(user)
+            db.session.flush()
+            entry = {'username': user.username, 'user_id': user.id, 'project_ids': []}
+            for p in range(projects_per_user):
+                project = Project(user_id=user.id, name=f'Bench project {i}-{p}',
+                                  description=_sentence(rng, 12))
+                db.session.add(project)
+                db.session.flush()
+                entry['project_ids'].append(project.id)
+                projects.append((user.id, project.id))
+            manifest['users'].append(entry)
+        db.session.commit()
+        print(f"[Seed] {users} users, {len(projects)} projects")
+
+        start = datetime.utcnow() - timedelta(days=180)
+        for n in range(sessions):
+            user_id, project_id = rng.choice(projects)
+            created = start + timedelta(minutes=rng.randint(0, 180 * 24 * 60))
+            chat_session = ChatSession(
+                user_id=user_id, project_id=project_id, session_id=f'bench-{n:08d}',
+                model='gpt', chat_history='[]', created_at=created, updated_at=created,
+                pinned=rng.random() < 0.05
+            )
+            db.session.add(chat_session)
+            history = []
+            for m in range(messages_per_session):
+                role = 'user' if m % 2 == 0 else 'assistant'
+                content = _sentence(rng, 15) if role == 'user' else _paragraph(rng, rng.randint(3, 10))
+                message = chat_session.add_message(role, content, history)
+                message.created_at = created + timedelta(seconds=30 * m)
+                chat_session.last_message_at = message.created_at
+            if (n + 1) % batch_size == 0:
+                db.session.commit()
+                print(f"[Seed] {n + 1}/{sessions} chat sessions")
+        db.session.commit()
+
+        for n in range(documents):
+            user_id, project_id = rng.choice(projects)
+            content = '\n\n'.join(_paragraph(rng, 6) for _ in range(rng.randint(2, 20)))
+            db.session.add(Document(
+                user_id=user_id, project_id=project_id, filename=f'bench-{n:06d}.txt', file_type='txt',
+                file_size=len(content), content=content, content_preview=content[:500],
+                total_chunks=1, token_count=len(content) // 4, is_processed=True
+            ))
+            if (n + 1) % batch_size == 0:
+                db.session.commit()
+                print(f"[Seed] {n + 1}/{documents} documents")
+        db.session.commit()
+
+        manifest['counts'] = {
+            'users': users,
+            'projects': len(projects),
+            'chat_sessions': sessions,
+            'chat_messages': sessions * messages_per_session,
+            'documents': documents,
+        }
+        manifest['random_seed'] = random_seed
+        return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a synthetic benchmark dataset")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--projects-per-user', type=int, default=3)
+    parser.add_argument('--sessions', type=int, default=5000)
+    parser.add_argument('--messages-per-session', type=int, default=6)
+    parser.add_argument('--documents', type=int, default=2000)
+    parser.add_argument('--password', default='bench-password')
+    parser.add_argument('--seed', type=int, default=42, help="Random seed for the generated content")
+    parser.add_argument('--manifest', default=os.path.join(os.path.dirname(__file__), 'results', 'seed_manifest.json'))
+    args = parser.parse_args()
+
+    manifest = seed(args.users, args.projects_per_user, args.sessions, args.messages_per_session,
+                    args.documents, args.password, args.seed)
+    os.makedirs(os.path.dirname(os.path.abspath(args.manifest)), exist_ok=True)
+    with open(args.manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"[Seed] Manifest written to {args.manifest}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+WSGI entry point for load tests: the normal app wrapped in a middleware that counts database
+queries per request and records worker memory.
+
+    BENCH_STATS_DIR=/tmp/bench-stats gunicorn benchmarks.wsgi:app
+
+Each worker writes its numbers to BENCH_STATS_DIR/worker-<pid>.json, which
+benchmarks/run_benchmark.py collects after a run.
+"""
+import atexit
+import json
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from run import app as flask_app
+
+STATS_DIR = os.environ.get('BENCH_STATS_DIR')
+FLUSH_INTERVAL_SECONDS = 1.0
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {'requests': 0, 'queries': 0, 'endpoints': {}}
+_last_flush = 0.0
+
+# /api/chats/bench-00000012 and /api/documents/17 are reported as one endpoint each
+_ID_SEGMENT = re.compile(r'/(\d+|[0-9a-f]{8}-[0-9a-f-]{27}|bench-\d+)(?=/|$)')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'active', False):
+        _local.queries += 1
+
+
+def read_memory_kb():
+    """Current and peak resident set size of this process, from /proc (Linux only)"""
+    memory = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    name, value = line.split(':', 1)
+                    memory['rss_kb' if name == 'VmRSS' else 'peak_rss_kb'] = int(value.split()[0])
+    except OSError:
+        pass
+    return memory
+
+
+def _record(endpoint, queries, elapsed):
+    with _lock:
+        _stats['requests'] += 1
+        _stats['queries'] += queries
+        entry = _stats['endpoints'].setdefault(endpoint, {'requests': 0, 'queries': 0, 'max_queries': 0, 'seconds': 0.0})
+        entry['requests'] += 1
+        entry['queries'] += queries
+        entry['max_queries'] = max(entry['max_queries'], queries)
+        entry['seconds'] += elapsed
+    _flush()
+
+
+def _flush(force=False):
+    global _last_flush
+    if not STATS_DIR:
+        return
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_flush < FLUSH_INTERVAL_SECONDS:
+            return
+        _last_flush = now
+        snapshot = json.loads(json.dumps(_stats))
+    snapshot.update(read_memory_kb())
+    snapshot['pid'] = os.getpid()
+    path = os.path.join(STATS_DIR, f'worker-{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
+
+
+class _ClosingBody:
+    """Response body that records the request once the (possibly streamed) body is finished"""
+
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.on_close()
+
+
+class QueryCountingMiddleware:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        endpoint = f"{environ.get('REQUEST_METHOD')} {_ID_SEGMENT.sub('/{id}', environ.get('PATH_INFO', ''))}"
+        started = time.perf_counter()
+        _local.active = True
+        _local.queries = 0
+
+        def finish():
+            _local.active = False
+            _record(endpoint, _local.queries, time.perf_counter() - started)
+
+        try:
+            body = self.wsgi_app(environ, start_response)
+        except Exception:
+            finish()
+            raise
+        return _ClosingBody(body, finish)
+
+
+if STATS_DIR:
+    os.makedirs(STATS_DIR, exist_ok=True)
+    atexit.register(_flush, True)
+
+app = QueryCountingMiddleware(flask_app)
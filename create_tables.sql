@@ -2,13 +2,21 @@
 -- PostgreSQL script to create all tables
 
 -- Drop existing tables if they exist (be careful with this in production!)
+DROP TABLE IF EXISTS nomadchat_daily_activity CASCADE;
+DROP TABLE IF EXISTS nomadchat_sessions CASCADE;
+DROP TABLE IF EXISTS nomadchat_schema_migrations CASCADE;
 DROP TABLE IF EXISTS nomadchat_research_session CASCADE;
 DROP TABLE IF EXISTS nomadchat_user_survey CASCADE;
 DROP TABLE IF EXISTS nomadchat_user_agreement CASCADE;
+DROP TABLE IF EXISTS nomadchat_assistant_thread CASCADE;
+DROP TABLE IF EXISTS nomadchat_memory_batch CASCADE;
+DROP TABLE IF EXISTS nomadchat_memory_lock CASCADE;
+DROP TABLE IF EXISTS nomadchat_project_activity CASCADE;
 DROP TABLE IF EXISTS nomadchat_project_memory CASCADE;
 DROP TABLE IF EXISTS nomadchat_user_chat_memory CASCADE;
 DROP TABLE IF EXISTS nomadchat_document_chunks CASCADE;
 DROP TABLE IF EXISTS nomadchat_documents CASCADE;
+DROP TABLE IF EXISTS nomadchat_chat_message CASCADE;
 DROP TABLE IF EXISTS nomadchat_chatsession CASCADE;
 DROP TABLE IF EXISTS nomadchat_project CASCADE;
 DROP TABLE IF EXISTS nomadchat_login_record CASCADE;
@@ -94,7 +102,22 @@ CREATE TABLE nomadchat_chatsession (
     chat_history TEXT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    pinned BOOLEAN DEFAULT FALSE
+    pinned BOOLEAN DEFAULT FALSE,
+    preview VARCHAR(120),
+    message_count INTEGER DEFAULT 0,
+    last_message_at TIMESTAMP
+);
+
+-- Create ChatMessage table (one row per message, mirrors chat_history)
+CREATE TABLE nomadchat_chat_message (
+    id SERIAL PRIMARY KEY,
+    chat_session_id INTEGER NOT NULL REFERENCES nomadchat_chatsession(id) ON DELETE CASCADE,
+    project_id INTEGER NOT NULL REFERENCES nomadchat_project(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES nomadchat_users(id) ON DELETE CASCADE,
+    role VARCHAR(20) NOT NULL,
+    content TEXT NOT NULL,
+    content_length INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Create Document table
@@ -146,6 +169,47 @@ CREATE TABLE nomadchat_project_memory (
     last_chat_count INTEGER DEFAULT 0
 );
 
+-- Create ProjectActivity table (write-time counters since the last memory build)
+CREATE TABLE nomadchat_project_activity (
+    id SERIAL PRIMARY KEY,
+    project_id INTEGER NOT NULL UNIQUE REFERENCES nomadchat_project(id) ON DELETE CASCADE,
+    new_sessions INTEGER NOT NULL DEFAULT 0,
+    new_messages INTEGER NOT NULL DEFAULT 0,
+    new_documents INTEGER NOT NULL DEFAULT 0,
+    new_tokens INTEGER NOT NULL DEFAULT 0,
+    last_memory_build TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create MemoryLock table (single-flight fallback where advisory locks are unavailable)
+CREATE TABLE nomadchat_memory_lock (
+    lock_key VARCHAR(100) PRIMARY KEY,
+    owner VARCHAR(64) NOT NULL,
+    acquired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- Create AssistantThread table (chat session -> Assistants API thread, plus a pool of unassigned threads)
+CREATE TABLE nomadchat_assistant_thread (
+    id SERIAL PRIMARY KEY,
+    thread_id VARCHAR(100) NOT NULL UNIQUE,
+    chat_session_id INTEGER UNIQUE REFERENCES nomadchat_chatsession(id) ON DELETE CASCADE,
+    synced_messages INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP
+);
+
+-- Create MemoryBatch table (offline user-memory summarization batches)
+CREATE TABLE nomadchat_memory_batch (
+    id SERIAL PRIMARY KEY,
+    batch_id VARCHAR(100) NOT NULL UNIQUE,
+    status VARCHAR(30) NOT NULL,
+    request_count INTEGER DEFAULT 0,
+    user_ids TEXT NOT NULL DEFAULT '[]',
+    submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP
+);
+
 -- Create UserAgreement table
 CREATE TABLE nomadchat_user_agreement (
     id SERIAL PRIMARY KEY,
@@ -182,15 +246,51 @@ CREATE TABLE nomadchat_research_session (
     perplexity_response TEXT
 );
 
+-- Create SchemaMigration table (versions applied from app/migrations)
+CREATE TABLE nomadchat_schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Daily activity rollups for the admin dashboard (organization_id 0: no organization)
+CREATE TABLE nomadchat_daily_activity (
+    id SERIAL PRIMARY KEY,
+    day DATE NOT NULL,
+    organization_id INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    messages INTEGER NOT NULL DEFAULT 0,
+    logins INTEGER NOT NULL DEFAULT 0,
+    uploads INTEGER NOT NULL DEFAULT 0,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_daily_activity_day_org UNIQUE (day, organization_id)
+);
+
+-- Server-side Flask sessions (Flask-Session, SESSION_BACKEND=sqlalchemy)
+CREATE TABLE nomadchat_sessions (
+    id SERIAL PRIMARY KEY,
+    session_id VARCHAR(255) UNIQUE,
+    data BYTEA,
+    expiry TIMESTAMP
+);
+
 -- Create additional indexes for performance
 CREATE INDEX ix_chatsession_user_id ON nomadchat_chatsession (user_id);
 CREATE INDEX ix_chatsession_project_id ON nomadchat_chatsession (project_id);
 CREATE INDEX ix_chatsession_session_id ON nomadchat_chatsession (session_id);
 CREATE INDEX ix_chatsession_created_at ON nomadchat_chatsession (created_at);
+CREATE INDEX ix_chatsession_user_session_project ON nomadchat_chatsession (user_id, session_id, project_id);
+CREATE INDEX ix_chatsession_user_project_list ON nomadchat_chatsession (user_id, project_id, pinned, updated_at, id);
+CREATE INDEX ix_chat_message_project_created ON nomadchat_chat_message (project_id, created_at);
+CREATE INDEX ix_chat_message_user_created ON nomadchat_chat_message (user_id, created_at);
+CREATE INDEX ix_chat_message_session_message ON nomadchat_chat_message (chat_session_id, id);
+CREATE INDEX ix_login_record_user_login_time ON nomadchat_login_record (user_id, login_time);
 
 CREATE INDEX ix_documents_user_id ON nomadchat_documents (user_id);
 CREATE INDEX ix_documents_project_id ON nomadchat_documents (project_id);
 CREATE INDEX ix_documents_filename ON nomadchat_documents (filename);
+CREATE INDEX ix_documents_user_project_created ON nomadchat_documents (user_id, project_id, created_at);
 
 CREATE INDEX ix_document_chunks_document_id ON nomadchat_document_chunks (document_id);
 CREATE INDEX ix_document_chunks_chunk_number ON nomadchat_document_chunks (chunk_number);
@@ -200,6 +300,8 @@ CREATE INDEX ix_project_name ON nomadchat_project (name);
 
 CREATE INDEX ix_api_log_user_id ON nomadchat_api_log (user_id);
 CREATE INDEX ix_api_log_timestamp ON nomadchat_api_log (timestamp);
+CREATE INDEX ix_api_log_user_timestamp ON nomadchat_api_log (user_id, timestamp);
+CREATE INDEX ix_research_session_user_project_created ON nomadchat_research_session (user_id, project_id, created_at);
 
 CREATE INDEX ix_login_record_user_id ON nomadchat_login_record (user_id);
 CREATE INDEX ix_login_record_login_time ON nomadchat_login_record (login_time);
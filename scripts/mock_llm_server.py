@@ -0,0 +1,654 @@
+"""
+Local stand-in for the LLM and research APIs the app calls, for offline benchmarking and load tests.
+
+Serves, on one port:
+  OpenAI      POST /v1/chat/completions (streaming and not), Assistants threads/messages/runs
+              (streaming and polled), files and batches
+  Anthropic   POST /v1/messages (streaming and not)
+  Perplexity  POST /chat/completions
+
+Point the app at it with:
+  OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+  ANTHROPIC_BASE_URL=http://127.0.0.1:8765
+  PERPLEXITY_BASE_URL=http://127.0.0.1:8765
+
+Responses are synthetic text, timed by --ttft (seconds to first token) and --tps (tokens/second).
+--error-rate and --rate-limit-rate inject 500s and 429s. --record DIR proxies stateless calls
+(chat completions, Anthropic messages, Perplexity) to the real APIs and saves the responses;
+--replay DIR serves them back with their original timing, falling back to synthetic text for
+requests that were never recorded.
+
+Settings can be changed while running: POST /_mock/config with a JSON object of settings,
+and GET /_mock/stats returns request counts.
+
+Usage: python scripts/mock_llm_server.py --port 8765 --ttft 0.4 --tps 60
+"""
+from email.parser import BytesParser
+from email import policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from urllib.parse import urlparse
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+WORDS = (
+    "the documentary follows a small crew through three seasons of production, balancing access, "
+    "ethics and budget while the story shifts under them; interviews, archival footage and "
+    "observational scenes are cut together into a structure that keeps the audience close to the "
+    "subjects without losing the larger argument about memory, place and change"
+).split()
+
+UPSTREAMS = {
+    'openai': 'https://api.openai.com',
+    'anthropic': 'https://api.anthropic.com',
+    'perplexity': 'https://api.perplexity.ai',
+}
+
+settings = {
+    'ttft': 0.3,
+    'ttft_jitter': 0.1,
+    'tps': 50.0,
+    'tokens': 150,
+    'error_rate': 0.0,
+    'rate_limit_rate': 0.0,
+    'retry_after': 2,
+    'record_dir': None,
+    'replay_dir': None,
+    'replay_speed': 1.0,
+}
+
+state_lock = Lock()
+threads = {}  # thread_id -> list of messages (oldest first)
+runs = {}  # run_id -> run dict plus timing
+files = {}  # file_id -> (filename, bytes)
+batches = {}
+stats = {'requests': 0, 'errors_injected': 0, 'rate_limited': 0, 'replayed': 0, 'recorded': 0, 'by_path': {}}
+
+
+def new_id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def synthetic_tokens(prompt_text, max_tokens=None):
+    """Deterministic per prompt, so repeated benchmark runs stream the same text"""
+    count = settings['tokens']
+    if max_tokens:
+        count = min(count, max_tokens)
+    rng = random.Random(hashlib.sha256(prompt_text.encode('utf-8', 'ignore')).hexdigest())
+    words = [rng.choice(WORDS) for _ in range(max(count, 1))]
+    words[0] = words[0].capitalize()
+    return [word + ' ' for word in words[:-1]] + [words[-1] + '.']
+
+
+def count_tokens(text):
+    return max(len(text) // 4, 1)
+
+
+def first_token_delay():
+    return max(settings['ttft'] + random.uniform(-settings['ttft_jitter'], settings['ttft_jitter']), 0)
+
+
+def token_interval():
+    return 1.0 / settings['tps'] if settings['tps'] else 0
+
+
+def messages_text(messages):
+    parts = []
+    for message in messages or []:
+        content = message.get('content')
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(part.get('text', '') for part in content if isinstance(part, dict))
+    return '\n'.join(parts)
+
+
+def record_key(path, body):
+    return hashlib.sha256((path + '\n' + json.dumps(body, sort_keys=True)).encode('utf-8')).hexdigest()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- plumbing -------------------------------------------------------------------------
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _json_body(self, raw):
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+    def _write_event(self, data, event=None):
+        lines = ''
+        if event:
+            lines += f"event: {event}\n"
+        lines += f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+        self.wfile.write(lines.encode('utf-8'))
+        self.wfile.flush()
+
+    def _inject_failure(self):
+        """Returns True if an injected error response was sent"""
+        roll = random.random()
+        if roll < settings['rate_limit_rate']:
+            with state_lock:
+                stats['rate_limited'] += 1
+            self._send_json(429, {'error': {'message': 'Rate limit reached (mock)', 'type': 'rate_limit_error',
+                                            'code': 'rate_limit_exceeded'}},
+                            {'retry-after': str(settings['retry_after'])})
+            return True
+        if roll < settings['rate_limit_rate'] + settings['error_rate']:
+            with state_lock:
+                stats['errors_injected'] += 1
+            self._send_json(500, {'error': {'message': 'Internal error (mock)', 'type': 'api_error'}})
+            return True
+        return False
+
+    def _count(self, path):
+        label = re.sub(r'/(thread|run|msg|file|batch)_[0-9a-f]+', r'/{\1}', path)
+        with state_lock:
+            stats['requests'] += 1
+            stats['by_path'][label] = stats['by_path'].get(label, 0) + 1
+
+    # --- routing ---------------------------------------------------------------------------
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        self._count(f"GET {path}")
+        if path == '/_mock/stats':
+            with state_lock:
+                return self._send_json(200, stats)
+        if path == '/_mock/config':
+            return self._send_json(200, settings)
+        match = re.fullmatch(r'/v1/threads/([^/]+)/messages', path)
+        if match:
+            return self._list_messages(match.group(1))
+        match = re.fullmatch(r'/v1/threads/([^/]+)/runs/([^/]+)', path)
+        if match:
+            return self._retrieve_run(match.group(1), match.group(2))
+        match = re.fullmatch(r'/v1/files/([^/]+)/content', path)
+        if match:
+            return self._file_content(match.group(1))
+        match = re.fullmatch(r'/v1/batches/([^/]+)', path)
+        if match:
+            return self._retrieve_batch(match.group(1))
+        if path == '/models' or path == '/v1/models':
+            return self._send_json(200, {'object': 'list', 'data': [{'id': 'mock-model', 'object': 'model'}]})
+        self._send_json(404, {'error': {'message': f'Unknown path {path}'}})
+
+    def do_DELETE(self):
+        path = urlparse(self.path).path
+        self._count(f"DELETE {path}")
+        match = re.fullmatch(r'/v1/(files|threads)/([^/]+)', path)
+        if match:
+            with state_lock:
+                (files if match.group(1) == 'files' else threads).pop(match.group(2), None)
+            return self._send_json(200, {'id': match.group(2), 'deleted': True})
+        self._send_json(404, {'error': {'message': f'Unknown path {path}'}})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        self._count(f"POST {path}")
+        raw = self._read_body()
+
+        if path == '/_mock/config':
+            updates = self._json_body(raw)
+            settings.update({name: value for name, value in updates.items() if name in settings})
+            return self._send_json(200, settings)
+        if path == '/v1/files':
+            return self._create_file(raw)
+
+        body = self._json_body(raw)
+        if path == '/v1/threads':
+            return self._create_thread(body)
+        match = re.fullmatch(r'/v1/threads/([^/]+)/messages', path)
+        if match:
+            return self._create_message(match.group(1), body)
+        match = re.fullmatch(r'/v1/threads/([^/]+)/runs/([^/]+)/cancel', path)
+        if match:
+            return self._cancel_run(match.group(1), match.group(2))
+        if path == '/v1/batches':
+            return self._create_batch(body)
+
+        if self._inject_failure():
+            return
+        match = re.fullmatch(r'/v1/threads/([^/]+)/runs', path)
+        if match:
+            return self._create_run(match.group(1), body)
+        if path in ('/v1/chat/completions', '/v1/messages', '/chat/completions'):
+            provider = {'/v1/chat/completions': 'openai', '/v1/messages': 'anthropic'}.get(path, 'perplexity')
+            if settings['replay_dir'] and self._replay(path, body):
+                return
+            if settings['record_dir']:
+                return self._record(provider, path, raw, body)
+            if provider == 'openai':
+                return self._chat_completion(body)
+            if provider == 'anthropic':
+                return self._anthropic_message(body)
+            return self._perplexity(body)
+        self._send_json(404, {'error': {'message': f'Unknown path {path}'}})
+
+    # --- OpenAI chat completions ---------------------------------------------------------------
+
+    def _chat_completion(self, body):
+        prompt = messages_text(body.get('messages'))
+        tokens = synthetic_tokens(prompt, body.get('max_tokens') or body.get('max_completion_tokens'))
+        model = body.get('model', 'mock-model')
+        completion_id = new_id('chatcmpl')
+        usage = {'prompt_tokens': count_tokens(prompt), 'completion_tokens': len(tokens),
+                 'total_tokens': count_tokens(prompt) + len(tokens)}
+
+        time.sleep(first_token_delay())
+        if not body.get('stream'):
+            time.sleep(token_interval() * len(tokens))
+            return self._send_json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                             'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+
+        self._start_stream()
+        base = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model}
+        for index, token in enumerate(tokens):
+            delta = {'content': token}
+            if index == 0:
+                delta['role'] = 'assistant'
+            self._write_event(dict(base, choices=[{'index': 0, 'delta': delta, 'finish_reason': None}]))
+            time.sleep(token_interval())
+        self._write_event(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+        if (body.get('stream_options') or {}).get('include_usage'):
+            self._write_event(dict(base, choices=[], usage=usage))
+        self._write_event('[DONE]')
+
+    # --- Anthropic messages --------------------------------------------------------------------
+
+    def _anthropic_message(self, body):
+        system = body.get('system')
+        system_text = system if isinstance(system, str) else messages_text([{'content': system}]) if system else ''
+        prompt = system_text + '\n' + messages_text(body.get('messages'))
+        tokens = synthetic_tokens(prompt, body.get('max_tokens'))
+        model = body.get('model', 'mock-model')
+        message_id = new_id('msg')
+        input_tokens = count_tokens(prompt)
+
+        time.sleep(first_token_delay())
+        if not body.get('stream'):
+            time.sleep(token_interval() * len(tokens))
+            return self._send_json(200, {
+                'id': message_id, 'type': 'message', 'role': 'assistant', 'model': model,
+                'content': [{'type': 'text', 'text': ''.join(tokens)}],
+                'stop_reason': 'end_turn', 'stop_sequence': None,
+                'usage': {'input_tokens': input_tokens, 'output_tokens': len(tokens)},
+            })
+
+        self._start_stream()
+        self._write_event({'type': 'message_start', 'message': {
+            'id': message_id, 'type': 'message', 'role': 'assistant', 'model': model, 'content': [],
+            'stop_reason': None, 'stop_sequence': None,
+            'usage': {'input_tokens': input_tokens, 'output_tokens': 1},
+        }}, 'message_start')
+        self._write_event({'type': 'content_block_start', 'index': 0,
+                           'content_block': {'type': 'text', 'text': ''}}, 'content_block_start')
+        for token in tokens:
+            self._write_event({'type': 'content_block_delta', 'index': 0,
+                               'delta': {'type': 'text_delta', 'text': token}}, 'content_block_delta')
+            time.sleep(token_interval())
+        self._write_event({'type': 'content_block_stop', 'index': 0}, 'content_block_stop')
+        self._write_event({'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                           'usage': {'output_tokens': len(tokens)}}, 'message_delta')
+        self._write_event({'type': 'message_stop'}, 'message_stop')
+
+    # --- Perplexity --------------------------------------------------------------------------------
+
+    def _perplexity(self, body):
+        prompt = messages_text(body.get('messages'))
+        tokens = synthetic_tokens(prompt)
+        time.sleep(first_token_delay() + token_interval() * len(tokens))
+        self._send_json(200, {
+            'id': new_id('pplx'), 'model': body.get('model', 'sonar'), 'created': int(time.time()),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                         'finish_reason': 'stop'}],
+            'citations': ['https://example.org/source-1', 'https://example.org/source-2'],
+            'usage': {'prompt_tokens': count_tokens(prompt), 'completion_tokens': len(tokens)},
+        })
+
+    # --- Assistants --------------------------------------------------------------------------------
+
+    def _create_thread(self, body):
+        thread_id = new_id('thread')
+        with state_lock:
+            threads[thread_id] = []
+        for message in body.get('messages') or []:
+            self._add_message(thread_id, message.get('role', 'user'), message.get('content', ''))
+        self._send_json(200, {'id': thread_id, 'object': 'thread', 'created_at': int(time.time()), 'metadata': {}})
+
+    def _add_message(self, thread_id, role, content, run_id=None):
+        if isinstance(content, list):
+            content = messages_text([{'content': content}])
+        message = {
+            'id': new_id('msg'), 'object': 'thread.message', 'created_at': int(time.time()),
+            'thread_id': thread_id, 'role': role, 'run_id': run_id, 'assistant_id': None,
+            'attachments': [], 'metadata': {}, 'status': 'completed',
+            'content': [{'type': 'text', 'text': {'value': content, 'annotations': []}}],
+        }
+        with state_lock:
+            threads.setdefault(thread_id, []).append(message)
+        return message
+
+    def _create_message(self, thread_id, body):
+        message = self._add_message(thread_id, body.get('role', 'user'), body.get('content', ''))
+        self._send_json(200, message)
+
+    def _list_messages(self, thread_id):
+        query = dict(part.split('=', 1) for part in urlparse(self.path).query.split('&') if '=' in part)
+        self._complete_due_runs(thread_id)
+        with state_lock:
+            data = list(reversed(threads.get(thread_id, [])))
+        if query.get('run_id'):
+            data = [message for message in data if message['run_id'] == query['run_id']]
+        if query.get('limit'):
+            data = data[:int(query['limit'])]
+        self._send_json(200, {'object': 'list', 'data': data, 'has_more': False,
+                              'first_id': data[0]['id'] if data else None,
+                              'last_id': data[-1]['id'] if data else None})
+
+    def _run_object(self, run):
+        return {name: value for name, value in run.items() if not name.startswith('_')}
+
+    def _create_run(self, thread_id, body):
+        for message in body.get('additional_messages') or []:
+            self._add_message(thread_id, message.get('role', 'user'), message.get('content', ''))
+        with state_lock:
+            history = list(threads.get(thread_id, []))
+        prompt = '\n'.join(message['content'][0]['text']['value'] for message in history)
+        tokens = synthetic_tokens(prompt)
+        now = time.time()
+        run = {
+            'id': new_id('run'), 'object': 'thread.run', 'created_at': int(now), 'thread_id': thread_id,
+            'assistant_id': body.get('assistant_id'), 'status': 'queued', 'model': body.get('model') or 'mock-model',
+            'instructions': '', 'tools': [], 'metadata': {}, 'temperature': body.get('temperature'),
+            'last_error': None, 'usage': None, 'required_action': None,
+            '_tokens': tokens, '_prompt_tokens': count_tokens(prompt),
+            '_done_at': now + first_token_delay() + token_interval() * len(tokens),
+        }
+        with state_lock:
+            runs[run['id']] = run
+
+        if not body.get('stream'):
+            return self._send_json(200, self._run_object(run))
+
+        self._start_stream()
+        run['status'] = 'in_progress'
+        self._write_event(self._run_object(dict(run, status='queued')), 'thread.run.created')
+        self._write_event(self._run_object(run), 'thread.run.in_progress')
+        time.sleep(first_token_delay())
+        message_id = new_id('msg')
+        for token in tokens:
+            if run['status'] == 'cancelling':
+                break
+            self._write_event({'id': message_id, 'object': 'thread.message.delta', 'delta': {
+                'content': [{'index': 0, 'type': 'text', 'text': {'value': token, 'annotations': []}}]
+            }}, 'thread.message.delta')
+            time.sleep(token_interval())
+        if run['status'] == 'cancelling':
+            run['status'] = 'cancelled'
+            self._write_event(self._run_object(run), 'thread.run.cancelled')
+        else:
+            self._finish_run(run)
+            self._write_event(self._run_object(run), 'thread.run.completed')
+        self._write_event('[DONE]', 'done')
+
+    def _finish_run(self, run):
+        run['status'] = 'completed'
+        run['completed_at'] = int(time.time())
+        run['usage'] = {'prompt_tokens': run['_prompt_tokens'], 'completion_tokens': len(run['_tokens']),
+                        'total_tokens': run['_prompt_tokens'] + len(run['_tokens'])}
+        self._add_message(run['thread_id'], 'assistant', ''.join(run['_tokens']), run_id=run['id'])
+
+    def _complete_due_runs(self, thread_id):
+        now = time.time()
+        with state_lock:
+            due = [run for run in runs.values() if run['thread_id'] == thread_id
+                   and run['status'] in ('queued', 'in_progress') and run['_done_at'] <= now]
+        for run in due:
+            self._finish_run(run)
+
+    def _retrieve_run(self, thread_id, run_id):
+        run = runs.get(run_id)
+        if not run:
+            return self._send_json(404, {'error': {'message': f'No run {run_id}'}})
+        if run['status'] == 'queued':
+            run['status'] = 'in_progress'
+        self._complete_due_runs(thread_id)
+        if run['status'] == 'cancelling':
+            run['status'] = 'cancelled'
+        self._send_json(200, self._run_object(run))
+
+    def _cancel_run(self, thread_id, run_id):
+        run = runs.get(run_id)
+        if not run:
+            return self._send_json(404, {'error': {'message': f'No run {run_id}'}})
+        if run['status'] in ('queued', 'in_progress'):
+            run['status'] = 'cancelling'
+        self._send_json(200, self._run_object(run))
+
+    # --- Files and batches -----------------------------------------------------------------------
+
+    def _create_file(self, raw):
+        message = BytesParser(policy=policy.default).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode('utf-8') + raw
+        )
+        filename, content, purpose = 'upload', b'', 'assistants'
+        for part in message.iter_parts() if message.is_multipart() else []:
+            name = part.get_param('name', header='content-disposition')
+            if name == 'file':
+                filename = part.get_filename() or filename
+                content = part.get_payload(decode=True) or b''
+            elif name == 'purpose':
+                purpose = (part.get_payload(decode=True) or b'').decode('utf-8')
+        file_id = new_id('file')
+        with state_lock:
+            files[file_id] = (filename, content)
+        self._send_json(200, {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                              'filename': filename, 'purpose': purpose, 'status': 'processed'})
+
+    def _file_content(self, file_id):
+        if file_id not in files:
+            return self._send_json(404, {'error': {'message': f'No file {file_id}'}})
+        content = files[file_id][1]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _create_batch(self, body):
+        input_file = files.get(body.get('input_file_id'))
+        if not input_file:
+            return self._send_json(404, {'error': {'message': 'Input file not found'}})
+        output = []
+        for line in input_file[1].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            request_body = item.get('body') or {}
+            prompt = messages_text(request_body.get('messages'))
+            tokens = synthetic_tokens(prompt, request_body.get('max_tokens'))
+            output.append(json.dumps({
+                'id': new_id('batch_req'), 'custom_id': item.get('custom_id'), 'error': None,
+                'response': {'status_code': 200, 'request_id': new_id('req'), 'body': {
+                    'id': new_id('chatcmpl'), 'object': 'chat.completion', 'model': request_body.get('model'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                                 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': count_tokens(prompt), 'completion_tokens': len(tokens)},
+                }},
+            }))
+        output_id = new_id('file')
+        batch_id = new_id('batch')
+        with state_lock:
+            files[output_id] = ('batch_output.jsonl', '\n'.join(output).encode('utf-8'))
+            batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': body.get('endpoint'),
+                'input_file_id': body.get('input_file_id'), 'completion_window': body.get('completion_window'),
+                'status': 'validating', 'output_file_id': None, 'error_file_id': None,
+                'created_at': int(time.time()), '_output_file_id': output_id,
+                'request_counts': {'total': len(output), 'completed': len(output), 'failed': 0},
+            }
+        self._send_json(200, self._run_object(batches[batch_id]))
+
+    def _retrieve_batch(self, batch_id):
+        batch = batches.get(batch_id)
+        if not batch:
+            return self._send_json(404, {'error': {'message': f'No batch {batch_id}'}})
+        # Validated on the first poll, done on the next
+        if batch['status'] == 'validating':
+            batch['status'] = 'in_progress'
+        elif batch['status'] == 'in_progress':
+            batch['status'] = 'completed'
+            batch['output_file_id'] = batch['_output_file_id']
+            batch['completed_at'] = int(time.time())
+        self._send_json(200, self._run_object(batch))
+
+    # --- Record / replay -------------------------------------------------------------------------
+
+    def _replay(self, path, body):
+        recording_path = os.path.join(settings['replay_dir'], record_key(path, body) + '.json')
+        if not os.path.exists(recording_path):
+            return False
+        with open(recording_path) as f:
+            recording = json.load(f)
+        with state_lock:
+            stats['replayed'] += 1
+
+        if not recording.get('stream'):
+            time.sleep(recording.get('elapsed', 0) / settings['replay_speed'])
+            data = recording['body'].encode('utf-8')
+            self.send_response(recording['status'])
+            self.send_header('Content-Type', recording.get('content_type', 'application/json'))
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return True
+
+        self._start_stream()
+        started = time.monotonic()
+        for offset, line in recording['chunks']:
+            delay = offset / settings['replay_speed'] - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+            self.wfile.write(line.encode('utf-8'))
+            self.wfile.flush()
+        return True
+
+    def _record(self, provider, path, raw, body):
+        upstream = UPSTREAMS[provider] + path
+        headers = {name: value for name, value in self.headers.items()
+                   if name.lower() in ('authorization', 'x-api-key', 'anthropic-version', 'anthropic-beta',
+                                       'content-type', 'openai-beta')}
+        request = urllib.request.Request(upstream, data=raw, headers=headers, method='POST')
+        started = time.monotonic()
+        try:
+            response = urllib.request.urlopen(request, timeout=300)
+            status = response.status
+        except urllib.error.HTTPError as e:
+            response, status = e, e.code
+
+        recording = {'path': path, 'status': status, 'stream': bool(body.get('stream')) and status == 200,
+                     'content_type': response.headers.get('Content-Type', 'application/json')}
+        if recording['stream']:
+            self._start_stream()
+            chunks = []
+            for line in response:
+                text = line.decode('utf-8')
+                chunks.append([time.monotonic() - started, text])
+                self.wfile.write(line)
+                self.wfile.flush()
+            recording['chunks'] = chunks
+        else:
+            data = response.read()
+            recording['elapsed'] = time.monotonic() - started
+            recording['body'] = data.decode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', recording['content_type'])
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        if status == 200:
+            os.makedirs(settings['record_dir'], exist_ok=True)
+            with open(os.path.join(settings['record_dir'], record_key(path, body) + '.json'), 'w') as f:
+                json.dump(recording, f)
+            with state_lock:
+                stats['recorded'] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock for the OpenAI, Anthropic and Perplexity APIs")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ttft', type=float, default=settings['ttft'], help='Seconds before the first token')
+    parser.add_argument('--ttft-jitter', type=float, default=settings['ttft_jitter'])
+    parser.add_argument('--tps', type=float, default=settings['tps'], help='Tokens per second while streaming')
+    parser.add_argument('--tokens', type=int, default=settings['tokens'], help='Tokens per synthetic response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=settings['retry_after'])
+    parser.add_argument('--record', dest='record_dir', help='Proxy to the real APIs and save responses here')
+    parser.add_argument('--replay', dest='replay_dir', help='Serve responses saved with --record')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='Replay timing multiplier')
+    args = parser.parse_args()
+
+    settings.update({
+        'ttft': args.ttft, 'ttft_jitter': args.ttft_jitter, 'tps': args.tps, 'tokens': args.tokens,
+        'error_rate': args.error_rate, 'rate_limit_rate': args.rate_limit_rate, 'retry_after': args.retry_after,
+        'record_dir': args.record_dir, 'replay_dir': args.replay_dir, 'replay_speed': args.replay_speed,
+    })
+
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    print(f"Mock LLM server on http://{args.host}:{args.port} "
+          f"(ttft {args.ttft}s, {args.tps} tokens/s, errors {args.error_rate}, 429s {args.rate_limit_rate})")
+    print(f"  OPENAI_BASE_URL=http://{args.host}:{args.port}/v1")
+    print(f"  ANTHROPIC_BASE_URL=http://{args.host}:{args.port}")
+    print(f"  PERPLEXITY_BASE_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
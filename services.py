@@ -6,7 +6,8 @@ import textract
 from openai import OpenAI
 import time
 from flask import current_app
-from app.models.models import db, APILog
+from app.services.api_log_service import log_api_usage, openai_usage, anthropic_usage, gemini_usage
+from app.services.assistant_thread_service import AssistantRunTimeout, cancel_run, poll_run, run_reply_text
 from anthropic import Anthropic
 import google.generativeai as genai
 import tiktoken
@@ -57,9 +58,77 @@ def extract_file_contents(file_paths):
 
 
 
+def _stream_run(client, thread_id, assistant_id, temperature, deadline, timings):
+    """
+    Create the run with stream=True and read the answer from the event stream.
+    Returns (run, text). Once the run exists, a dropped or failed stream is finished by
+    polling that same run; a new run can't be created while it is active on the thread.
+    Errors before the run exists propagate with run None, so the caller can create one.
+    """
+    run = None
+    run_id = None
+    parts = []
+    stream = client.with_options(timeout=max(deadline - time.monotonic(), 1)).beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        temperature=temperature,
+        stream=True
+    )
+    try:
+        for event in stream:
+            if event.event == 'thread.run.created':
+                run_id = event.data.id
+                timings['run_created'] = time.monotonic()
+                print(f"\nRun created: {run_id}")
+            elif event.event == 'thread.message.delta':
+                if 'first_token' not in timings:
+                    timings['first_token'] = time.monotonic()
+                for block in event.data.delta.content or []:
+                    if block.type == 'text' and block.text and block.text.value:
+                        parts.append(block.text.value)
+            elif event.event == 'thread.run.requires_action':
+                # This assistant has no tools wired up; a run waiting on one would never finish
+                print(f"\nRun requires action, cancelling: {event.data.id}")
+                cancel_run(client, thread_id, event.data.id)
+                run = event.data
+                break
+            elif event.event in ('thread.run.completed', 'thread.run.failed', 'thread.run.cancelled',
+                                 'thread.run.expired', 'thread.run.incomplete'):
+                run = event.data
+                break
+            elif event.event == 'error':
+                print(f"\nRun stream error: {event.data}")
+                break
+
+            if time.monotonic() > deadline:
+                if run_id:
+                    cancel_run(client, thread_id, run_id)
+                raise AssistantRunTimeout(f"Run did not finish within the deadline (run {run_id})")
+    except AssistantRunTimeout:
+        raise
+    except Exception as e:
+        if run_id is None:
+            raise
+        # Read timeout or dropped connection mid-run: the run carries on server-side
+        print(f"\nRun stream failed ({str(e)}), polling run {run_id}")
+    finally:
+        stream.close()
+
+    if run is None and run_id:
+        # Stream ended before the run did: finish by polling the same run
+        run = poll_run(client, thread_id, run_id, deadline)
+        parts = []
+    return run, ''.join(parts)
+
+
 def generate_openai_response(prompt, temperature, chat_history, file_contents, session, user_id):
     client = OpenAI(api_key=current_app.config['OPENAI_API_KEY'])
-    assistant_id = current_app.config['ASSISTANT_ID']
+    assistant_id = current_app.config.get('ASSISTANT_ID') or current_app.config['OPENAI_ASSISTANT_ID']
+    run_timeout = current_app.config.get('ASSISTANT_RUN_TIMEOUT_SECONDS', 120)
+    use_streaming = current_app.config.get('ASSISTANT_STREAMING', True)
+
+    timings = {'start': time.monotonic()}
+    deadline = timings['start'] + run_timeout
 
     try:
         # Retrieve or create thread_id
@@ -72,6 +141,7 @@ def generate_openai_response(prompt, temperature, chat_history, file_contents, s
         else:
             thread_id = session['openai_thread_id']
             print(f"\nUsing existing thread: {thread_id}")
+        timings['thread_ready'] = time.monotonic()
 
         print("\n--- OpenAI API Request ---")
         print(f"Assistant ID: {assistant_id}")
@@ -101,59 +171,87 @@ def generate_openai_response(prompt, temperature, chat_history, file_contents, s
             role="user",
             content=prompt
         )
+        timings['message_added'] = time.monotonic()
 
         print(f"\nMessage added to thread: {thread_id}")
 
-        try:
-            run = client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=assistant_id,
-                temperature=temperature
-            )
-            print(f"\nRun created: {run.id}")
-        except Exception as e:
-            print(f"\nError creating run: {str(e)}")
-            return str(e)
+        run_status = None
+        assistant_response = ""
+        if use_streaming:
+            try:
+                run_status, assistant_response = _stream_run(client, thread_id, assistant_id, temperature,
+                                                             deadline, timings)
+            except AssistantRunTimeout:
+                raise
+            except Exception as e:
+                # Only reached before a run was created; otherwise _stream_run polls that run
+                print(f"\nStreaming run could not start, falling back to polling: {str(e)}")
 
-        while True:
-            run_status = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
-            print(f"\nRun status: {run_status.status}")
-            if run_status.status == 'completed':
-                break
-            elif run_status.status == "failed":
-                print(f"Run failed: {run_status.last_error}")
-                break
-            time.sleep(2)
-
-        log_entry = APILog(
-            prompt=prompt,
-            completion_tokens=run_status.usage.completion_tokens,
-            prompt_tokens=run_status.usage.prompt_tokens,
-            cache_tokens=0 if session.get('documents_uploaded', False) else run_status.usage.prompt_tokens,  # New field
-            model=run_status.model,
-            thread_id=thread_id,
-        user_id=user_id
-        )
-        db.session.add(log_entry)
-        db.session.commit()
+        if run_status is None:
+            try:
+                run = client.beta.threads.runs.create(
+                    thread_id=thread_id,
+                    assistant_id=assistant_id,
+                    temperature=temperature
+                )
+                timings['run_created'] = time.monotonic()
+                print(f"\nRun created: {run.id}")
+            except Exception as e:
+                print(f"\nError creating run: {str(e)}")
+                return str(e)
+            run_status = poll_run(client, thread_id, run.id, deadline)
+
+        timings['run_finished'] = time.monotonic()
+        print(f"\nRun status: {run_status.status}")
+        if run_status.status != 'completed':
+            error = run_status.last_error.message if run_status.last_error else run_status.status
+            print(f"Run did not complete: {error}")
+            return f"The assistant run did not complete ({error})."
+
+        if run_status.usage:
+            log_api_usage(run_status.model, openai_usage(run_status.usage), prompt=prompt,
+                          thread_id=thread_id, user_id=user_id)
 
-        # Print the token usage
-        print(f"\nToken Usage: {run_status.usage}")
+            # Print the token usage
+            print(f"\nToken Usage: {run_status.usage}")
 
-        messages = client.beta.threads.messages.list(thread_id=thread_id)
-        assistant_response = messages.data[0].content[0].text.value
+        if not assistant_response:
+            assistant_response = run_reply_text(client, thread_id, run_status.id)
 
         print("\nAssistant Response (first 200 characters):")
         print(assistant_response[:200] + "...")
 
+        _print_run_timings(timings)
         print("\n--- End of OpenAI API Request ---\n")
 
         return assistant_response
 
+    except AssistantRunTimeout as e:
+        print(f"\nTimeout in generate_openai_response: {str(e)}")
+        _print_run_timings(timings)
+        return "The assistant took too long to respond. Please try again."
     except Exception as e:
         print(f"\nError in generate_openai_response: {str(e)}")
         return str(e)
 
+
+def _print_run_timings(timings):
+    """Print how long each phase of an Assistants request took"""
+    start = timings['start']
+    phases = [
+        ('thread', 'start', 'thread_ready'),
+        ('add message', 'thread_ready', 'message_added'),
+        ('create run', 'message_added', 'run_created'),
+        ('first token', 'run_created', 'first_token'),
+        ('run', 'run_created', 'run_finished'),
+    ]
+    parts = []
+    for label, begin, end in phases:
+        if begin in timings and end in timings:
+            parts.append(f"{label} {timings[end] - timings[begin]:.2f}s")
+    parts.append(f"total {time.monotonic() - start:.2f}s")
+    print(f"\nRun timings: {', '.join(parts)}")
+
 # Global variable to track if file contents have been sent
 file_contents_sent = False
 
@@ -265,31 +363,15 @@ def generate_claude_response(prompt, temperature, chat_history, file_contents, s
         print("\nAssistant Response (first 200 characters):")
         print(assistant_response[:200] + "...")
 
-        # Calculate and log the API usage
-        non_file_input_tokens = response.usage.input_tokens
-        total_input_tokens = non_file_input_tokens + (file_token_count if not file_contents_sent else 0)
-        cache_tokens = file_token_count if file_contents_sent else 0
+        # Log the API usage as reported by Anthropic (cache reads included in input tokens)
+        usage = anthropic_usage(response.usage)
 
         print(f"\nToken Usage:")
-        print(f"  Input tokens (excluding file contents): {non_file_input_tokens}")
-        print(f"  File content tokens: {file_token_count} ({'sent' if not file_contents_sent else 'cached'})")
-        print(f"  Total input tokens: {total_input_tokens}")
-        print(f"  Output tokens: {response.usage.output_tokens}")
-        print(f"  Cached tokens: {cache_tokens}")
-
-        # Log the API call
-        log_entry = APILog(
-            prompt=prompt,
-            completion_tokens=response.usage.output_tokens,
-            prompt_tokens=total_input_tokens,
-            cache_tokens=cache_tokens,
-            model=response.model,
-            thread_id=session_id,
-            user_id=user_id
-        )
+        print(f"  Total input tokens: {usage['prompt_tokens']}")
+        print(f"  Output tokens: {usage['completion_tokens']}")
+        print(f"  Cached tokens: {usage['cache_tokens']}")
 
-        db.session.add(log_entry)
-        db.session.commit()
+        log_api_usage(response.model, usage, prompt=prompt, thread_id=session_id, user_id=user_id)
 
         print("\n--- End of Claude API Request ---\n")
 
@@ -330,9 +412,6 @@ def generate_gemini_response(prompt, temperature, chat_history, file_contents, s
 
         file_token_count = count_tokens(file_contents) if file_contents else 0
 
-        # Calculate tokens for chat history
-        chat_history_tokens = sum(count_tokens(message['content']) for message in chat_history)
-
         if is_first_gemini_request and file_contents:
             file_instruction = ("The following content is from uploaded files. "
                                 "Use this information when responding to queries. "
@@ -390,36 +469,15 @@ def generate_gemini_response(prompt, temperature, chat_history, file_contents, s
         print("\nAssistant Response (first 200 characters):")
         print(assistant_response[:200] + "...")
 
-        # Calculate and log the API usage
-        prompt_tokens = count_tokens(prompt)
-        completion_tokens = count_tokens(assistant_response)
-
-        if is_first_gemini_request:
-            total_input_tokens = prompt_tokens + chat_history_tokens + file_token_count
-            cache_tokens = 0
-        else:
-            total_input_tokens = prompt_tokens + chat_history_tokens
-            cache_tokens = file_token_count if file_contents_sent else 0
-
-        print(f"\nEstimated Token Usage:")
-        print(f"  Input tokens (including chat history): {total_input_tokens}")
-        print(f"  Chat history tokens: {chat_history_tokens}")
-        print(f"  Current prompt tokens: {prompt_tokens}")
-        print(f"  Output tokens: {completion_tokens}")
-        print(f"  Cached tokens: {cache_tokens}")
-
-        log_entry = APILog(
-            prompt=prompt,
-            completion_tokens=completion_tokens,
-            prompt_tokens=total_input_tokens,
-            cache_tokens=cache_tokens,
-            model='gemini-1.5-pro',
-            thread_id=session_id,
-            user_id=user_id
-        )
+        # Log the API usage as reported by Gemini
+        usage = gemini_usage(getattr(response, 'usage_metadata', None))
+        if usage:
+            print(f"\nToken Usage:")
+            print(f"  Input tokens (including chat history): {usage['prompt_tokens']}")
+            print(f"  Output tokens: {usage['completion_tokens']}")
+            print(f"  Cached tokens: {usage['cache_tokens']}")
 
-        db.session.add(log_entry)
-        db.session.commit()
+        log_api_usage('gemini-1.5-pro', usage, prompt=prompt, thread_id=session_id, user_id=user_id)
 
         print(f"\nFile contents sent status at end: {file_contents_sent}")
         print("\n--- End of Google Gemini API Request ---\n")
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+# DATABASE_URL as the environment gave it, before the tests point the app elsewhere;
+# Postgres-only tests run against it and are skipped without it
+CONFIGURED_DATABASE_URL = os.environ.get('DATABASE_URL', '')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')  # Config refuses to load without one
+
+
+def make_app(monkeypatch, database_url):
+    from app import config, create_app
+
+    monkeypatch.setattr(config.Config, 'SQLALCHEMY_DATABASE_URI', database_url)
+    # Flask-Session defines its table on the shared metadata, which fails for a second app
+    monkeypatch.setattr(config.Config, 'SESSION_BACKEND', 'cookie')
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return app
+
+
+def _dispose(app):
+    from app.extensions import db
+
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The app on a fresh, fully migrated SQLite database"""
+    app = make_app(monkeypatch, f"sqlite:///{tmp_path / 'test.db'}")
+    yield app
+    _dispose(app)
+
+
+@pytest.fixture
+def postgres_app(monkeypatch):
+    """The app on the Postgres database named by DATABASE_URL"""
+    url = CONFIGURED_DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+    if not url.startswith('postgresql'):
+        pytest.skip('DATABASE_URL does not point at Postgres')
+    app = make_app(monkeypatch, url)
+    yield app
+    _dispose(app)
+
+
+
+
+
+@pytest.fixture
+def admin_client(app):
+    """Test client logged in as an admin user"""
+    from app.extensions import db
+    from app.models.models import User
+
+    with app.app_context():
+        admin = User(username='admin', role='admin', is_active=True)
+        admin.set_password('pw')
+        db.session.add(admin)
+        db.session.commit()
+    client = app.test_client()
+    response = client.post('/admin/login', data={'username': 'admin', 'password': 'pw'})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.models import LoginRecord, User
+from app.services import login_report_service
+from app.services.query_stats import count_queries
+
+LOGINS_PER_USER = 4
+
+
+def _seed_users(start, stop):
+    now = datetime.utcnow()
+    for i in range(start, stop):
+        user = User(username=f'user{i:04d}', role='user', is_active=True)
+        user.login_records = [LoginRecord(login_time=now - timedelta(hours=hour)) for hour in range(LOGINS_PER_USER)]
+        db.session.add(user)
+    db.session.commit()
+
+
+def _render_logins(client):
+    with count_queries() as stats:
+        response = client.get('/admin/logins')
+    assert response.status_code == 200
+    return stats, response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('window_functions', [True, False], ids=['window', 'fallback'])
+def test_login_report_query_count_does_not_grow_with_users(app, admin_client, monkeypatch, window_functions):
+    monkeypatch.setattr(login_report_service, 'supports_window_functions', lambda dialect: window_functions)
+    app.config['LOGIN_RECORDS_PAGE_SIZE'] = 100  # every seeded user on the one page
+    n = 5
+
+    with app.app_context():
+        _seed_users(0, n)
+    _render_logins(admin_client)  # warm-up: one-off queries don't count against the first render
+    small, small_page = _render_logins(admin_client)
+
+    with app.app_context():
+        _seed_users(n, 10 * n)
+    large, large_page = _render_logins(admin_client)
+
+    assert large.queries == small.queries, f"{small.summary()}\n---\n{large.summary()}"
+    assert f'user{n - 1:04d}' in small_page
+    assert f'user{10 * n - 1:04d}' in large_page
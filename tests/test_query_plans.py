@@ -0,0 +1,22 @@
+import pytest
+
+from app.migrations.query_plans import check_query_plans
+
+
+def _assert_plans_use_indexes(app):
+    with app.app_context():
+        results = check_query_plans()
+    assert results
+    for result in results:
+        plan = '\n'.join(result['plan'])
+        assert result['used_expected_index'], f"{result['name']}: expected {result['expected_index']}\n{plan}"
+        assert not result['problems'], f"{result['name']}: {result['problems']}\n{plan}"
+
+
+def test_hot_queries_use_their_indexes_on_sqlite(app):
+    _assert_plans_use_indexes(app)
+
+
+@pytest.mark.postgres
+def test_hot_queries_use_their_indexes_on_postgres(postgres_app):
+    _assert_plans_use_indexes(postgres_app)
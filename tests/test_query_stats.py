@@ -0,0 +1,61 @@
+import pytest
+
+from app.extensions import db
+from app.models.models import User
+from app.services.query_stats import assert_max_queries, count_queries, fingerprint
+
+
+def _add_users(count):
+    users = [User(username=f'user{i}', role='user', is_active=True) for i in range(count)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def test_fingerprint_collapses_literals_and_in_lists():
+    assert fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'o''k'") == \
+        fingerprint("SELECT * FROM t WHERE id IN (7, 8) AND name = 'x'") == \
+        "SELECT * FROM t WHERE id IN (?, ...) AND name = ?"
+
+
+def test_assert_max_queries_passes_within_limit(app):
+    with app.app_context():
+        user_ids = _add_users(3)
+        db.session.expire_all()
+        with assert_max_queries(1, repeat_threshold=2) as stats:
+            User.query.filter(User.id.in_(user_ids)).all()
+    assert stats.queries == 1
+
+
+def test_assert_max_queries_fails_over_limit(app):
+    with app.app_context():
+        user_ids = _add_users(3)
+        db.session.expire_all()
+        with pytest.raises(AssertionError, match='Expected at most 2 queries'):
+            with assert_max_queries(2):
+                for user_id in user_ids:
+                    db.session.get(User, user_id)
+
+
+def test_assert_max_queries_flags_repeated_statement(app):
+    with app.app_context():
+        user_ids = _add_users(6)
+        db.session.expire_all()
+        # Well under the query limit, but one lookup per user is an N+1
+        with pytest.raises(AssertionError, match=r'repeated 5\+ times'):
+            with assert_max_queries(100, repeat_threshold=5):
+                for user_id in user_ids:
+                    db.session.get(User, user_id)
+
+
+def test_count_queries_groups_by_fingerprint(app):
+    with app.app_context():
+        user_ids = _add_users(4)
+        db.session.expire_all()
+        with count_queries() as stats:
+            for user_id in user_ids:
+                db.session.get(User, user_id)
+            User.query.count()
+    assert stats.queries == 5
+    [(statement, count, seconds)] = stats.repeated(threshold=4)
+    assert count == 4 and 'FROM nomadchat_users' in statement